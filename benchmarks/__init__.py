@@ -0,0 +1 @@
+"""Benchmarks for the mock server hot paths."""
@@ -0,0 +1,159 @@
+"""Event-loop lag under concurrent admin writes and mock reads.
+
+Runs the same workload twice, once calling crud directly on the event loop
+and once through ``run_in_db_thread``, and prints how late a 5ms ticker
+fires. Every admin write also runs a query that sleeps, standing in for a
+slow Postgres round trip.
+
+Usage:
+    python -m benchmarks.event_loop_lag [--seconds 3] [--query-ms 20]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from mock_server import crud, helpers, models, schemas
+from mock_server.cache import mock_cache, URL_TAG
+from mock_server.database import Base, run_in_db_thread
+
+TICK = 0.005
+
+
+def make_session_factory(path):
+    """Creates a SQLite db with a ``slow_query`` function."""
+    engine = create_engine(
+        "sqlite:///" + path, connect_args={"check_same_thread": False, "timeout": 30}
+    )
+
+    @event.listens_for(engine, "connect")
+    def register(dbapi_connection, connection_record):
+        dbapi_connection.create_function(
+            "slow_query", 1, lambda ms: time.sleep(ms / 1000.0) or ms
+        )
+
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(models.Users(name="bench", password="", is_active=True, is_admin=True))
+    db.commit()
+    user_id = db.query(models.Users).first().id
+    db.close()
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine), user_id
+
+
+def admin_write(session_factory, user_id, counter, query_ms):
+    """Creates a mock and runs one slow query, like an admin request."""
+    db = session_factory()
+    try:
+        crud.CreateUrl(
+            db,
+            schemas.UrlCreate(
+                identifier="bench",
+                request_type="GET",
+                url="bench/{0}".format(counter),
+                response={"counter": counter},
+                headers={},
+                status_code=200,
+                latency=0,
+                is_active=True,
+            ),
+            user_id,
+        )
+        db.execute("SELECT slow_query({0})".format(query_ms))
+    finally:
+        db.close()
+
+
+async def run(mode, session_factory, user_id, seconds, query_ms, writers, readers):
+    """Runs the workload in one mode and measures the ticker lag."""
+    stop = time.monotonic() + seconds
+    lags = []
+    counts = {"writes": 0, "reads": 0}
+
+    async def ticker():
+        while time.monotonic() < stop:
+            expected = time.monotonic() + TICK
+            await asyncio.sleep(TICK)
+            lags.append(max(0.0, time.monotonic() - expected))
+
+    async def writer(index):
+        counter = index * 1000000
+        while time.monotonic() < stop:
+            counter += 1
+            if mode == "blocking":
+                admin_write(session_factory, user_id, counter, query_ms)
+                await asyncio.sleep(0)
+            else:
+                await run_in_db_thread(
+                    admin_write, session_factory, user_id, counter, query_ms
+                )
+            counts["writes"] += 1
+
+    async def reader():
+        db = session_factory()
+        try:
+            while time.monotonic() < stop:
+                mocks = await helpers.GetIdentifierMocks("bench", db, URL_TAG)
+                mocks.route_table.match("/bench/1", "GET")
+                counts["reads"] += 1
+                await asyncio.sleep(0)
+        finally:
+            db.close()
+
+    await asyncio.gather(
+        ticker(),
+        *[writer(index) for index in range(writers)],
+        *[reader() for _ in range(readers)],
+    )
+    lags.sort()
+    return {
+        "mode": mode,
+        "writes": counts["writes"],
+        "reads": counts["reads"],
+        "p50_ms": statistics.median(lags) * 1000,
+        "p99_ms": lags[int(len(lags) * 0.99) - 1] * 1000,
+        "max_ms": lags[-1] * 1000,
+    }
+
+
+def main():
+    """Runs both modes and prints the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--query-ms", type=int, default=20)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=50)
+    options = parser.parse_args()
+    row = "{mode:>9} {writes:>7} {reads:>9} {p50_ms:>9.2f} {p99_ms:>9.2f} {max_ms:>9.2f}"
+    print("{0:>9} {1:>7} {2:>9} {3:>9} {4:>9} {5:>9}".format(
+        "mode", "writes", "reads", "lag p50", "lag p99", "lag max"
+    ))
+    for mode in ("blocking", "threaded"):
+        handle, path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        try:
+            session_factory, user_id = make_session_factory(path)
+            mock_cache.invalidate()
+            result = asyncio.get_event_loop().run_until_complete(
+                run(
+                    mode,
+                    session_factory,
+                    user_id,
+                    options.seconds,
+                    options.query_ms,
+                    options.writers,
+                    options.readers,
+                )
+            )
+            print(row.format(**result))
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
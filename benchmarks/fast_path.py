@@ -0,0 +1,128 @@
+"""Requests per second of one worker serving mocked urls.
+
+Loads ``--mocks`` urls of one identifier into the in-memory cache, then
+sends the same mocked requests straight to the ASGI app of ``main``, with
+no server or network in between, so the numbers are the cost of the app
+on one core:
+
+    fastapi    the stack below the fast path, FastAPI routing, header
+               dependencies and ``Depends(get_db)``, as before
+    fast path  the app as deployed, mocks answered by ``FastPath``
+
+The mocks never touch the database, no connection is opened.
+
+Usage:
+    python -m benchmarks.fast_path [--requests 20000] [--mocks 200]
+"""
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+from main import app
+
+from mock_server.cache import mock_cache, URL_TAG
+from mock_server.fast_path import FastPath
+
+IDENTIFIER = "bench"
+
+
+def load_mocks(count):
+    """Puts count mocked urls of the identifier in the cache."""
+    rows = [
+        SimpleNamespace(
+            id=i,
+            identifier=IDENTIFIER,
+            request_type="GET",
+            url="/bench/{0}/items/{{id}}".format(i),
+            response='{"id": %d, "name": "item"}' % i,
+            payload="",
+            headers={},
+            status_code=200,
+            latency=0,
+            latency_spec=None,
+            is_active=True,
+            inactive_status_code=None,
+            inactive_response=None,
+            is_deleted=False,
+        )
+        for i in range(count)
+    ]
+    mock_cache.invalidate(URL_TAG, IDENTIFIER)
+    mock_cache.get(URL_TAG, IDENTIFIER, lambda: rows)
+
+
+def find_fast_path():
+    """Gets the FastPath middleware of the app and the middleware above it."""
+    parent = app.error_middleware
+    while not isinstance(parent.app, FastPath):
+        parent = parent.app
+    return parent, parent.app
+
+
+async def run(asgi_app, total, mocks):
+    """Sends total requests one after the other, checks every status."""
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    statuses = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    start = time.perf_counter()
+    for i in range(total):
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "scheme": "http",
+            "server": ("bench", 80),
+            "client": ("127.0.0.1", 5000),
+            "root_path": "",
+            "method": "GET",
+            "path": "/bench/{0}/items/{1}".format(i % mocks, i),
+            "raw_path": b"",
+            "query_string": b"",
+            "headers": [
+                (b"host", b"bench"),
+                (b"x-identifier-id", IDENTIFIER.encode()),
+                (b"accept", b"*/*"),
+                (b"user-agent", b"bench"),
+            ],
+        }
+        await asgi_app(scope, receive, send)
+    elapsed = time.perf_counter() - start
+    if set(statuses) != {200}:
+        raise RuntimeError("Unexpected statuses {0}".format(set(statuses)))
+    return elapsed
+
+
+async def main(total, mocks):
+    """Runs both stacks on the same mocks."""
+    load_mocks(mocks)
+    parent, fast_path = find_fast_path()
+    results = []
+    for name, below in (("fastapi", fast_path.app), ("fast path", fast_path)):
+        parent.app = below
+        try:
+            await run(app, min(total, 1000), mocks)
+            elapsed = await run(app, total, mocks)
+        finally:
+            parent.app = fast_path
+        results.append(total / elapsed)
+        print(
+            "{0:<10} req/s={1:<8.0f} per request={2:.1f}us".format(
+                name, total / elapsed, elapsed / total * 1e6
+            )
+        )
+    print("speedup    {0:.1f}x".format(results[1] / results[0]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--mocks", type=int, default=200)
+    options = parser.parse_args()
+    asyncio.run(main(options.requests, options.mocks))
@@ -0,0 +1,85 @@
+"""Memory and time of projecting a large upstream JSON on a response_key.
+
+Builds a document of about ``--mb`` megabytes whose projected value sits
+after most of the data, then feeds it in 64 KiB chunks, as the upstream
+client delivers it, to two strategies:
+
+    buffered   join the chunks, json.loads, walk the path, json.dumps
+    streaming  JsonProjector, which skips non matching subtrees
+
+and prints the peak memory allocated while projecting (tracemalloc) and
+the time taken.
+
+Usage:
+    python -m benchmarks.projection_memory [--mb 20] [--chunk-kb 64]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from mock_server.projection import JsonProjector, parse_path
+
+RESPONSE_KEY = "data.summary"
+
+
+def make_document(megabytes):
+    """Builds the upstream body, records first and the summary last."""
+    record = {"id": 0, "name": "record", "tags": ["a", "b"], "text": "x" * 200}
+    size = len(json.dumps(record))
+    records = [dict(record, id=i) for i in range(megabytes * 1024 * 1024 // size)]
+    document = {"data": {"records": records, "summary": {"count": len(records)}}}
+    return json.dumps(document).encode("utf-8")
+
+
+def chunks(body, chunk_size):
+    """Yields the body in chunks, like an upstream response."""
+    for start in range(0, len(body), chunk_size):
+        yield body[start:start + chunk_size]
+
+
+def buffered(body, chunk_size):
+    """Reads the whole body and parses it."""
+    value = json.loads(b"".join(chunks(body, chunk_size)))
+    for segment in parse_path(RESPONSE_KEY):
+        value = value[segment]
+    return json.dumps(value).encode("utf-8")
+
+
+def streaming(body, chunk_size):
+    """Projects the body as it arrives."""
+    projector = JsonProjector(parse_path(RESPONSE_KEY))
+    for chunk in chunks(body, chunk_size):
+        if projector.feed(chunk):
+            break
+    return projector.close()
+
+
+def measure(name, project, body, chunk_size):
+    """Prints the peak allocation and the time of one strategy.
+
+    Time is measured on a separate run, tracemalloc slows allocations down.
+    """
+    start = time.perf_counter()
+    value = project(body, chunk_size)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    project(body, chunk_size)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(
+        "{0:<10} peak={1:>9.2f}MB time={2:>7.1f}ms value={3}".format(
+            name, peak / 1024.0 / 1024.0, elapsed * 1000, value.decode("utf-8")
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=int, default=20)
+    parser.add_argument("--chunk-kb", type=int, default=64)
+    options = parser.parse_args()
+    body = make_document(options.mb)
+    print("document {0:.1f}MB".format(len(body) / 1024.0 / 1024.0))
+    for name, project in (("buffered", buffered), ("streaming", streaming)):
+        measure(name, project, body, options.chunk_kb * 1024)
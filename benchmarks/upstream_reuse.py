@@ -0,0 +1,114 @@
+"""Connection reuse of the pooled upstream client.
+
+Starts a local stand-in upstream that counts the TCP connections it
+accepts, then sends the same requests twice: once opening a session per
+request, like the old ``aiohttp_requests`` calls, and once through
+``UpstreamClient``. Prints connections opened, requests per second and
+latency percentiles.
+
+Usage:
+    python -m benchmarks.upstream_reuse [--requests 2000] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+from aiohttp import web
+
+from mock_server.upstream import UpstreamClient
+from tests.stand_in import stand_in_upstream
+
+BODY = b'{"hello": "world"}' * 20
+
+
+def counting_upstream(peers):
+    """Builds the handler of the stand-in upstream.
+
+    Arguments:
+        peers {set} -- Gets the client address of every request, one per
+        TCP connection.
+
+    Returns:
+        handle[coroutine function] -- The aiohttp handler.
+    """
+
+    async def handle(request):
+        peers.add(request.transport.get_extra_info("peername"))
+        return web.Response(body=BODY, content_type="application/json")
+
+    return handle
+
+
+async def session_per_request(url):
+    """One request on a fresh session, like the global helper did."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            await response.read()
+
+
+def pooled_request(client):
+    """One request on the shared client."""
+
+    async def send(url):
+        response = await client.request("GET", url)
+        async with response:
+            await response.read()
+
+    return send
+
+
+async def run(send, url, total, concurrency):
+    """Sends total requests with a bounded concurrency."""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await send(url)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def report(name, opened, elapsed, latencies):
+    """Prints one line of results."""
+    print(
+        "{0:<20} connections={1:<6} req/s={2:<8.0f} p50={3:.2f}ms p99={4:.2f}ms".format(
+            name,
+            opened,
+            len(latencies) / elapsed,
+            statistics.median(latencies),
+            latencies[int(len(latencies) * 0.99) - 1],
+        )
+    )
+
+
+async def main(total, concurrency):
+    """Runs both modes against the same upstream."""
+    peers = set()
+    async with stand_in_upstream([("/upstream", counting_upstream(peers))]) as base:
+        url = base + "/upstream"
+        elapsed, latencies = await run(session_per_request, url, total, concurrency)
+        report("session per request", len(peers), elapsed, latencies)
+
+        peers.clear()
+        client = UpstreamClient(limit_per_host=concurrency)
+        await client.start()
+        try:
+            elapsed, latencies = await run(pooled_request(client), url, total, concurrency)
+        finally:
+            await client.close()
+        report("pooled client", len(peers), elapsed, latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    options = parser.parse_args()
+    asyncio.run(main(options.requests, options.concurrency))
@@ -11,6 +11,19 @@ YAML_FILE = "default.yaml"
 
 default_config_file = FILE_FORMAT.format(BASE_DIR, YAML_FILE)
 
+
+def str2bool(value):
+    """Parses a boolean flag from yaml or env.
+
+    Arguments:
+        value {str} -- true/false, yes/no or 1/0
+
+    Returns:
+        flag[bool] -- The parsed value
+    """
+    return str(value).strip().lower() in ("true", "yes", "1", "on")
+
+
 parser = configargparse.ArgParser(
     config_file_parser_class=configargparse.YAMLConfigFileParser,
     default_config_files=[default_config_file],
@@ -44,8 +57,113 @@ parser.add("--POSTGRES_NOPASS_DSN", help="POSTGRES_NOPASS_DSN")
 
 parser.add("--POSTGRES_TEST_GITLAB", help="POSTGRES_TEST_GITLAB")
 
-arguments = sys.argv
-argument_options = parser.parse_known_args(arguments)
-print(parser.format_values())
+# Database Parameters
+parser.add("--DB_EXECUTOR_WORKERS", type=int, help="DB_EXECUTOR_WORKERS")
+
+parser.add("--DB_POOL_SIZE", type=int, help="DB_POOL_SIZE")
+
+parser.add("--DB_MAX_OVERFLOW", type=int, help="DB_MAX_OVERFLOW")
+
+parser.add("--DB_POOL_TIMEOUT", type=float, help="DB_POOL_TIMEOUT")
+
+parser.add("--DB_POOL_RECYCLE", type=int, help="DB_POOL_RECYCLE")
+
+parser.add("--DB_POOL_PRE_PING", type=str2bool, help="DB_POOL_PRE_PING")
+
+parser.add("--DB_STATEMENT_TIMEOUT", type=int, help="DB_STATEMENT_TIMEOUT")
+
+parser.add("--DB_SCHEMA_CHECK", help="DB_SCHEMA_CHECK")
+
+# Mock Cache Parameters
+parser.add("--MOCK_CACHE_SIZE", type=int, help="MOCK_CACHE_SIZE")
+
+parser.add("--CACHE_SYNC_INTERVAL", type=float, help="CACHE_SYNC_INTERVAL")
+
+parser.add("--CACHE_SYNC_GAP_TIMEOUT", type=float, help="CACHE_SYNC_GAP_TIMEOUT")
+
+parser.add("--CACHE_CHANGELOG_RETENTION", type=int, help="CACHE_CHANGELOG_RETENTION")
+
+parser.add("--MODIFY_CACHE_SIZE", type=int, help="MODIFY_CACHE_SIZE")
+
+# Upstream Client Parameters
+parser.add("--UPSTREAM_LIMIT", type=int, help="UPSTREAM_LIMIT")
+
+parser.add("--UPSTREAM_LIMIT_PER_HOST", type=int, help="UPSTREAM_LIMIT_PER_HOST")
+
+parser.add("--UPSTREAM_CONNECT_TIMEOUT", type=float, help="UPSTREAM_CONNECT_TIMEOUT")
+
+parser.add("--UPSTREAM_READ_TIMEOUT", type=float, help="UPSTREAM_READ_TIMEOUT")
+
+parser.add("--UPSTREAM_DNS_TTL", type=int, help="UPSTREAM_DNS_TTL")
+
+parser.add("--UPSTREAM_KEEPALIVE_TIMEOUT", type=float, help="UPSTREAM_KEEPALIVE_TIMEOUT")
+
+parser.add("--UPSTREAM_CACHE_BYTES", type=int, help="UPSTREAM_CACHE_BYTES")
+
+parser.add("--UPSTREAM_CACHE_STALE", type=float, help="UPSTREAM_CACHE_STALE")
+
+# Circuit Breaker Parameters
+parser.add("--BREAKER_WINDOW", type=int, help="BREAKER_WINDOW")
+
+parser.add("--BREAKER_MIN_CALLS", type=int, help="BREAKER_MIN_CALLS")
+
+parser.add("--BREAKER_ERROR_RATE", type=float, help="BREAKER_ERROR_RATE")
+
+parser.add("--BREAKER_SLOW_MS", type=float, help="BREAKER_SLOW_MS")
+
+parser.add("--BREAKER_SLOW_RATE", type=float, help="BREAKER_SLOW_RATE")
+
+parser.add("--BREAKER_OPEN_SECONDS", type=float, help="BREAKER_OPEN_SECONDS")
+
+parser.add("--LAST_GOOD_ENTRIES", type=int, help="LAST_GOOD_ENTRIES")
+
+# Record Mode Parameters
+parser.add("--RECORD_BATCH_SIZE", type=int, help="RECORD_BATCH_SIZE")
+
+parser.add("--RECORD_FLUSH_INTERVAL", type=float, help="RECORD_FLUSH_INTERVAL")
+
+parser.add("--RECORD_MAX_PENDING", type=int, help="RECORD_MAX_PENDING")
+
+# Snapshot Parameters
+parser.add("--SNAPSHOT_PATH", help="SNAPSHOT_PATH")
+
+parser.add("--SNAPSHOT_INTERVAL", type=float, help="SNAPSHOT_INTERVAL")
+
+parser.add("--SNAPSHOT_MAX_AGE", type=float, help="SNAPSHOT_MAX_AGE")
+
+# Warm-up Parameters
+parser.add("--WARMUP", type=str2bool, help="WARMUP")
+
+# Metrics Parameters
+parser.add("--METRICS_DIR", help="METRICS_DIR")
+
+parser.add("--METRICS_INTERVAL", type=float, help="METRICS_INTERVAL")
+
+# Stage Timing Parameters
+parser.add("--STAGE_TIMING", type=str2bool, help="STAGE_TIMING")
+
+parser.add("--SLOW_REQUESTS", type=int, help="SLOW_REQUESTS")
+
+# Profiling Parameters
+parser.add("--LOOP_STALL_THRESHOLD", type=float, help="LOOP_STALL_THRESHOLD")
+
+
+def parse_config(arguments=()):
+    """Parses the yaml file, overridden by the environment.
+
+    Keyword Arguments:
+        arguments {list} -- Command line flags, overriding both. None when
+        imported, the command line belongs to uvicorn or alembic then.
+
+    Returns:
+        args[Namespace] -- The configuration values.
+    """
+    return parser.parse_known_args(list(arguments))[0]
+
+
+docker_args = parse_config()
 
-docker_args = argument_options[0]
+if __name__ == "__main__":
+    # python -m config.config_parser [--FLAG value] prints the effective values.
+    parse_config(sys.argv[1:])
+    print(parser.format_values())
@@ -30,3 +30,100 @@ class DockerConfig(object):
 
     # POSTGRES GITLAB DSN
     POSTGRES_TEST_GITLAB = args.POSTGRES_TEST_GITLAB
+
+    # THREADS RUNNING BLOCKING DB CALLS
+    DB_EXECUTOR_WORKERS = args.DB_EXECUTOR_WORKERS
+
+    # CONNECTION POOL OF THE PROCESS-WIDE ENGINE
+    DB_POOL_SIZE = args.DB_POOL_SIZE
+
+    DB_MAX_OVERFLOW = args.DB_MAX_OVERFLOW
+
+    DB_POOL_TIMEOUT = args.DB_POOL_TIMEOUT
+
+    DB_POOL_RECYCLE = args.DB_POOL_RECYCLE
+
+    DB_POOL_PRE_PING = args.DB_POOL_PRE_PING
+
+    # MILLISECONDS, POSTGRES ONLY
+    DB_STATEMENT_TIMEOUT = args.DB_STATEMENT_TIMEOUT
+
+    # SCHEMA CHECK AT STARTUP: SKIP, CHECK OR CREATE
+    DB_SCHEMA_CHECK = args.DB_SCHEMA_CHECK
+
+    # IDENTIFIERS KEPT IN THE MOCK CACHE, 0 FOR NO LIMIT
+    MOCK_CACHE_SIZE = args.MOCK_CACHE_SIZE
+
+    # MOCK CACHE SYNC PARAMETERS
+    CACHE_SYNC_INTERVAL = args.CACHE_SYNC_INTERVAL
+
+    CACHE_SYNC_GAP_TIMEOUT = args.CACHE_SYNC_GAP_TIMEOUT
+
+    CACHE_CHANGELOG_RETENTION = args.CACHE_CHANGELOG_RETENTION
+
+    # MODIFIED RESPONSES KEPT IN THE LRU, 0 DISABLES IT
+    MODIFY_CACHE_SIZE = args.MODIFY_CACHE_SIZE
+
+    # POOLED CLIENT OF URL COLLECTION UPSTREAMS
+    UPSTREAM_LIMIT = args.UPSTREAM_LIMIT
+
+    UPSTREAM_LIMIT_PER_HOST = args.UPSTREAM_LIMIT_PER_HOST
+
+    UPSTREAM_CONNECT_TIMEOUT = args.UPSTREAM_CONNECT_TIMEOUT
+
+    UPSTREAM_READ_TIMEOUT = args.UPSTREAM_READ_TIMEOUT
+
+    UPSTREAM_DNS_TTL = args.UPSTREAM_DNS_TTL
+
+    UPSTREAM_KEEPALIVE_TIMEOUT = args.UPSTREAM_KEEPALIVE_TIMEOUT
+
+    # UPSTREAM RESPONSE CACHE OF URL COLLECTIONS
+    UPSTREAM_CACHE_BYTES = args.UPSTREAM_CACHE_BYTES
+
+    UPSTREAM_CACHE_STALE = args.UPSTREAM_CACHE_STALE
+
+    # CIRCUIT BREAKERS OF COLLECTION UPSTREAMS
+    BREAKER_WINDOW = args.BREAKER_WINDOW
+
+    BREAKER_MIN_CALLS = args.BREAKER_MIN_CALLS
+
+    BREAKER_ERROR_RATE = args.BREAKER_ERROR_RATE
+
+    BREAKER_SLOW_MS = args.BREAKER_SLOW_MS
+
+    BREAKER_SLOW_RATE = args.BREAKER_SLOW_RATE
+
+    BREAKER_OPEN_SECONDS = args.BREAKER_OPEN_SECONDS
+
+    # LAST SUCCESSFUL RESPONSES SERVED WHILE A BREAKER IS OPEN
+    LAST_GOOD_ENTRIES = args.LAST_GOOD_ENTRIES
+
+    # RECORD MODE, RECORDED URLS ARE WRITTEN IN BATCHES
+    RECORD_BATCH_SIZE = args.RECORD_BATCH_SIZE
+
+    RECORD_FLUSH_INTERVAL = args.RECORD_FLUSH_INTERVAL
+
+    RECORD_MAX_PENDING = args.RECORD_MAX_PENDING
+
+    # MOCK SNAPSHOTS PUSHED FROM THE CONTROL PLANE TO THE DATA PLANE
+    SNAPSHOT_PATH = args.SNAPSHOT_PATH
+
+    SNAPSHOT_INTERVAL = args.SNAPSHOT_INTERVAL
+
+    SNAPSHOT_MAX_AGE = args.SNAPSHOT_MAX_AGE
+
+    # LOAD MOCKS AND OPEN POOLS BEFORE REPORTING READY
+    WARMUP = args.WARMUP
+
+    # METRICS OF EVERY WORKER, MERGED THROUGH FILES IN A SHARED DIRECTORY
+    METRICS_DIR = args.METRICS_DIR
+
+    METRICS_INTERVAL = args.METRICS_INTERVAL
+
+    # SERVER-TIMING HEADER AND SLOWEST REQUESTS WITH THEIR STAGES
+    STAGE_TIMING = args.STAGE_TIMING
+
+    SLOW_REQUESTS = args.SLOW_REQUESTS
+
+    # EVENT LOOP BLOCKS LOGGED WITH THE STACK OF THE CODE BLOCKING IT
+    LOOP_STALL_THRESHOLD = args.LOOP_STALL_THRESHOLD
@@ -1,22 +1,59 @@
 """Main App Server to handle requests."""
 import asyncio
+from contextlib import asynccontextmanager
 import os
-import re
 from subprocess import call
+import time
 from urllib.parse import urlparse
 
-from aiohttp_requests import requests
 from config import current_config
 from fastapi import Depends, FastAPI, Header, HTTPException
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm import Session
 from starlette.requests import Request
-from starlette.responses import Response
-
-from mock_server import helpers, schemas
-from mock_server.database import Base, engine, get_db_for_x0
-
-Base.metadata.create_all(bind=engine)
+from starlette.responses import JSONResponse, Response
+
+from mock_server import crud, database, helpers, schemas
+from mock_server.cache import COLLECTION_TAG, mock_cache, URL_TAG
+from mock_server.database import (
+    Base,
+    check_schema,
+    close_session,
+    config_value,
+    get_db_for_x0,
+    get_engine,
+    get_pool_stats,
+    open_pool,
+    run_in_db_thread,
+    SessionLocal,
+)
+from mock_server.fast_path import CLIENT_CLOSED_REQUEST, FastPath
+from mock_server.latency import simulate
+from mock_server.metrics import (
+    COUNTER,
+    GAUGE,
+    loop_lag_seconds,
+    loop_stalls_total,
+    LoopLagMonitor,
+    metrics,
+    MetricsExporter,
+    RequestMetrics,
+    stage_seconds,
+)
+from mock_server.profiler import LoopWatchdog, SamplingProfiler
+from mock_server.responses import etag_matches, PrebuiltResponse
+from mock_server.snapshot import (
+    CONTROL_MODE,
+    DATA_MODE,
+    SERVER_MODE,
+    SnapshotLoader,
+    SnapshotPublisher,
+)
+from mock_server.sync import ChangeLogSync
+from mock_server.timing import mark, SlowestRequests, StageTiming
+from mock_server.warmup import WarmUp
+
+serving_mode = current_config.MODE or SERVER_MODE
 
 current_env = os.environ.get("ENV")
 
@@ -46,9 +83,23 @@ def create_app():
 
 app = create_app()
 
+# Mocked urls found in memory are served before FastAPI routing.
+app.add_middleware(FastPath, record_modes=helpers.record_modes)
+
+# The slowest requests of the worker, with the duration of their stages.
+slow_requests = SlowestRequests(config_value(current_config.SLOW_REQUESTS, 50))
+
+# Opt-in, without it the endpoints find no timer in the scope.
+if current_config.STAGE_TIMING:
+    app.add_middleware(StageTiming, slowest=slow_requests)
+
+# Every request is counted and timed, the ones of the fast path too.
+app.add_middleware(RequestMetrics)
+
 security = HTTPBasic()
 
-engines = engine
+# The engine bound by change_engine, the process-wide one if None.
+engines = None
 
 
 def change_engine(eng):
@@ -58,6 +109,7 @@ def change_engine(eng):
     """
     global engines
     engines = eng
+    SessionLocal.configure(bind=engines)
     Base.metadata.create_all(bind=engines)
     return engines
 
@@ -70,18 +122,306 @@ def drop_engine(eng):
 async def get_db():
     """To Get the current db connection.
 
+    Raises:
+        HTTPException: 503 on the data plane, which has no db.
+
     Yields:
         [db] -- [The current connection]
     """
-    engine1 = engines
+    if serving_mode == DATA_MODE:
+        raise HTTPException(
+            status_code=503, detail="Admin endpoints are served by the control plane"
+        )
+    db = SessionLocal()
     try:
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine1)
-        db = SessionLocal()
         yield db
+    finally:
+        await close_session(db)
+
+
+async def get_mock_db():
+    """To Get the db connection of the mocked url endpoints.
+
+    Yields:
+        [db] -- [The current connection, None on the data plane, where
+        mocks only come from snapshots]
+    """
+    if serving_mode == DATA_MODE:
+        yield None
+        return
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        await close_session(db)
+
+
+def new_session():
+    """Creates a db Session outside of a request.
+
+    Returns:
+        [db] -- A new Session on the current engine
+    """
+    return SessionLocal()
+
+
+change_log_sync = ChangeLogSync(
+    new_session,
+    mock_cache,
+    interval=current_config.CACHE_SYNC_INTERVAL,
+    gap_timeout=current_config.CACHE_SYNC_GAP_TIMEOUT,
+    retention=current_config.CACHE_CHANGELOG_RETENTION,
+)
+
+snapshot_publisher = SnapshotPublisher(
+    new_session,
+    current_config.SNAPSHOT_PATH,
+    interval=current_config.SNAPSHOT_INTERVAL or 1.0,
+    max_age=current_config.SNAPSHOT_MAX_AGE or 30.0,
+)
+
+snapshot_loader = SnapshotLoader(
+    current_config.SNAPSHOT_PATH, mock_cache, interval=current_config.SNAPSHOT_INTERVAL or 1.0
+)
+
+
+async def warm_db_pool():
+    """Opens the idle connections of the db pool.
+
+    Returns:
+        count[int] -- Connections opened.
+    """
+    return await run_in_db_thread(open_pool, engines or get_engine())
+
+
+def preload_mocks():
+    """Loads and compiles every mock from the db, blocks until done.
+
+    Returns:
+        count[int] -- Urls and collections loaded.
+    """
+    db = new_session()
+    try:
+        return sum(
+            mock_cache.preload(tag, lambda: crud.GetAllUrls(db, None, tag))
+            for tag in (URL_TAG, COLLECTION_TAG)
+        )
     finally:
         db.close()
 
 
+async def warm_mocks():
+    """Loads and compiles every mock, from the db or the snapshot.
+
+    The change log sync drops the whole cache when it starts following
+    the log, the mocks are loaded after that.
+
+    Returns:
+        count[int] -- Urls and collections loaded.
+    """
+    if serving_mode == DATA_MODE:
+        while snapshot_loader.version is None:
+            await asyncio.sleep(0.05)
+        loop = asyncio.get_event_loop()
+        count = 0
+        for tag in (URL_TAG, COLLECTION_TAG):
+            count += await loop.run_in_executor(None, mock_cache.preload, tag)
+        return count
+    while change_log_sync.last_seen is None:
+        await asyncio.sleep(0.05)
+    return await run_in_db_thread(preload_mocks)
+
+
+async def warm_upstreams():
+    """Connects to the upstreams of every loaded collection.
+
+    Returns:
+        count[int] -- Upstream origins connected.
+    """
+    urls = set()
+    for key, mocks in list(mock_cache.entries.items()):
+        if key[0] != COLLECTION_TAG:
+            continue
+        for collection in mocks.definitions.values():
+            urls.add(collection.request_url)
+            urls.update(upstream.get("url") for upstream in collection.upstreams)
+    return await helpers.upstream_client.preconnect(urls)
+
+
+warm_up_steps = [("mocks", warm_mocks), ("upstreams", warm_upstreams)]
+if serving_mode != DATA_MODE:
+    warm_up_steps.insert(0, ("db_pool", warm_db_pool))
+
+warm_up = WarmUp(warm_up_steps if config_value(current_config.WARMUP, True) else [])
+
+
+metrics_exporter = MetricsExporter(
+    metrics,
+    current_config.METRICS_DIR or None,
+    interval=config_value(current_config.METRICS_INTERVAL, 5.0),
+)
+
+loop_lag_monitor = LoopLagMonitor(loop_lag_seconds)
+
+loop_watchdog = LoopWatchdog(
+    config_value(current_config.LOOP_STALL_THRESHOLD, 0.25), counter=loop_stalls_total
+)
+
+profiler = SamplingProfiler()
+
+
+def cache_requests():
+    """Hits and misses of the in-memory caches of the worker.
+
+    Returns:
+        values[dict] -- Counts keyed by cache and result.
+    """
+    values = {}
+    for name, cache in (
+        ("mocks", mock_cache),
+        ("modified_responses", helpers.modified_responses),
+        ("modified_bodies", helpers.modified_bodies),
+        ("upstream", helpers.upstream_cache),
+    ):
+        values[(name, "hit")] = cache.hits
+        values[(name, "miss")] = cache.misses
+    values[("upstream", "stale_hit")] = helpers.upstream_cache.stale_hits
+    return values
+
+
+def pool_values(fields):
+    """Reads the db pool usage of the worker.
+
+    Arguments:
+        fields {dict} -- Keys of ``get_pool_stats`` keyed by label values.
+
+    Returns:
+        values[dict] -- The values keyed by label values, none before the
+        engine is created, never on the data plane.
+    """
+    bind = engines or database.engine
+    if bind is None:
+        return {}
+    stats = get_pool_stats(bind)
+    return {labels: stats[key] for labels, key in fields.items() if key in stats}
+
+
+metrics.collect(
+    "masquerader_cache_requests_total",
+    COUNTER,
+    "Lookups of the in-memory caches, by cache and result.",
+    ("cache", "result"),
+    cache_requests,
+)
+metrics.collect(
+    "masquerader_db_pool_connections",
+    GAUGE,
+    "Connections of the db pool, by state.",
+    ("state",),
+    lambda: pool_values({("checked_out",): "checked_out", ("idle",): "idle"}),
+)
+metrics.collect(
+    "masquerader_db_pool_checkouts_total",
+    COUNTER,
+    "Connections asked from the db pool, by result.",
+    ("result",),
+    lambda: pool_values({("ok",): "checkouts", ("timeout",): "timeouts"}),
+)
+metrics.collect(
+    "masquerader_db_pool_wait_seconds_total",
+    COUNTER,
+    "Time checkouts waited on a full db pool.",
+    (),
+    lambda: pool_values({(): "wait_seconds"}),
+)
+metrics.collect(
+    "masquerader_ready",
+    GAUGE,
+    "1 once the warm-up of the worker is done.",
+    (),
+    lambda: {(): int(warm_up.ready)},
+)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Starts the worker, and stops it on exit.
+
+    Importing this module connects nowhere. The schema is checked here
+    when ``DB_SCHEMA_CHECK`` asks for it, the upstream pool and the
+    background tasks of the mode are started. The data plane only follows
+    the snapshot. Otherwise the change log sync and record mode run, and
+    the control plane publishes snapshots. None of the background tasks
+    needs the db to be up yet, they retry until it is. The warm-up runs
+    last, ``/_readyz`` reports ready once it is done.
+
+    Arguments:
+        app {FastAPI} -- The app served.
+
+    Raises:
+        RuntimeError: if the schema check fails.
+    """
+    schema_check = current_config.DB_SCHEMA_CHECK or "skip"
+    if serving_mode != DATA_MODE and schema_check in ("check", "create"):
+        await run_in_db_thread(
+            check_schema, engines or get_engine(), create=schema_check == "create"
+        )
+    await helpers.upstream_client.start()
+    loop_lag_monitor.start()
+    loop_watchdog.start()
+    metrics_exporter.start()
+    if serving_mode == DATA_MODE:
+        snapshot_loader.start()
+    else:
+        change_log_sync.start()
+        helpers.record_modes.start()
+        helpers.record_writer.start()
+        if serving_mode == CONTROL_MODE:
+            snapshot_publisher.start()
+    warm_up.start()
+    try:
+        yield
+    finally:
+        await warm_up.stop()
+        await snapshot_loader.stop()
+        await snapshot_publisher.stop()
+        await change_log_sync.stop()
+        await helpers.record_modes.stop()
+        await helpers.record_writer.stop()
+        await helpers.upstream_client.close()
+        await loop_lag_monitor.stop()
+        await loop_watchdog.stop()
+        await metrics_exporter.stop()
+
+
+def add_lifespan(app, lifespan):
+    """Runs an async context manager around the life of the app.
+
+    This Starlette only knows startup and shutdown handlers, the context
+    is entered by the first and exited by the second.
+
+    Keyword Arguments:
+        app {FastAPI} -- The app.
+        lifespan {callable} -- Takes the app, returns the context manager.
+    """
+    contexts = []
+
+    async def startup():
+        context = lifespan(app)
+        await context.__aenter__()
+        contexts.append(context)
+
+    async def shutdown():
+        while contexts:
+            await contexts.pop().__aexit__(None, None, None)
+
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", shutdown)
+
+
+add_lifespan(app, lifespan)
+
+
 @app.get("/_healthz", tags=["System Check"])
 async def healthz():
     """Healthz check if server is available.
@@ -94,22 +434,153 @@ async def healthz():
 
 @app.get("/_readyz", tags=["System Check"])
 async def readyz():
-    """Readyz check if server is available.
+    """Readyz check if server is warmed up.
 
     Returns:
-        {dict} -- returns message as working
+        {dict} -- message, 503 until the warm-up is done, with the counts
+        and timings of its steps
     """
-    return {"message": "Mock Server Ready"}
+    stats = warm_up.stats()
+    if not stats["ready"]:
+        return JSONResponse(dict(stats, message="Mock Server Warming Up"), status_code=503)
+    return dict(stats, message="Mock Server Ready")
 
 
-@app.get("/grafana.json", tags=["System Check"])
-async def grafana():
-    """Grafana check if server is available.
+@app.get("/metrics", tags=["System Check"])
+async def prometheus_metrics():
+    """Prometheus metrics of every worker of this host.
 
     Returns:
-        {dict} -- returns message as working
+        {Response} -- requests, stage timings, cache hits, db pool usage,
+        upstream timings and event loop lag in the text exposition format
+    """
+    loop = asyncio.get_event_loop()
+    text = await loop.run_in_executor(None, metrics_exporter.exposition)
+    return Response(text, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/_pool_stats", tags=["System Check"])
+async def pool_stats():
+    """Connection pool usage of this worker.
+
+    Returns:
+        {dict} -- pool size, checked out connections and checkout waits
+    """
+    return get_pool_stats(engines)
+
+
+@app.get("/_upstream_stats", tags=["System Check"])
+async def upstream_stats():
+    """Upstream calls of url collections made by this worker.
+
+    Returns:
+        {dict} -- open connections, per host latency, errors and timeouts,
+        the upstream response cache and the coalesced call counters
+    """
+    return dict(
+        helpers.upstream_client.stats(),
+        cache=helpers.upstream_cache.stats(),
+        single_flight=helpers.single_flight.stats(),
+    )
+
+
+@app.get("/_circuit_breakers", tags=["System Check"])
+async def circuit_breakers():
+    """Circuit breakers of the collection upstreams of this worker.
+
+    Returns:
+        {dict} -- state, error and slow call rates and recent transitions
+        of each upstream host
+    """
+    return {
+        "breakers": helpers.breakers.stats(),
+        "last_good": {
+            "entries": len(helpers.last_good.entries),
+            "served": helpers.last_good.served,
+        },
+    }
+
+
+@app.get("/_record_stats", tags=["System Check"])
+async def record_stats():
+    """Recorded urls of this worker.
+
+    Returns:
+        {dict} -- queued, written, dropped and failed recorded urls
+    """
+    return helpers.record_writer.stats()
+
+
+@app.get("/_snapshot", tags=["System Check"])
+async def snapshot():
+    """Mock snapshot of this worker.
+
+    Returns:
+        {dict} -- the serving mode and the snapshot version published or
+        loaded by this worker
     """
-    return {"message": "Grafana not added yet"}
+    if serving_mode == DATA_MODE:
+        return dict(snapshot_loader.stats(), mode=serving_mode)
+    if serving_mode == CONTROL_MODE:
+        return dict(snapshot_publisher.stats(), mode=serving_mode)
+    return {"mode": serving_mode}
+
+
+@app.get("/_slow_requests", tags=["System Check"])
+async def slowest_requests():
+    """Slowest requests of this worker, when STAGE_TIMING is on.
+
+    Returns:
+        {dict} -- the requests kept, slowest first, with the duration of
+        each of their stages in ms
+    """
+    return {
+        "enabled": bool(current_config.STAGE_TIMING),
+        "pid": os.getpid(),
+        "size": slow_requests.size,
+        "recorded": slow_requests.recorded,
+        "requests": slow_requests.requests(),
+    }
+
+
+@app.get("/_profile", tags=["System Check"])
+async def profile(seconds: float = 10.0, all_threads: bool = False):
+    """Samples the stacks of this worker for a few seconds.
+
+    Keyword Arguments:
+        seconds {float} -- How long to sample, 60 at most.
+        all_threads {bool} -- Samples the db and executor threads too, not
+        only the event loop.
+
+    Raises:
+        HTTPException: if seconds is out of range, or a profile is running.
+
+    Returns:
+        {Response} -- the collapsed stacks, for flamegraph.pl or speedscope
+    """
+    try:
+        text = await profiler.profile(seconds, all_threads=all_threads)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    filename = "profile-{0}.folded".format(os.getpid())
+    return Response(
+        text,
+        media_type="text/plain",
+        headers={"Content-Disposition": 'attachment; filename="{0}"'.format(filename)},
+    )
+
+
+@app.get("/_loop_stalls", tags=["System Check"])
+async def loop_stalls():
+    """Event loop blocks of this worker longer than LOOP_STALL_THRESHOLD.
+
+    Returns:
+        {dict} -- the threshold, the number of stalls and the recent ones
+        with the stack of the code blocking the loop
+    """
+    return loop_watchdog.stats()
 
 
 @app.post("/set-x0-x1-db/", tags=["Only for x0 configuration"])
@@ -119,23 +590,36 @@ async def x0():
     Returns:
         response[json] -- Message on creation
     """
+    if serving_mode == DATA_MODE:
+        raise HTTPException(
+            status_code=503, detail="Admin endpoints are served by the control plane"
+        )
     if current_config.ENV == "x0" or current_config.ENV == "x1":
-        session = get_db_for_x0()
-        try:
-            session.connection().connection.set_isolation_level(0)
-            session.execute("DROP DATABASE mockdb;")
-            drop_engine(engine)
-        except Exception as e:
-            return HTTPException(status_code=500, detail=str(e))
-        Base.metadata.create_all(bind=engine)
-        session.execute("CREATE DATABASE mockdb;")
-        session.connection().connection.set_isolation_level(1)
-        call(["alembic", "upgrade", "head"])
-        return {"success": True, "message": "Migrations done successfully"}
+        return await run_in_db_thread(reset_x0_db)
     else:
         return HTTPException(status_code=500, detail="Environment is not X0 or X1")
 
 
+def reset_x0_db():
+    """Recreates mockdb and runs the migrations, blocks until done.
+
+    Returns:
+        response[json] -- Message on creation
+    """
+    session = get_db_for_x0()
+    try:
+        session.connection().connection.set_isolation_level(0)
+        session.execute("DROP DATABASE mockdb;")
+        drop_engine(get_engine())
+    except Exception as e:
+        return HTTPException(status_code=500, detail=str(e))
+    Base.metadata.create_all(bind=get_engine())
+    session.execute("CREATE DATABASE mockdb;")
+    session.connection().connection.set_isolation_level(1)
+    call(["alembic", "upgrade", "head"])
+    return {"success": True, "message": "Migrations done successfully"}
+
+
 @app.get("/user/auth/", response_model=schemas.User, tags=["User"])
 async def UserAuth(
     credentials: HTTPBasicCredentials = Depends(security),
@@ -153,7 +637,7 @@ async def UserAuth(
     Returns:
         db_user{dict} -- User Details stored in db
     """
-    return helpers.UserAuth(credentials, db)
+    return await helpers.UserAuth(credentials, db)
 
 
 @app.post("/user/create/", response_model=schemas.User, tags=["User"])
@@ -172,7 +656,7 @@ async def UserCreate(user: schemas.UserCreate, db: Session = Depends(get_db)):
     Returns:
         user[dict] -- If successful shows the user id and other data
     """
-    return helpers.UserCreate(user, db)
+    return await helpers.UserCreate(user, db)
 
 
 @app.post("/url/create/", response_model=schemas.Url, tags=["Url"])
@@ -199,7 +683,7 @@ async def UrlCreate(
     If response you are mocking is a json use {},
     if xml then add it as string "".
     """
-    return helpers.UrlCreate(url, db, user)
+    return await helpers.UrlCreate(url, db, user)
 
 
 @app.post("/url/update/", tags=["Url"])
@@ -222,7 +706,7 @@ async def UrlUpdate(
     Returns:
         b[list] -- [List of keys that were updated
     """
-    return helpers.UrlUpdate(url, db, user)
+    return await helpers.UrlUpdate(url, db, user)
 
 
 @app.post("/url/delete/", tags=["Url"])
@@ -243,7 +727,7 @@ async def UrlDelete(
     Returns:
         [dict] -- message that url was removed
     """
-    return helpers.UrlDelete(url, db, user)
+    return await helpers.UrlDelete(url, db, user)
 
 
 @app.post("/url/toggle/", tags=["Url"])
@@ -266,7 +750,7 @@ async def UrlToggle(
     Returns:
         b[dict] -- Url and current status of URL.
     """
-    return helpers.UrlToggle(url, db, user)
+    return await helpers.UrlToggle(url, db, user)
 
 
 @app.get("/url/mocked/", tags=["Url"])
@@ -279,7 +763,57 @@ async def UrlMocked(user=Depends(UserAuth), db: Session = Depends(get_db)):
     Keyword Arguments:
         db {Session} -- Current db connection
     """
-    return helpers.UrlMocked(user, db)
+    return await helpers.UrlMocked(user, db)
+
+
+@app.post("/record/start/", tags=["Record"])
+async def RecordStart(
+    record: schemas.RecordStart, db: Session = Depends(get_db), user=Depends(UserAuth),
+):
+    """Endpoint to turn on record mode of an identifier.
+
+    Requests of the identifier that match no url are proxied to
+    target_url, and the responses are saved as urls of the identifier
+    with the histogram of their upstream latency. With proxy set, the
+    matched requests are proxied too, to learn the latency histogram of
+    their url.
+
+    Arguments:
+        record {schemas.RecordStart} -- Identifier and the url to record from.
+
+    Keyword Arguments:
+        db {Session} -- Current db Session
+        user {str} -- The User who owns the recorded urls
+
+    Raises:
+        HTTPException: If target_url is not an http(s) url
+
+    Returns:
+        [dict] -- The identifier and its target_url
+    """
+    return await helpers.RecordStart(record, db, user)
+
+
+@app.post("/record/stop/", tags=["Record"])
+async def RecordStop(
+    record: schemas.RecordStop, db: Session = Depends(get_db), user=Depends(UserAuth),
+):
+    """Endpoint to turn off record mode of an identifier.
+
+    Arguments:
+        record {schemas.RecordStop} -- The identifier.
+
+    Keyword Arguments:
+        db {Session} -- Current db Session
+        user {str} -- The User who is stopping it
+
+    Raises:
+        HTTPException: If the identifier is not recording
+
+    Returns:
+        [dict] -- The identifier and that it is not recording
+    """
+    return await helpers.RecordStop(record, db, user)
 
 
 @app.post("/url/collection/create/", tags=["Url Collection [NEW]"])
@@ -308,7 +842,7 @@ async def UrlCollection(
     request: Request,
     x_identifier_id: str = Header(None, convert_underscores=True),
     x_modify_body=Header(None, convert_underscores=True),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_mock_db),
 ):
     """This is the endpoint for every mocked url.
 
@@ -329,56 +863,28 @@ async def UrlCollection(
     Returns:
         response[Response] -- The required response.
     """
-    await asyncio.Task(UrlLoad(x_identifier_id, request, db, "collection"))
-    regex_list = []
-    route_id = 0
-    for route in range(0, len(app.routes)):
-        regex_list.append(app.routes[route].path_regex)
-    for regex in regex_list:
-        if re.match(regex, path):
-            route_id = regex_list.index(regex)
-    url_to_search_in_db = app.routes[route_id].path
+    mark(request.scope, "app")
+    start = time.perf_counter()
+    mocks = await helpers.GetIdentifierMocks(x_identifier_id, db, "collection")
+    mark(request.scope, "load")
+    matched = mocks.route_table.match(path, request.method)
+    mark(request.scope, "route")
+    stage_seconds.observe(("lookup",), time.perf_counter() - start)
+    if not matched:
+        raise HTTPException(status_code=404, detail="Url Not Found")
+    url_to_search_in_db = matched[0]
+    request.scope["mock"] = (x_identifier_id, "/collection" + url_to_search_in_db)
     requests_new = await helpers.aiohttpResponse(
-        url_to_search_in_db, request, db, x_modify_body,
+        mocks, url_to_search_in_db, request, db, x_modify_body,
     )
-    response_new = requests
-    if request.method == "GET":
-        response_new = await requests.get(
-            requests_new["url"], headers=requests_new["headers"]
-        )
-    elif request.method == "POST":
-        response_new = await requests.post(
-            requests_new["url"],
-            headers=requests_new["headers"],
-            data=requests_new["body"],
-        )
-    elif request.method == "PUT":
-        response_new = await requests.put(
-            requests_new["url"],
-            headers=requests_new["headers"],
-            data=requests_new["body"],
-        )
-    return Response(content=await response_new.text(), headers=response_new.headers,)
-
-
-async def UrlLoad(identifier, request: Request, db=None, tag: str = None):
-    """This loads the mocked URL's in the app route table.
-
-    Keyword Arguments:
-        identifier {[str]} -- To load URL's of a particular identifier.
-        request {Request} -- Request object
-    """
-    if not db:
-        engine1 = engines
-        try:
-            SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine1)
-            db = SessionLocal()
-        finally:
-            db.close()
-    urls_dict = helpers.GetAllUrl(identifier, db, tag)
-    for url in urls_dict.keys():
-        app.add_api_route(url, Url, methods=[urls_dict[url]], tags=["Mocked Urls"])
-    print({"urls": "mocked"})
+    if requests_new["latency"] is not None:
+        connected = await simulate(requests_new["latency"].delay_ms(), request.receive)
+        mark(request.scope, "latency")
+        if not connected:
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+    response = await helpers.CollectionResponse(requests_new, request)
+    mark(request.scope, "upstream")
+    return response
 
 
 @app.get("{path:path}", tags=["Url Endpoint"])
@@ -390,7 +896,7 @@ async def Url(
     x_identifier_id: str = Header(None, convert_underscores=True),
     x_modify_response=Header(None, convert_underscores=True),
     x_status_code: int = Header(None, convert_underscores=True),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_mock_db),
 ):
     """This is the endpoint for every mocked url.
 
@@ -411,20 +917,21 @@ async def Url(
     Returns:
         response[Response] -- The required response.
     """
-    await asyncio.Task(UrlLoad(x_identifier_id, request, db, "url"))
     o = urlparse(str(request.url))
     url_path = o.path
     url_query = o.query
-    regex_list = []
-    route_id = 0
-    for route in range(0, len(app.routes)):
-        regex_list.append(app.routes[route].path_regex)
-    for regex in regex_list:
-        if re.match(regex, url_path):
-            route_id = regex_list.index(regex)
-    url_to_search_in_db = app.routes[route_id].path
-    print(request.headers, x_modify_response)
+    mark(request.scope, "app")
+    start = time.perf_counter()
+    mocks = await helpers.GetIdentifierMocks(x_identifier_id, db, "url")
+    mark(request.scope, "load")
+    matched = mocks.route_table.match(url_path, request.method)
+    mark(request.scope, "route")
+    stage_seconds.observe(("lookup",), time.perf_counter() - start)
+    if not matched:
+        return await helpers.RecordUrl(x_identifier_id, request)
+    url_to_search_in_db = matched[0]
     response = helpers.UrlResponse(
+        mocks,
         url_to_search_in_db,
         url_query,
         request,
@@ -433,15 +940,24 @@ async def Url(
         x_status_code,
         request.method,
     )
-    if type(response) == Response:
+    if response is None:
+        return await helpers.RecordUrl(x_identifier_id, request)
+    request.scope["mock"] = (x_identifier_id, url_to_search_in_db)
+    if isinstance(response, Response):
         return response
+    mode = helpers.record_modes.get(x_identifier_id)
+    if mode is not None and mode.proxy:
+        return await helpers.RecordUrl(x_identifier_id, request, url_id=response["id"])
     if response["payload"] != "" and response["payload"] != url_query:
         raise HTTPException(
             status_code=402, detail=("Incorrect Query Params."),
         )
-    await asyncio.sleep(response["latency"])
-    return Response(
-        status_code=response["status_code"],
-        content=response["content"],
-        headers=response["headers"],
-    )
+    if response["latency"] is not None:
+        connected = await simulate(response["latency"].delay_ms(), request.receive)
+        mark(request.scope, "latency")
+        if not connected:
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+    compiled = response["response"]
+    if etag_matches(request.headers.get("if-none-match"), compiled.etag):
+        return PrebuiltResponse(compiled.not_modified)
+    return PrebuiltResponse(compiled)
@@ -0,0 +1,239 @@
+"""Circuit breakers of collection upstreams.
+
+Each upstream host has a breaker over its last ``window`` calls. Once at
+least ``min_calls`` were made, the breaker opens when the share of failed
+calls (errors, timeouts, 5xx) reaches ``error_rate``, or the share of calls
+slower than ``slow_ms`` reaches ``slow_rate``. An open breaker fails fast
+for ``open_seconds``, then lets one probe call through: it closes again if
+the probe succeeds and reopens if it fails. Every allowed call gets a token,
+so the outcome of a call let through before the breaker opened, arriving
+while it is half open, is not taken for the outcome of the probe.
+
+While a breaker is open, requests are answered with the last successful
+response of the same request, kept in a bounded LRU.
+"""
+from collections import deque, OrderedDict
+from itertools import count
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker(object):
+    """Breaker of one upstream host."""
+
+    def __init__(
+        self,
+        name,
+        window=20,
+        min_calls=10,
+        error_rate=0.5,
+        slow_ms=2000,
+        slow_rate=0.5,
+        open_seconds=30.0,
+    ):
+        """Creates a closed breaker.
+
+        Keyword Arguments:
+            name {str} -- The upstream host.
+            window {int} -- Number of recent calls the rates are computed on.
+            min_calls {int} -- Calls needed in the window before it can open.
+            error_rate {float} -- Share of failed calls opening the breaker.
+            slow_ms {float} -- Calls slower than this count as slow.
+            slow_rate {float} -- Share of slow calls opening the breaker.
+            open_seconds {float} -- Seconds to fail fast before a probe.
+        """
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_ms / 1000.0
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.calls = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = None
+        self.tokens = count(1)
+        self.probe = None
+        self.rejected = 0
+        self.transitions = deque(maxlen=20)
+
+    def allow(self):
+        """Checks if a call may be sent upstream.
+
+        Returns:
+            token[int] -- Identifies the call to ``record`` and ``abandon``,
+            0 to fail fast.
+        """
+        if self.state == CLOSED:
+            return next(self.tokens)
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self._move(HALF_OPEN, "open for {0:.0f}s".format(self.open_seconds))
+        if self.state == HALF_OPEN and self.probe is None:
+            self.probe = next(self.tokens)
+            return self.probe
+        self.rejected += 1
+        return 0
+
+    def record(self, success, seconds, token=None):
+        """Records the outcome of an allowed call.
+
+        While half open only the outcome of the probe counts, calls let
+        through before the breaker opened are ignored.
+
+        Keyword Arguments:
+            success {bool} -- False for errors, timeouts and 5xx responses.
+            seconds {float} -- Time until the response headers arrived.
+            token {int} -- Returned by ``allow`` for the call.
+        """
+        slow = seconds >= self.slow_seconds
+        if self.state == HALF_OPEN:
+            if token is None or token != self.probe:
+                return
+            self.probe = None
+            if success and not slow:
+                self.calls.clear()
+                self._move(CLOSED, "probe succeeded")
+            else:
+                self._open("probe {0}".format("failed" if not success else "was slow"))
+            return
+        self.calls.append((success, slow))
+        if self.state != CLOSED or len(self.calls) < self.min_calls:
+            return
+        errors, slows = self.rates()
+        if errors >= self.error_rate:
+            self._open("error rate {0:.0%}".format(errors))
+        elif slows >= self.slow_rate:
+            self._open("slow call rate {0:.0%}".format(slows))
+
+    def abandon(self, token=None):
+        """Forgets an allowed call that was cancelled before its outcome.
+
+        Keyword Arguments:
+            token {int} -- Returned by ``allow`` for the call, another probe
+            may go out if it was the probe.
+        """
+        if token is not None and token == self.probe:
+            self.probe = None
+
+    def rates(self):
+        """Gets the error and slow call rates of the window.
+
+        Returns:
+            rates[tuple] -- (error rate, slow call rate)
+        """
+        if not self.calls:
+            return 0.0, 0.0
+        errors = sum(1 for success, _ in self.calls if not success)
+        slows = sum(1 for _, slow in self.calls if slow)
+        return errors / len(self.calls), slows / len(self.calls)
+
+    def _open(self, reason):
+        self.opened_at = time.monotonic()
+        self._move(OPEN, reason)
+
+    def _move(self, state, reason):
+        self.transitions.append({
+            "at": time.time(),
+            "from": self.state,
+            "to": state,
+            "reason": reason,
+        })
+        self.state = state
+
+    def stats(self):
+        """Gets the state, rates and recent transitions of the breaker.
+
+        Returns:
+            stats[dict] -- The breaker details.
+        """
+        errors, slows = self.rates()
+        return {
+            "state": self.state,
+            "calls": len(self.calls),
+            "error_rate": errors,
+            "slow_rate": slows,
+            "rejected": self.rejected,
+            "transitions": list(self.transitions),
+        }
+
+
+class BreakerRegistry(object):
+    """Breakers by upstream host, created on first use."""
+
+    def __init__(self, **options):
+        """Creates an empty registry.
+
+        Keyword Arguments:
+            options {dict} -- Passed to every ``CircuitBreaker``.
+        """
+        self.options = options
+        self.breakers = {}
+
+    def get(self, name):
+        """Gets the breaker of an upstream host.
+
+        Arguments:
+            name {str} -- The upstream host.
+
+        Returns:
+            breaker[CircuitBreaker] -- The breaker of the host.
+        """
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = CircuitBreaker(name, **self.options)
+        return breaker
+
+    def stats(self):
+        """Gets the details of every breaker.
+
+        Returns:
+            stats[dict] -- Breaker details keyed by upstream host.
+        """
+        return {name: breaker.stats() for name, breaker in self.breakers.items()}
+
+
+class LastGoodStore(object):
+    """LRU of the last successful response of each upstream request."""
+
+    def __init__(self, max_entries=256, max_entry_bytes=1024 * 1024):
+        """Creates an empty store.
+
+        Keyword Arguments:
+            max_entries {int} -- Responses kept at most, 0 disables the store.
+            max_entry_bytes {int} -- Larger responses are not kept.
+        """
+        self.max_entries = max_entries
+        self.max_entry_bytes = max_entry_bytes if max_entries else 0
+        self.entries = OrderedDict()
+        self.served = 0
+
+    def put(self, key, compiled):
+        """Keeps the response of a request, replacing the older one.
+
+        Keyword Arguments:
+            key {tuple} -- Built by ``cache_key``.
+            compiled {CompiledResponse} -- The successful response.
+        """
+        if not self.max_entries or len(compiled.body) > self.max_entry_bytes:
+            return
+        self.entries[key] = compiled
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, key):
+        """Gets the last successful response of a request.
+
+        Arguments:
+            key {tuple} -- Built by ``cache_key``.
+
+        Returns:
+            compiled[CompiledResponse] -- The response, None if there is none.
+        """
+        compiled = self.entries.get(key)
+        if compiled is not None:
+            self.entries.move_to_end(key)
+            self.served += 1
+        return compiled
@@ -0,0 +1,440 @@
+"""In-memory cache of mock definitions.
+
+Mock definitions are loaded once per identifier and kept in memory, so
+serving a mocked url does not touch the database. Every crud mutation
+patches the cache through ``MockCache.apply`` after its commit. A data
+plane worker reads its mocks from a mapped snapshot file instead, see
+``MockCache.attach_snapshot``.
+"""
+import logging
+import threading
+
+from config import current_config
+
+from mock_server.latency import parse_spec
+from mock_server.modify import loads
+from mock_server.responses import compile_response
+from mock_server.router import RouteTable
+
+URL_TAG = "url"
+COLLECTION_TAG = "collection"
+
+DEFAULT_CONTENT_TYPE = "application/json"
+
+logger = logging.getLogger(__name__)
+
+
+def compile_latency(row):
+    """Compiles the latency of a row, ignoring a malformed stored spec.
+
+    Arguments:
+        row {models.Urls} -- The db row.
+
+    Returns:
+        spec[LatencySpec] -- The compiled spec, None for no delay.
+    """
+    try:
+        return parse_spec(getattr(row, "latency_spec", None), row.latency)
+    except ValueError:
+        logger.warning("Ignoring malformed latency_spec of %s", row.url)
+        return parse_spec(None, row.latency)
+
+
+class MockUrl(object):
+    """Detached copy of a row of the urls table."""
+
+    __slots__ = (
+        "id",
+        "identifier",
+        "request_type",
+        "url",
+        "response",
+        "payload",
+        "headers",
+        "status_code",
+        "latency",
+        "is_active",
+        "inactive_status_code",
+        "inactive_response",
+        "version",
+        "latency_spec",
+        "compiled",
+        "inactive",
+        "document",
+    )
+
+    def __init__(self, row, version):
+        """Copies the served columns of a row and compiles its responses.
+
+        A row read from a snapshot brings the ETag of its response, its
+        response bodies are memoryviews of the snapshot file then.
+
+        Keyword Arguments:
+            row {models.Urls} -- The db row.
+            version {int} -- Cache version the definition was built at.
+        """
+        self.id = row.id
+        self.identifier = row.identifier
+        self.request_type = row.request_type
+        self.url = row.url
+        self.response = row.response
+        self.payload = row.payload or ""
+        self.headers = dict(row.headers or {})
+        if "Content-Type" not in self.headers:
+            self.headers["Content-Type"] = DEFAULT_CONTENT_TYPE
+        self.status_code = row.status_code
+        self.latency = row.latency or 0
+        self.latency_spec = compile_latency(row)
+        self.is_active = row.is_active
+        self.inactive_status_code = row.inactive_status_code
+        self.inactive_response = row.inactive_response
+        self.version = version
+        etag = getattr(row, "etag", None) or True
+        self.compiled = compile_response(
+            self.status_code, self.response, self.headers, etag=etag
+        )
+        self.inactive = None
+        if not self.is_active:
+            self.inactive = compile_response(
+                self.inactive_status_code or 400, self.inactive_response, etag=False
+            )
+        self.document = None
+
+    def get_document(self):
+        """Parses the JSON response once, for x-modify-response.
+
+        Returns:
+            document[Any] -- The parsed response, shared, never mutate it.
+        """
+        if self.document is None:
+            self.document = loads(self.response)
+        return self.document
+
+
+class MockCollection(object):
+    """Detached copy of a row of the url_collection table."""
+
+    __slots__ = (
+        "id",
+        "identifier",
+        "request_type",
+        "url",
+        "request_url",
+        "request_body",
+        "request_headers",
+        "response_key",
+        "latency",
+        "latency_spec",
+        "cache_ttl",
+        "upstreams",
+        "is_active",
+        "version",
+        "document",
+    )
+
+    def __init__(self, row, version):
+        """Copies the served columns of a row.
+
+        Keyword Arguments:
+            row {models.UrlCollection} -- The db row.
+            version {int} -- Cache version the definition was built at.
+        """
+        self.id = row.id
+        self.identifier = row.identifier
+        self.request_type = row.request_type
+        self.url = row.url
+        self.request_url = row.request_url
+        self.request_body = row.request_body
+        self.request_headers = dict(row.request_headers or {})
+        if "Content-Type" not in self.request_headers:
+            self.request_headers["Content-Type"] = DEFAULT_CONTENT_TYPE
+        self.response_key = row.response_key
+        self.latency = row.latency or 0
+        self.latency_spec = compile_latency(row)
+        self.cache_ttl = getattr(row, "cache_ttl", None) or 0
+        self.upstreams = tuple(getattr(row, "upstreams", None) or ())
+        self.is_active = row.is_active
+        self.version = version
+        self.document = None
+
+    def get_document(self):
+        """Parses the JSON request body once, for x-modify-body.
+
+        Returns:
+            document[Any] -- The parsed body, shared, never mutate it.
+        """
+        if self.document is None:
+            self.document = loads(self.request_body)
+        return self.document
+
+
+DEFINITIONS = {URL_TAG: MockUrl, COLLECTION_TAG: MockCollection}
+
+
+class IdentifierMocks(object):
+    """Immutable set of compiled mocks of one identifier."""
+
+    def __init__(self, tag, identifier, definitions, version):
+        """Compiles the route table and lookup index of the definitions.
+
+        Keyword Arguments:
+            tag {str} -- "url" or "collection"
+            identifier {str} -- The identifier, None for every identifier.
+            definitions {dict} -- Definitions keyed by row id.
+            version {int} -- Cache version of this set.
+        """
+        self.tag = tag
+        self.identifier = identifier
+        self.definitions = definitions
+        self.version = version
+        self.index = {}
+        for definition_id in sorted(definitions):
+            definition = definitions[definition_id]
+            key = (definition.url, definition.request_type)
+            self.index.setdefault(key, []).append(definition)
+        self.route_table = RouteTable(self.index.keys())
+
+    def find(self, url, request_type, payload=None, status_code=None):
+        """Finds the definition of a matched url template.
+
+        Arguments:
+            url {str} -- The matched url template.
+            request_type {str} -- GET, POST, PUT
+
+        Keyword Arguments:
+            payload {str} -- Query params of the request, urls only.
+            status_code {int} -- Preferred status code, urls only.
+
+        Returns:
+            definition[MockUrl] -- The last created match, or None.
+        """
+        found = None
+        for definition in self.index.get((url, request_type), ()):
+            if payload is not None and definition.payload != payload:
+                continue
+            if status_code and definition.status_code != status_code:
+                continue
+            found = definition
+        return found
+
+    def __len__(self):
+        """Number of definitions in the set."""
+        return len(self.definitions)
+
+
+class MockCache(object):
+    """Versioned per-identifier cache of mock definitions.
+
+    Readers always get a complete ``IdentifierMocks`` object, writers
+    build a new one and swap it in under the lock. The identifiers come
+    from a request header, so at most ``size`` of them are kept, the one
+    loaded first is dropped to make room and reloaded on its next miss.
+    """
+
+    def __init__(self, size=0):
+        """Creates an empty cache.
+
+        Keyword Arguments:
+            size {int} -- Maximum number of identifiers kept, 0 for no
+            limit. (default: {0})
+        """
+        self.lock = threading.Lock()
+        self.size = size
+        self.entries = {}
+        self.generations = {}
+        self.complete = set()
+        self.source = None
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def peek(self, tag, identifier):
+        """Gets the mocks of an identifier if they are loaded.
+
+        Only called on the event loop, so the hits are counted without
+        the lock.
+
+        Arguments:
+            tag {str} -- "url" or "collection"
+            identifier {str} -- The identifier, None for every identifier.
+
+        Returns:
+            mocks[IdentifierMocks] -- The compiled mocks, None on a miss.
+        """
+        entry = self.entries.get((tag, identifier))
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def get(self, tag, identifier, loader):
+        """Gets the mocks of an identifier, loading them on a miss.
+
+        Called after a miss of ``peek``, from a db thread or the loop, the
+        misses are counted under the lock.
+
+        Arguments:
+            tag {str} -- "url" or "collection"
+            identifier {str} -- The identifier, None for every identifier.
+            loader {callable} -- Returns the db rows of the identifier.
+
+        Returns:
+            mocks[IdentifierMocks] -- The compiled mocks.
+        """
+        key = (tag, identifier)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry
+            self.misses += 1
+            generation = self.generations.get(key, 0)
+            source = self.source
+        if tag in self.complete:
+            # Served from a snapshot, the db loader is never called.
+            rows = source(tag, identifier)
+        else:
+            rows = loader()
+        with self.lock:
+            self.version += 1
+            definition_class = DEFINITIONS[tag]
+            definitions = {row.id: definition_class(row, self.version) for row in rows}
+            entry = IdentifierMocks(tag, identifier, definitions, self.version)
+            if self.generations.get(key, 0) == generation and self.source is source:
+                if self.size and len(self.entries) >= self.size:
+                    del self.entries[next(iter(self.entries))]
+                self.entries[key] = entry
+        return entry
+
+    def preload(self, tag, loader=None):
+        """Loads every identifier of a tag at once, for the warm-up.
+
+        Identifiers already loaded, or changed while the rows were read,
+        are left alone, they are patched or reloaded on a miss as usual.
+        Past the size of the cache the other identifiers are loaded on
+        their first miss.
+
+        Arguments:
+            tag {str} -- "url" or "collection"
+
+        Keyword Arguments:
+            loader {callable} -- Returns every db row of the tag, unused
+            for a tag served from a snapshot.
+
+        Returns:
+            count[int] -- Number of definitions loaded.
+        """
+        with self.lock:
+            self.version += 1
+            version = self.version
+            generations = dict(self.generations)
+            source = self.source
+        rows = source(tag, None) if tag in self.complete else loader()
+        definition_class = DEFINITIONS[tag]
+        definitions = {row.id: definition_class(row, version) for row in rows}
+        identifiers = {}
+        for definition_id, definition in definitions.items():
+            if definition.identifier is not None:
+                identifier_definitions = identifiers.setdefault(definition.identifier, {})
+                identifier_definitions[definition_id] = definition
+        identifiers[None] = definitions
+        loaded = {
+            (tag, identifier): IdentifierMocks(tag, identifier, definition_set, version)
+            for identifier, definition_set in identifiers.items()
+        }
+        with self.lock:
+            if self.source is source:
+                entries = dict(self.entries)
+                for key, entry in loaded.items():
+                    generation = self.generations.get(key, 0)
+                    if key in entries or generation != generations.get(key, 0):
+                        continue
+                    if self.size and len(entries) >= self.size:
+                        break
+                    entries[key] = entry
+                self.entries = entries
+        return len(definitions)
+
+    def apply(self, tag, rows):
+        """Patches the loaded identifiers with changed rows.
+
+        A row may have moved to another identifier, the entries holding it
+        are found in one pass over the entries of the tag for all the rows.
+
+        Keyword Arguments:
+            tag {str} -- "url" or "collection"
+            rows {list} -- Rows that were created, updated or deleted.
+        """
+        row_ids = {row.id for row in rows}
+        with self.lock:
+            self.version += 1
+            definition_class = DEFINITIONS[tag]
+            holders = {}
+            for key, entry in self.entries.items():
+                if key[0] != tag:
+                    continue
+                definitions = entry.definitions
+                if len(row_ids) < len(definitions):
+                    held = [row_id for row_id in row_ids if row_id in definitions]
+                else:
+                    held = [row_id for row_id in definitions if row_id in row_ids]
+                for row_id in held:
+                    holders.setdefault(row_id, set()).add(key)
+            changed = {}
+            for row in rows:
+                keys = {(tag, row.identifier), (tag, None)}
+                keys.update(holders.get(row.id, ()))
+                for key in keys:
+                    self.generations[key] = self.generations.get(key, 0) + 1
+                    entry = self.entries.get(key)
+                    if entry is None:
+                        continue
+                    definitions = changed.setdefault(key, dict(entry.definitions))
+                    definitions.pop(row.id, None)
+                    if row.is_deleted is False and key[1] in (None, row.identifier):
+                        definitions[row.id] = definition_class(row, self.version)
+            for key, definitions in changed.items():
+                self.entries[key] = IdentifierMocks(
+                    tag, key[1], definitions, self.version
+                )
+
+    def attach_snapshot(self, tags, source):
+        """Serves the tags from a snapshot instead of the db.
+
+        Every loaded identifier of the tags is dropped at once, each one is
+        read from the new source on its next miss. Readers see the old or
+        the new mocks of an identifier, never a mix. Afterwards the loader
+        of ``get`` is not called any more for the tags.
+
+        Keyword Arguments:
+            tags {tuple} -- "url" and or "collection"
+            source {callable} -- Takes a tag and an identifier, returns
+            the rows of the identifier, every row of the tag for None.
+        """
+        with self.lock:
+            self.version += 1
+            for key in [key for key in self.entries if key[0] in tags]:
+                self.generations[key] = self.generations.get(key, 0) + 1
+            self.entries = {
+                key: entry for key, entry in self.entries.items() if key[0] not in tags
+            }
+            self.source = source
+            self.complete.update(tags)
+
+    def invalidate(self, tag=None, identifier=None):
+        """Drops loaded identifiers so they are reloaded on next use.
+
+        Keyword Arguments:
+            tag {str} -- Only drop this tag, every tag if None.
+            identifier {str} -- Only drop this identifier, every one if None.
+        """
+        with self.lock:
+            self.version += 1
+            for key in list(self.entries):
+                if tag is not None and key[0] != tag:
+                    continue
+                if identifier is not None and key[1] not in (None, identifier):
+                    continue
+                self.generations[key] = self.generations.get(key, 0) + 1
+                del self.entries[key]
+
+
+mock_cache = MockCache(current_config.MOCK_CACHE_SIZE or 0)
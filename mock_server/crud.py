@@ -7,9 +7,12 @@ import json
 from urllib.parse import urlparse
 
 from common import utils
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 
 from . import models, schemas
+from .cache import COLLECTION_TAG, mock_cache, URL_TAG
+from .histogram import LatencyHistogram
 
 
 def CreateUrl(db: Session, url: schemas.UrlCreate, user_id: int):
@@ -47,18 +50,34 @@ def CreateUrl(db: Session, url: schemas.UrlCreate, user_id: int):
         headers=url.headers,
         status_code=status,
         latency=url.latency,
+        latency_spec=url.latency_spec,
         created_by=user_id,
         is_active=1,
         inactive_response=new_inactive_response,
         inactive_status_code=url.inactive_status_code,
-        created_on=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        created_on=datetime.now().replace(microsecond=0),
     )
     db.add(db_url)
+    db.flush()
+    RecordChanges(db, URL_TAG, [db_url])
     db.commit()
     db.refresh(db_url)
+    mock_cache.apply(URL_TAG, [db_url])
     return db_url
 
 
+def RecordChanges(db: Session, tag: str, rows: list):
+    """Adds change log rows for mutated mocks to the current transaction.
+
+    Keyword Arguments:
+        db {Session} -- Current db Session, committed by the caller
+        tag {str} -- "url" or "collection"
+        rows {list} -- The created or updated rows
+    """
+    for row in rows:
+        db.add(models.MockChange(tag=tag, row_id=row.id, identifier=row.identifier))
+
+
 def CreateCollection(db: Session, url: schemas.UrlCollection, user_id: int):
     """Create or Mock a url in the database.
 
@@ -86,13 +105,19 @@ def CreateCollection(db: Session, url: schemas.UrlCollection, user_id: int):
         request_headers=url.request_headers,
         response_key=url.response_key,
         latency=url.latency,
+        latency_spec=url.latency_spec,
+        cache_ttl=url.cache_ttl,
+        upstreams=url.upstreams,
         is_active=url.is_active,
         created_by=user_id,
-        created_on=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        created_on=datetime.now().replace(microsecond=0),
     )
     db.add(db_url)
+    db.flush()
+    RecordChanges(db, COLLECTION_TAG, [db_url])
     db.commit()
     db.refresh(db_url)
+    mock_cache.apply(COLLECTION_TAG, [db_url])
     return db_url
 
 
@@ -124,12 +149,11 @@ def UpdateUrl(db: Session, update_details: dict, user_id: int):
         update_details["status_code_of_old_url"],
         update_details["request_type_of_old_url"],
     )
-    if not db_update.first():
+    changed_rows = db_update.all()
+    if not changed_rows:
         return None
 
-    to_update_dict[models.Urls.updated_on] = datetime.now().strftime(
-        "%Y-%m-%d %H:%M:%S"
-    )
+    to_update_dict[models.Urls.updated_on] = datetime.now().replace(microsecond=0)
     to_update_dict[models.Urls.updated_by] = str(user_id)
     for i in to_update:
         if i == "response" or i == "payload":
@@ -144,7 +168,9 @@ def UpdateUrl(db: Session, update_details: dict, user_id: int):
     db_update.update(
         to_update_dict, synchronize_session="evaluate",
     )
+    RecordChanges(db, URL_TAG, changed_rows)
     db.commit()
+    mock_cache.apply(URL_TAG, changed_rows)
     return to_update
 
 
@@ -168,7 +194,7 @@ def CreateUser(db: Session, user: schemas.UserCreate):
         password=hashed_pass,
         is_active=user.is_active,
         is_admin=user.is_admin,
-        created_on=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        created_on=datetime.now().replace(microsecond=0),
     )
     db.add(db_user)
     db.commit()
@@ -263,10 +289,13 @@ def UrlDelete(db: Session, url: schemas.UrlCreate):
         url[dict] -- Message which URL got deleted.
     """
     db_url = GetUrlDetails(db, url.url, url.status_code, url.request_type)
-    if not db_url.first():
+    changed_rows = db_url.all()
+    if not changed_rows:
         return None
     db_url.update({models.Urls.is_deleted: True}, synchronize_session="evaluate")
+    RecordChanges(db, URL_TAG, changed_rows)
     db.commit()
+    mock_cache.apply(URL_TAG, changed_rows)
     return db_url
 
 
@@ -296,7 +325,8 @@ def UrlToggle(
     db_url = GetUrlDetails(
         db, toggle_details.url, toggle_details.status_code, toggle_details.request_type,
     )
-    if not db_url.first():
+    changed_rows = db_url.all()
+    if not changed_rows:
         return None
     changed_to = False
     to_update[models.Urls.inactive_response] = new_inactive_response
@@ -307,7 +337,9 @@ def UrlToggle(
         to_update[models.Urls.is_active] = True
         changed_to = True
     db_url.update(to_update, synchronize_session="evaluate")
+    RecordChanges(db, URL_TAG, changed_rows)
     db.commit()
+    mock_cache.apply(URL_TAG, changed_rows)
     return {toggle_details.url: changed_to}
 
 
@@ -346,17 +378,232 @@ def GetAllUrls(db: Session, identifier: str, tag: str):
     Returns:
         results[Query] -- The urls of that identifier.
     """
-    model = models.UrlCollection if tag == "collection" else models.Urls
+    model = models.UrlCollection if tag == COLLECTION_TAG else models.Urls
+    query = db.query(model).filter(model.is_deleted == False)  # noqa
     if identifier:
-        results = (
-            db.query(models.UrlCollection)
-            .filter(models.UrlCollection.identifier == identifier)
-            .all()
-            if tag == "collection"
-            else db.query(models.Urls)
-            .filter(models.Urls.identifier == identifier)
-            .all()
+        query = query.filter(model.identifier == identifier)
+    return query.all()
+
+
+def GetLastChangeId(db: Session):
+    """Used to get the id of the latest change log row.
+
+    Arguments:
+        db {Session} -- Session Object
+
+    Returns:
+        change_id[int] -- Latest change id, 0 if the log is empty.
+    """
+    return db.query(func.max(models.MockChange.id)).scalar() or 0
+
+
+def GetChangesSince(db: Session, change_id: int, missing_ids=(), limit: int = 1000):
+    """Used to get the change log rows after a change id.
+
+    Arguments:
+        db {Session} -- Session Object
+        change_id {int} -- The last change id already applied.
+
+    Keyword Arguments:
+        missing_ids {iterable} -- Older ids that were not visible yet.
+        limit {int} -- Maximum number of rows to return.
+
+    Returns:
+        results[list] -- The change rows ordered by id.
+    """
+    condition = models.MockChange.id > change_id
+    if missing_ids:
+        condition = or_(condition, models.MockChange.id.in_(list(missing_ids)))
+    return (
+        db.query(models.MockChange)
+        .filter(condition)
+        .order_by(models.MockChange.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def GetRowsById(db: Session, tag: str, row_ids: list):
+    """Used to get the current state of changed rows.
+
+    Arguments:
+        db {Session} -- Session Object
+        tag {str} -- "url" or "collection"
+        row_ids {list} -- Ids of the changed rows.
+
+    Returns:
+        results[list] -- The rows, deleted ones included.
+    """
+    model = models.UrlCollection if tag == COLLECTION_TAG else models.Urls
+    return db.query(model).filter(model.id.in_(row_ids)).all()
+
+
+def PruneChanges(db: Session, before: datetime):
+    """Used to remove change log rows that every worker has applied.
+
+    Arguments:
+        db {Session} -- Session Object
+        before {datetime} -- Rows created before this are removed.
+
+    Returns:
+        count[int] -- Number of removed rows.
+    """
+    count = (
+        db.query(models.MockChange)
+        .filter(models.MockChange.created_on < before)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return count
+
+
+def StartRecording(db: Session, record: schemas.RecordStart, user_id: int):
+    """Used to turn on record mode of an identifier.
+
+    Arguments:
+        db {Session} -- Session Object
+        record {schemas.RecordStart} -- Identifier and the url to record from.
+        user_id {int} -- The User who started it, owner of the recorded urls.
+
+    Returns:
+        db_record[models.RecordMode] -- The active record mode.
+    """
+    StopRecording(db, record.identifier, commit=False)
+    db_record = models.RecordMode(
+        identifier=record.identifier,
+        target_url=record.target_url.rstrip("/"),
+        proxy=record.proxy,
+        is_active=True,
+        created_by=user_id,
+        created_on=datetime.now().replace(microsecond=0),
+    )
+    db.add(db_record)
+    db.commit()
+    db.refresh(db_record)
+    return db_record
+
+
+def StopRecording(db: Session, identifier: str, commit: bool = True):
+    """Used to turn off record mode of an identifier.
+
+    Arguments:
+        db {Session} -- Session Object
+        identifier {str} -- The identifier.
+
+    Keyword Arguments:
+        commit {bool} -- Commit the transaction.
+
+    Returns:
+        count[int] -- Number of record modes stopped.
+    """
+    count = (
+        db.query(models.RecordMode)
+        .filter(
+            models.RecordMode.identifier == identifier,
+            models.RecordMode.is_active == True,  # noqa
         )
-    else:
-        results = db.query(model).all()
-    return results
+        .update(
+            {"is_active": False, "stopped_on": datetime.now().replace(microsecond=0)},
+            synchronize_session=False,
+        )
+    )
+    if commit:
+        db.commit()
+    return count
+
+
+def GetRecordings(db: Session):
+    """Used to get the active record modes.
+
+    Arguments:
+        db {Session} -- Session Object
+
+    Returns:
+        results[list] -- The record modes, oldest first.
+    """
+    return (
+        db.query(models.RecordMode)
+        .filter(models.RecordMode.is_active == True)  # noqa
+        .order_by(models.RecordMode.id)
+        .all()
+    )
+
+
+def CreateRecordedUrls(db: Session, rows: list):
+    """Used to store recorded responses as urls in one statement.
+
+    The urls are written with a single multi-row insert and announced
+    with one change log row per identifier, which makes workers reload
+    the identifier instead of fetching every new row.
+
+    Arguments:
+        db {Session} -- Session Object
+        rows {list} -- Column values of the urls table, one dict per url.
+
+    Returns:
+        count[int] -- Number of urls stored.
+    """
+    if not rows:
+        return 0
+    identifiers = sorted({row["identifier"] for row in rows})
+    db.execute(models.Urls.__table__.insert().values(rows))
+    db.execute(
+        models.MockChange.__table__.insert().values([
+            {
+                "tag": URL_TAG,
+                "row_id": None,
+                "identifier": identifier,
+                "created_on": datetime.utcnow(),
+            }
+            for identifier in identifiers
+        ])
+    )
+    db.commit()
+    for identifier in identifiers:
+        mock_cache.invalidate(URL_TAG, identifier)
+    return len(rows)
+
+
+def MergeLatencyHistograms(db: Session, histograms: dict):
+    """Used to add upstream timings to the latency histograms of urls.
+
+    The rows are locked while merging, so workers adding their own
+    timings at the same time do not lose each other's counts. Only urls
+    without a latency, or with a learned histogram, are updated, a
+    latency set by hand is left alone.
+
+    Arguments:
+        db {Session} -- Session Object
+        histograms {dict} -- LatencyHistogram keyed by url id.
+
+    Returns:
+        count[int] -- Number of urls updated.
+    """
+    if not histograms:
+        return 0
+    rows = (
+        db.query(models.Urls)
+        .filter(models.Urls.id.in_(list(histograms)))
+        .with_for_update()
+        .all()
+    )
+    merged = []
+    for row in rows:
+        histogram = histograms[row.id]
+        spec = row.latency_spec
+        if isinstance(spec, dict) and spec.get("type") == "histogram":
+            try:
+                histogram.merge(LatencyHistogram.from_spec(spec))
+            except ValueError:
+                pass
+        elif spec or row.latency:
+            continue
+        row.latency_spec = histogram.to_spec()
+        row.latency = 0
+        row.updated_on = datetime.now().replace(microsecond=0)
+        merged.append(row)
+    db.flush()
+    RecordChanges(db, URL_TAG, merged)
+    db.commit()
+    mock_cache.apply(URL_TAG, merged)
+    return len(merged)
@@ -0,0 +1,169 @@
+"""Raw ASGI fast path for mocked urls.
+
+Serving a mock through FastAPI resolves the header dependencies of the
+``Url`` endpoint with Pydantic and opens a db Session through
+``Depends(get_db)`` on every hit, although the mocks are in memory. The
+fast path sits in front of the app as an ASGI middleware: it reads the
+few headers it needs straight from the scope, finds the mock in the
+in-memory cache and sends its compiled bytes.
+
+Anything it cannot answer exactly like the ``Url`` endpoint falls through
+to the app unchanged: admin and system routes, collections, identifiers
+not loaded yet, unmatched urls and record mode, ``x-modify-response``,
+malformed headers. The fast path only ever serves successful lookups,
+every error response still comes from FastAPI.
+"""
+import time
+
+from mock_server.cache import mock_cache, URL_TAG
+from mock_server.latency import simulate
+from mock_server.metrics import stage_seconds
+from mock_server.responses import etag_matches
+from mock_server.timing import mark
+
+# Status sent when the client left while its response was delayed.
+CLIENT_CLOSED_REQUEST = 499
+
+METHODS = frozenset(("GET", "POST", "PUT"))
+
+# Request headers read by the fast path, every other header is ignored.
+IDENTIFIER_HEADER = b"x-identifier-id"
+MODIFY_HEADER = b"x-modify-response"
+STATUS_CODE_HEADER = b"x-status-code"
+IF_NONE_MATCH_HEADER = b"if-none-match"
+
+
+async def send_compiled(send, compiled):
+    """Sends a ``CompiledResponse`` as two ASGI messages.
+
+    Keyword Arguments:
+        send {callable} -- The ASGI send of the request.
+        compiled {CompiledResponse} -- The response to send.
+    """
+    await send({
+        "type": "http.response.start",
+        "status": compiled.status_code,
+        "headers": compiled.raw_headers,
+    })
+    await send({"type": "http.response.body", "body": compiled.body})
+
+
+class FastPath(object):
+    """ASGI middleware serving mocked urls without FastAPI."""
+
+    def __init__(self, app, record_modes=None):
+        """Wraps the app that serves everything else.
+
+        Keyword Arguments:
+            app {ASGI app} -- The FastAPI app, or the rest of its stack.
+            record_modes {RecordModes} -- Identifiers in record mode are
+            left to the app.
+        """
+        self.app = app
+        self.record_modes = record_modes
+        self.routes = None
+        self.served = 0
+        self.passed = 0
+
+    def owned_by_app(self, path):
+        """Checks if a path is routed to an endpoint other than ``Url``.
+
+        The route list is read on first use, once every route is added.
+
+        Arguments:
+            path {str} -- The request path.
+
+        Returns:
+            owned[bool] -- True for admin, system and collection paths.
+        """
+        if self.routes is None:
+            exact, prefixes = set(), []
+            for route in self.find_routes():
+                route_path = getattr(route, "path", None)
+                if route_path is None:
+                    continue
+                if "{" not in route_path:
+                    exact.add(route_path)
+                elif route_path.index("{") > 0:
+                    prefixes.append(route_path[:route_path.index("{")])
+            self.routes = (frozenset(exact), tuple(prefixes))
+        exact, prefixes = self.routes
+        return path in exact or path.startswith(prefixes)
+
+    def find_routes(self):
+        """Gets the routes of the router below the middlewares of the app."""
+        app = self.app
+        while app is not None and not hasattr(app, "routes"):
+            app = getattr(app, "app", None)
+        return getattr(app, "routes", ())
+
+    async def __call__(self, scope, receive, send):
+        """Serves a mock, or hands the request to the app."""
+        if scope["type"] != "http" or not await self.serve(scope, receive, send):
+            self.passed += 1
+            await self.app(scope, receive, send)
+
+    async def serve(self, scope, receive, send):
+        """Serves a mocked url if the lookup succeeds in memory.
+
+        Arguments:
+            scope {dict} -- The ASGI scope.
+            receive {callable} -- The ASGI receive.
+            send {callable} -- The ASGI send.
+
+        Returns:
+            served[bool] -- False if the app has to handle the request,
+            nothing was sent then.
+        """
+        method = scope["method"]
+        path = scope["path"]
+        if method not in METHODS or self.owned_by_app(path):
+            return False
+        identifier = status_code = if_none_match = None
+        for name, value in scope["headers"]:
+            if name == IDENTIFIER_HEADER:
+                identifier = value.decode("latin-1")
+            elif name == STATUS_CODE_HEADER:
+                if not value.isdigit():
+                    return False
+                status_code = int(value)
+            elif name == IF_NONE_MATCH_HEADER:
+                if_none_match = value.decode("latin-1")
+            elif name == MODIFY_HEADER:
+                return False
+        start = time.perf_counter()
+        mocks = mock_cache.peek(URL_TAG, identifier)
+        if mocks is None:
+            return False
+        if self.record_modes is not None and self.record_modes.get(identifier):
+            return False
+        matched = mocks.route_table.match(path, method)
+        if not matched:
+            return False
+        query = scope["query_string"].decode("latin-1")
+        db_url = mocks.find(matched[0], method, query, status_code)
+        if db_url is None:
+            return False
+        stage_seconds.observe(("lookup",), time.perf_counter() - start)
+        mark(scope, "lookup")
+        scope["mock"] = (identifier, matched[0])
+        self.served += 1
+        if not db_url.is_active:
+            await send_compiled(send, db_url.inactive)
+            return True
+        if db_url.latency_spec is not None:
+            connected = await simulate(db_url.latency_spec.delay_ms(), receive)
+            mark(scope, "latency")
+            if not connected:
+                await send({
+                    "type": "http.response.start",
+                    "status": CLIENT_CLOSED_REQUEST,
+                    "headers": [(b"content-length", b"0")],
+                })
+                await send({"type": "http.response.body", "body": b""})
+                return True
+        compiled = db_url.compiled
+        if etag_matches(if_none_match, compiled.etag):
+            compiled = compiled.not_modified
+        await send_compiled(send, compiled)
+        return True
@@ -1,18 +1,171 @@
 """The helper class where all functions are done."""
-import json
+import asyncio
+from datetime import datetime
+import logging
 import secrets
+import time
+from urllib.parse import urlparse
+import zlib
 
+import aiohttp
 from common import utils
-from dotty_dict import dotty
+from config import current_config
 from fastapi import HTTPException
-from starlette.responses import Response
 
 from mock_server import crud
+from mock_server.breaker import BreakerRegistry, LastGoodStore
+from mock_server.cache import mock_cache
+from mock_server.database import config_value, run_in_db_thread, SessionLocal
+from mock_server.latency import parse_spec
+from mock_server.metrics import stage_seconds
+from mock_server.modify import apply_plan, dumps, ModifiedCache
+from mock_server.projection import (
+    content_decoder,
+    JsonProjector,
+    parse_path,
+    ProjectionError,
+)
+from mock_server.record import RecordModes, RecordWriter
+from mock_server.responses import compile_response, PrebuiltResponse
+from mock_server.single_flight import SingleFlight
+from mock_server.timing import mark
+from mock_server.upstream import forward_headers, StreamedResponse, UpstreamClient
+from mock_server.upstream_cache import cache_key, compile_upstream, UpstreamCache
+
+logger = logging.getLogger(__name__)
+
+# Marks responses served from the last-known-good store.
+CIRCUIT_HEADER = b"x-masquerader-circuit"
+
+# Upstream headers that no longer describe a projected body.
+PROJECTION_DROPPED_HEADERS = (b"content-encoding", b"etag")
+
+# Encodings ProjectUpstream can decode.
+PROJECTION_ACCEPT_ENCODING = "gzip, deflate"
+
+FAN_OUT_HEADERS = [(b"content-type", b"application/json")]
+
+FAN_OUT_METHODS = ("GET", "POST", "PUT")
+
+# Request headers of Masquerader itself, never sent to a recorded upstream.
+RECORD_DROPPED_HEADERS = frozenset((
+    b"host",
+    b"content-length",
+    b"accept-encoding",
+    b"x-identifier-id",
+    b"x-modify-response",
+    b"x-status-code",
+))
+
+# Upstream headers that do not describe a recorded body.
+RECORD_UNSTORED_HEADERS = frozenset((b"content-length", b"content-encoding", b"date"))
+
+modified_responses = ModifiedCache(current_config.MODIFY_CACHE_SIZE or 0)
+
+modified_bodies = ModifiedCache(current_config.MODIFY_CACHE_SIZE or 0)
+
+upstream_client = UpstreamClient(
+    limit=current_config.UPSTREAM_LIMIT,
+    limit_per_host=current_config.UPSTREAM_LIMIT_PER_HOST,
+    connect_timeout=current_config.UPSTREAM_CONNECT_TIMEOUT,
+    read_timeout=current_config.UPSTREAM_READ_TIMEOUT,
+    dns_ttl=current_config.UPSTREAM_DNS_TTL,
+    keepalive_timeout=current_config.UPSTREAM_KEEPALIVE_TIMEOUT,
+)
+
+upstream_cache = UpstreamCache(
+    max_bytes=current_config.UPSTREAM_CACHE_BYTES or 0,
+    stale=current_config.UPSTREAM_CACHE_STALE or 0,
+)
+
+single_flight = SingleFlight()
+
+breakers = BreakerRegistry(
+    window=current_config.BREAKER_WINDOW,
+    min_calls=current_config.BREAKER_MIN_CALLS,
+    error_rate=current_config.BREAKER_ERROR_RATE,
+    slow_ms=current_config.BREAKER_SLOW_MS,
+    slow_rate=current_config.BREAKER_SLOW_RATE,
+    open_seconds=current_config.BREAKER_OPEN_SECONDS,
+)
+
+last_good = LastGoodStore(max_entries=current_config.LAST_GOOD_ENTRIES or 0)
+
+record_writer = RecordWriter(
+    SessionLocal,
+    batch_size=config_value(current_config.RECORD_BATCH_SIZE, 500),
+    interval=config_value(current_config.RECORD_FLUSH_INTERVAL, 0.5),
+    max_pending=config_value(current_config.RECORD_MAX_PENDING, 10000),
+)
+
+record_modes = RecordModes(
+    SessionLocal, interval=config_value(current_config.CACHE_SYNC_INTERVAL, 1.0)
+)
+
+
+def ValidateLatency(latency_spec):
+    """Checks a latency spec before it is stored.
 
-indexed_urls = []
+    Arguments:
+        latency_spec {dict} -- The spec sent by the user, may be None.
+
+    Raises:
+        HTTPException: If the spec is malformed.
+    """
+    try:
+        parse_spec(latency_spec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def ValidateUpstreams(upstreams):
+    """Checks the upstreams of a fan-out collection.
+
+    Arguments:
+        upstreams {list} -- The upstreams sent by the user, may be None.
+
+    Raises:
+        HTTPException: If an upstream lacks a key or url, or has a bad
+        method or timeout.
+    """
+    keys = set()
+    for upstream in upstreams or ():
+        key = upstream.get("key")
+        if not isinstance(key, str) or not key or key in keys or key == "_errors":
+            raise HTTPException(status_code=400, detail="Upstream keys must be unique")
+        keys.add(key)
+        if not isinstance(upstream.get("url"), str):
+            raise HTTPException(
+                status_code=400, detail="Upstream {0} needs a url".format(key)
+            )
+        if str(upstream.get("method", "GET")).upper() not in FAN_OUT_METHODS:
+            raise HTTPException(
+                status_code=400,
+                detail="Upstream {0} method must be GET, POST or PUT".format(key),
+            )
+        timeout = upstream.get("timeout")
+        if timeout is not None and (
+            isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0
+        ):
+            raise HTTPException(
+                status_code=400, detail="Upstream {0} timeout must be positive".format(key)
+            )
+
+
+def ValidateCacheTtl(cache_ttl):
+    """Checks the upstream cache TTL of a collection.
+
+    Arguments:
+        cache_ttl {int} -- Seconds, may be None.
+
+    Raises:
+        HTTPException: If the TTL is negative.
+    """
+    if cache_ttl is not None and cache_ttl < 0:
+        raise HTTPException(status_code=400, detail="cache_ttl must not be negative")
 
 
-def UserAuth(credentials, db):
+async def UserAuth(credentials, db):
     """Used for User Authentication. Uses HTTPBasicAuth.
 
     Keyword Arguments:
@@ -22,7 +175,9 @@ def UserAuth(credentials, db):
     cur_username = credentials.username
     cur_password = credentials.password
     hashed_pass = utils.hash_generate(cur_password)
-    db_user = crud.UserExist(db=db, username=cur_username, password=cur_password)
+    db_user = await run_in_db_thread(
+        crud.UserExist, db=db, username=cur_username, password=cur_password
+    )
     if db_user is None:
         raise HTTPException(status_code=401, detail="User Not Authenticated")
     correct_username = secrets.compare_digest(cur_username, db_user.name)
@@ -34,31 +189,39 @@ def UserAuth(credentials, db):
     return db_user
 
 
-def UserCreate(user, db):
+async def UserCreate(user, db):
     """Function to create a user.
 
     Keyword Arguments:
         user {[schema]} -- User details to be added.
         db {[Session]} -- The current session.
     """
-    user = crud.CreateUser(db=db, user=user)
+    user = await run_in_db_thread(crud.CreateUser, db=db, user=user)
     if user is None:
         raise HTTPException(status_code=400, detail="User Already Exists")
     return user
 
 
-def UrlCreate(url, db, user):
+async def UrlCreate(url, db, user):
     """Function to create or mock a url.
 
     Keyword Arguments:
         url {schemas.UrlCreate} -- JSON Body that contains url data.
     """
-    existing_url = crud.GetUrlDetails(
-        db=db, url=url.url, status_code=url.status_code, request_type=url.request_type,
+    existing_url = await run_in_db_thread(
+        lambda: crud.GetUrlDetails(
+            db=db,
+            url=url.url,
+            status_code=url.status_code,
+            request_type=url.request_type,
+        ).first()
     )
-    if existing_url.first():
+    if existing_url:
         raise HTTPException(status_code=400, detail="Url Exists")
-    create_url = crud.CreateUrl(db=db, url=url, user_id=user.id)
+    ValidateLatency(url.latency_spec)
+    create_url = await run_in_db_thread(
+        crud.CreateUrl, db=db, url=url, user_id=user.id
+    )
     return create_url
 
 
@@ -68,16 +231,23 @@ async def UrlCollectionCreate(url, db, user):
     Keyword Arguments:
         url {schemas.UrlCreate} -- JSON Body that contains url data.
     """
-    existing_url = crud.GetCollectionDetails(
-        db=db, url=url.url, request_type=url.request_type,
+    existing_url = await run_in_db_thread(
+        lambda: crud.GetCollectionDetails(
+            db=db, url=url.url, request_type=url.request_type,
+        ).first()
     )
-    if existing_url.first():
+    if existing_url:
         raise HTTPException(status_code=400, detail="Url Collection Exists")
-    create_url = crud.CreateCollection(db=db, url=url, user_id=user.id)
+    ValidateLatency(url.latency_spec)
+    ValidateCacheTtl(url.cache_ttl)
+    ValidateUpstreams(url.upstreams)
+    create_url = await run_in_db_thread(
+        crud.CreateCollection, db=db, url=url, user_id=user.id
+    )
     return create_url
 
 
-def UrlUpdate(url, db, user):
+async def UrlUpdate(url, db, user):
     """Function to update details of any mocked URL.
 
     Keyword Arguments:
@@ -92,15 +262,16 @@ def UrlUpdate(url, db, user):
             keys_to_be_updated.append(i)
     for j in keys_to_be_updated:
         dict_to_be_updated[j] = url_dict[j]
-    updated_url = crud.UpdateUrl(
-        db=db, update_details=dict_to_be_updated, user_id=user.id
+    ValidateLatency(dict_to_be_updated.get("latency_spec"))
+    updated_url = await run_in_db_thread(
+        crud.UpdateUrl, db=db, update_details=dict_to_be_updated, user_id=user.id
     )
     if not updated_url:
         raise HTTPException(status_code=500, detail="Incorrect Url provided")
     return updated_url
 
 
-def UrlDelete(url, db, user):
+async def UrlDelete(url, db, user):
     """Endpoint to remove any mocked url.
 
     Keyword Arguments:
@@ -109,26 +280,26 @@ def UrlDelete(url, db, user):
         db {Session} -- Current db Sessiom
         url {str} -- Url to be deleted
     """
-    a = crud.UrlDelete(db=db, url=url)
+    a = await run_in_db_thread(crud.UrlDelete, db=db, url=url)
     if not a:
         raise HTTPException(status_code=500, detail="Incorrect Old Url provided")
     return {"url removed": url.url}
 
 
-def UrlToggle(url, db, user):
+async def UrlToggle(url, db, user):
     """Endpoint to toggle url - 200 or 400.
 
     Keyword Arguments:
         db {Session} -- Current db Session
         url {str} -- The url to be toggled
     """
-    toggle_url = crud.UrlToggle(db=db, toggle_details=url)
+    toggle_url = await run_in_db_thread(crud.UrlToggle, db=db, toggle_details=url)
     if not toggle_url:
         raise HTTPException(status_code=500, detail="Incorrect Url provided")
     return toggle_url
 
 
-def UrlMocked(user, db):
+async def UrlMocked(user, db):
     """Endpoint for getting all mocked urls.
 
     Keyword Arguments:
@@ -137,33 +308,88 @@ def UrlMocked(user, db):
     Keyword Arguments:
         db {Session} -- Current db connection
     """
-    return crud.UserMockedUrls(db=db, user_id=user.id)
+    return await run_in_db_thread(crud.UserMockedUrls, db=db, user_id=user.id)
+
+
+async def RecordStart(record, db, user):
+    """Function to turn on record mode of an identifier.
+
+    Keyword Arguments:
+        record {schemas.RecordStart} -- Identifier and the url to record from.
+        db {Session} -- Current db Session
+        user {str} -- The User who owns the recorded urls.
+    """
+    target = urlparse(record.target_url)
+    if target.scheme not in ("http", "https") or not target.netloc:
+        raise HTTPException(status_code=400, detail="target_url must be an http(s) url")
+    mode = await run_in_db_thread(
+        crud.StartRecording, db=db, record=record, user_id=user.id
+    )
+    record_modes.put(record.identifier, mode)
+    return {
+        "identifier": mode.identifier,
+        "target_url": mode.target_url,
+        "proxy": mode.proxy,
+    }
+
+
+async def RecordStop(record, db, user):
+    """Function to turn off record mode of an identifier.
+
+    The urls recorded by this worker are written before it returns.
+
+    Keyword Arguments:
+        record {schemas.RecordStop} -- The identifier.
+        db {Session} -- Current db Session
+        user {str} -- The User who is stopping it.
+    """
+    count = await run_in_db_thread(
+        crud.StopRecording, db=db, identifier=record.identifier
+    )
+    if not count:
+        raise HTTPException(status_code=400, detail="Identifier Is Not Recording")
+    record_modes.put(record.identifier, None)
+    await record_writer.flush()
+    return {"identifier": record.identifier, "recording": False}
+
 
+async def GetIdentifierMocks(identifier, db, tag):
+    """Used to get the compiled mocks of a particular identifier.
 
-def GetAllUrl(identifier, db, tag):
-    """Used to get all urls of a particular identifier.
+    The mocks are served from the in-memory cache, the db is only
+    queried the first time an identifier is used. On the data plane
+    there is no db, every mock comes from the snapshot.
 
     Arguments:
         identifier {[str]} -- The identifier
-        db {[Session]} -- Session Object
+        db {[Session]} -- Session Object, None on the data plane
+        tag {str} -- "url" or "collection"
+
+    Raises:
+        HTTPException: 503 on the data plane until a snapshot is loaded.
 
     Returns:
-        list_urls[dict] -- The list of urls to add to route table.
+        mocks[IdentifierMocks] -- Route table and definitions of the identifier.
     """
-    global indexed_urls
-    indexed_urls = crud.GetAllUrls(db, identifier, tag)
-    list_urls = []
-    for url in indexed_urls:
-        list_urls.append((url.url, url.request_type))
-    return dict(list_urls)
+    mocks = mock_cache.peek(tag, identifier)
+    if mocks is None and db is None:
+        if tag not in mock_cache.complete:
+            raise HTTPException(status_code=503, detail="Mock Snapshot Not Loaded")
+        mocks = mock_cache.get(tag, identifier, None)
+    elif mocks is None:
+        mocks = await run_in_db_thread(
+            mock_cache.get, tag, identifier, lambda: crud.GetAllUrls(db, identifier, tag)
+        )
+    return mocks
 
 
 async def aiohttpResponse(
-    url, request, db, x_modify_body,
+    mocks, url, request, db, x_modify_body,
 ):
     """The main endpoint for every mocked request collection.
 
     Arguments:
+        mocks {IdentifierMocks} -- Compiled collections of the identifier
         url {str} -- The url endpoint for which response is mocked
         request {Request} -- The complete curl request
         db {Session} -- Current db Session
@@ -173,42 +399,340 @@ async def aiohttpResponse(
         Response[Any] -- The final response after modifying data,
         converting and validating it.
     """
-    global indexed_urls
-    db_url = None
-    for i in range(len(indexed_urls)):
-        if (
-            indexed_urls[i].url == url
-            and indexed_urls[i].request_type == request.method
-        ):
-            db_url = indexed_urls[i]
+    db_url = mocks.find(url, request.method)
+    mark(request.scope, "find")
     if not db_url:
         raise HTTPException(status_code=404, detail="Url Not Found")
     db_header = db_url.request_headers
     req_body = db_url.request_body
-    if "Content-Type" not in db_header:
-        db_header["Content-Type"] = "application/json"
     if x_modify_body:
-        x_modify_body = eval(x_modify_body)
-        body = json.loads(db_url.request_body)
-        dot_dict_resp = dotty(body)
-        for i in x_modify_body.keys():
-            dot_dict_resp[i] = x_modify_body[i]
-        req_body = json.dumps(body)
+        start = time.perf_counter()
+        try:
+            req_body = modified_bodies.get(
+                db_url,
+                x_modify_body,
+                lambda plan: dumps(apply_plan(db_url.get_document(), plan)),
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        stage_seconds.observe(("modify",), time.perf_counter() - start)
+        mark(request.scope, "modify")
     final_request = {
         "url": db_url.request_url,
         "body": req_body,
         "headers": db_header,
         "resp_key": db_url.response_key,
+        "latency": db_url.latency_spec,
+        "collection": db_url,
     }
     return final_request
 
 
+async def SendUpstream(method, url, headers, body):
+    """Sends a collection request upstream.
+
+    Arguments:
+        method {str} -- GET, POST, PUT
+        url {str} -- The upstream url
+        headers {dict} -- Headers sent upstream
+        body {str} -- Request body, None for GET
+
+    Raises:
+        HTTPException: 504 if the upstream timed out, 502 if it failed.
+
+    Returns:
+        response[ClientResponse] -- The upstream response, body not read.
+    """
+    try:
+        return await upstream_client.request(method, url, headers=headers, data=body)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Upstream Timed Out")
+    except aiohttp.ClientError as e:
+        raise HTTPException(status_code=502, detail="Upstream Failed: {0}".format(e))
+
+
+async def ProjectUpstream(response, response_key):
+    """Reads the value at response_key out of an upstream JSON body.
+
+    The body is scanned as it arrives and the upstream connection is
+    dropped as soon as the value is complete.
+
+    Arguments:
+        response {ClientResponse} -- The upstream response, body not read
+        response_key {str} -- Dotted path of the value
+
+    Raises:
+        HTTPException: 502 if the body is not JSON or lacks the path.
+
+    Returns:
+        projection[tuple] -- The forwarded headers and the value as JSON.
+    """
+    async with response:
+        raw_headers = [
+            (name, value)
+            for name, value in forward_headers(response.raw_headers)
+            if name not in PROJECTION_DROPPED_HEADERS
+        ]
+        try:
+            projector = JsonProjector(parse_path(response_key))
+            decoder = content_decoder(response.headers.get("Content-Encoding"))
+            async for chunk in response.content.iter_any():
+                if decoder is not None:
+                    chunk = decoder.decompress(chunk)
+                if projector.feed(chunk):
+                    break
+            return raw_headers, projector.close()
+        except (ProjectionError, zlib.error) as e:
+            raise HTTPException(status_code=502, detail=str(e))
+
+
+async def RefreshUpstream(key, ttl, method, url, headers, body, response_key):
+    """Refreshes a stale cached upstream response in the background."""
+    try:
+        response = await SendUpstream(method, url, headers, body)
+        if not 200 <= response.status < 300:
+            response.release()
+            return
+        if response_key:
+            raw_headers, content = await ProjectUpstream(response, response_key)
+        else:
+            async with response:
+                chunks, size = [], 0
+                async for chunk in response.content.iter_any():
+                    size += len(chunk)
+                    if not upstream_cache.admits(size):
+                        return
+                    chunks.append(chunk)
+                raw_headers, content = forward_headers(response.raw_headers), b"".join(chunks)
+        upstream_cache.store(
+            key, compile_upstream(response.status, raw_headers, content), ttl
+        )
+    except (HTTPException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("Refreshing %s failed: %s", url, getattr(e, "detail", e))
+    finally:
+        upstream_cache.end_refresh(key)
+
+
+async def CallUpstream(upstream):
+    """Calls one upstream of a fan-out collection.
+
+    Arguments:
+        upstream {dict} -- key, url and optional method, headers, body,
+        timeout in seconds and response_key
+
+    Returns:
+        result[tuple] -- The upstream key, its value as JSON and the error,
+        the value is None if the call failed.
+    """
+    url = upstream["url"]
+    method = upstream.get("method", "GET").upper()
+    headers = dict(upstream.get("headers") or {})
+    headers["Accept-Encoding"] = PROJECTION_ACCEPT_ENCODING
+    body = upstream.get("body")
+    if isinstance(body, (dict, list)):
+        body = dumps(body)
+    timeout = upstream.get("timeout") or upstream_client.read_timeout
+    breaker = breakers.get(urlparse(url).netloc)
+    token = breaker.allow()
+    if not token:
+        return upstream["key"], None, "Upstream Circuit Open"
+    start = time.perf_counter()
+    recorded = False
+
+    async def call():
+        nonlocal recorded
+        response = await upstream_client.request(method, url, headers=headers, data=body)
+        breaker.record(response.status < 500, time.perf_counter() - start, token)
+        recorded = True
+        if response.status >= 400:
+            response.release()
+            raise HTTPException(status_code=502, detail="Upstream Status {0}".format(
+                response.status
+            ))
+        return (await ProjectUpstream(response, upstream.get("response_key")))[1]
+
+    try:
+        return upstream["key"], await asyncio.wait_for(call(), timeout), None
+    except asyncio.CancelledError:
+        if not recorded:
+            breaker.abandon(token)
+        raise
+    except (asyncio.TimeoutError, aiohttp.ClientError, HTTPException) as e:
+        if not recorded:
+            breaker.record(False, time.perf_counter() - start, token)
+        if isinstance(e, asyncio.TimeoutError):
+            return upstream["key"], None, "Upstream Timed Out after {0}s".format(timeout)
+        return upstream["key"], None, getattr(e, "detail", None) or str(e)
+
+
+async def FanOutUpstreams(upstreams):
+    """Calls the upstreams of a fan-out collection concurrently.
+
+    Arguments:
+        upstreams {list} -- The upstreams column of the collection
+
+    Returns:
+        merged[tuple] -- A JSON object of every value under its key, with
+        the failed ones under _errors, and whether all calls succeeded.
+    """
+    results = await asyncio.gather(*(CallUpstream(upstream) for upstream in upstreams))
+    members = []
+    errors = {}
+    for key, value, error in results:
+        if error is not None:
+            errors[key] = error
+        members.append(dumps(key) + b":" + (value if value is not None else b"null"))
+    if errors:
+        members.append(b'"_errors":' + dumps(errors))
+    return b"{" + b",".join(members) + b"}", not errors
+
+
+async def RefreshFanOut(key, ttl, upstreams):
+    """Refreshes a stale cached fan-out response in the background."""
+    try:
+        content, successful = await FanOutUpstreams(upstreams)
+        if successful:
+            upstream_cache.store(key, compile_upstream(200, FAN_OUT_HEADERS, content), ttl)
+    finally:
+        upstream_cache.end_refresh(key)
+
+
+async def CollectionResponse(requests_new, request):
+    """Forwards a collection request upstream, through the response cache.
+
+    A collection with a response_key answers with the value at that path of
+    the upstream JSON only, one with upstreams with the merged results of
+    all of them. Concurrent identical GET requests, or requests
+    of a cached collection, share one upstream call. Calls to an upstream
+    whose circuit breaker is open fail fast with the last successful
+    response of the request.
+
+    Arguments:
+        requests_new {dict} -- The upstream request built by aiohttpResponse
+        request {Request} -- The client request
+
+    Raises:
+        HTTPException: If the upstream timed out or failed, or its circuit
+        is open and no successful response is known.
+
+    Returns:
+        response[Response] -- A cached response or the streamed upstream one.
+    """
+    collection = requests_new["collection"]
+    method = request.method
+    # Bodies are relayed undecoded, so only ask for encodings the client takes.
+    headers = {
+        name: value
+        for name, value in (requests_new["headers"] or {}).items()
+        if name.lower() != "accept-encoding"
+    }
+    headers["Accept-Encoding"] = request.headers.get("accept-encoding", "identity")
+    if collection.response_key:
+        headers["Accept-Encoding"] = PROJECTION_ACCEPT_ENCODING
+    body = requests_new["body"] if method != "GET" else None
+    url = requests_new["url"]
+    ttl = collection.cache_ttl if upstream_cache.max_bytes else 0
+    key = cache_key(collection, method, body, headers)
+    if ttl:
+        cached = upstream_cache.lookup(key)
+        if cached is not None:
+            compiled, fresh = cached
+            if not fresh and upstream_cache.begin_refresh(key):
+                if collection.upstreams:
+                    refresh = RefreshFanOut(key, ttl, collection.upstreams)
+                else:
+                    refresh = RefreshUpstream(
+                        key, ttl, method, url, headers, body, collection.response_key
+                    )
+                asyncio.ensure_future(refresh)
+            return PrebuiltResponse(compiled)
+    # Only calls that can be answered with another call's response share one.
+    shared = method == "GET" or bool(ttl)
+    if shared:
+        flight, leader = single_flight.join(key)
+        if not leader:
+            compiled = await single_flight.wait(flight)
+            if compiled is not None:
+                return PrebuiltResponse(compiled)
+            shared = False
+
+    def complete(raw_headers, content, successful=True, status_code=200):
+        compiled = None
+        if content is not None:
+            compiled = compile_upstream(status_code, raw_headers, content)
+            if successful:
+                last_good.put(key, compiled)
+                if ttl:
+                    upstream_cache.store(key, compiled, ttl)
+        if shared:
+            single_flight.finish(key, flight, compiled)
+        return compiled
+
+    if collection.upstreams:
+        try:
+            content, successful = await FanOutUpstreams(collection.upstreams)
+        except BaseException:
+            complete(None, None)
+            raise
+        return PrebuiltResponse(complete(FAN_OUT_HEADERS, content, successful))
+    breaker = breakers.get(urlparse(url).netloc)
+    token = breaker.allow()
+    if not token:
+        compiled = last_good.get(key)
+        if shared:
+            single_flight.finish(key, flight, compiled)
+        if compiled is None:
+            raise HTTPException(status_code=503, detail="Upstream Circuit Open")
+        return PrebuiltResponse(compiled, extra_headers=[(CIRCUIT_HEADER, b"open")])
+    start = time.perf_counter()
+    try:
+        response = await SendUpstream(method, url, headers, body)
+    except BaseException as e:
+        if isinstance(e, HTTPException):
+            breaker.record(False, time.perf_counter() - start, token)
+        else:
+            breaker.abandon(token)
+        if shared:
+            single_flight.finish(key, flight, None)
+        raise
+    breaker.record(response.status < 500, time.perf_counter() - start, token)
+    successful = 200 <= response.status < 300
+    if collection.response_key:
+        try:
+            raw_headers, content = await ProjectUpstream(response, collection.response_key)
+        except BaseException:
+            complete(None, None)
+            raise
+        return PrebuiltResponse(complete(raw_headers, content, successful, response.status))
+    tee_limit = last_good.max_entry_bytes if successful else 0
+    if shared:
+        tee_limit = max(tee_limit, single_flight.max_bytes)
+    if ttl and successful:
+        tee_limit = max(tee_limit, upstream_cache.max_entry_bytes)
+    return StreamedResponse(
+        response,
+        status_code=response.status,
+        on_complete=lambda raw_headers, content: complete(
+            raw_headers, content, successful, response.status
+        ),
+        tee_limit=tee_limit,
+    )
+
+
 def UrlResponse(
-    url, query_param, request, db, modify_response, x_masquerader_code, request_type,
+    mocks,
+    url,
+    query_param,
+    request,
+    db,
+    modify_response,
+    x_masquerader_code,
+    request_type,
 ):
     """The main endpoint for every mocked request.
 
     Arguments:
+        mocks {IdentifierMocks} -- Compiled urls of the identifier
         url {str} -- The url endpoint for which response is mocked
         request {Request} -- The complete curl request
         db {Session} -- Current db Session
@@ -216,39 +740,135 @@ def UrlResponse(
 
     Returns:
         Response[Any] -- The final response after modifying data,
-        converting and validating it.
+        converting and validating it, None if no url matches.
     """
-    global indexed_urls
-    db_url = None
-    for i in range(len(indexed_urls)):
-        if (
-            indexed_urls[i].url == url
-            and indexed_urls[i].request_type == request_type
-            and indexed_urls[i].payload == query_param
-        ):
-            db_url = indexed_urls[i]
+    db_url = mocks.find(url, request_type, query_param, x_masquerader_code)
+    mark(request.scope, "find")
     if not db_url:
-        raise HTTPException(status_code=404, detail="Url Not Found")
+        return None
     if not db_url.is_active:
-        return Response(
-            status_code=db_url.inactive_status_code, content=db_url.inactive_response,
-        )
+        return PrebuiltResponse(db_url.inactive)
     db_header = db_url.headers
-    resp = db_url.response
-    if "Content-Type" not in db_header:
-        db_header["Content-Type"] = "application/json"
+    compiled = db_url.compiled
     if modify_response is not None and db_header["Content-Type"] == "application/json":
-        modify_response = eval(modify_response)
-        resp = json.loads(db_url.response)
-        dot_dict_resp = dotty(resp)
-        for i in modify_response.keys():
-            dot_dict_resp[i] = modify_response[i]
-        resp = json.dumps(resp)
+        start = time.perf_counter()
+        try:
+            compiled = modified_responses.get(
+                db_url,
+                modify_response,
+                lambda plan: compile_response(
+                    db_url.status_code,
+                    dumps(apply_plan(db_url.get_document(), plan)),
+                    db_header,
+                ),
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        stage_seconds.observe(("modify",), time.perf_counter() - start)
+        mark(request.scope, "modify")
     response = {
+        "id": db_url.id,
         "status_code": db_url.status_code,
-        "content": resp,
-        "headers": db_header,
-        "latency": db_url.latency,
+        "response": compiled,
+        "latency": db_url.latency_spec,
         "payload": db_url.payload,
     }
     return response
+
+
+def RecordedHeaders(raw_headers):
+    """Converts upstream headers into the headers of a mocked url.
+
+    Arguments:
+        raw_headers {list} -- Forwarded (name, value) byte pairs.
+
+    Returns:
+        headers[dict] -- Headers to store, names like Content-Type.
+    """
+    headers = {}
+    for name, value in raw_headers:
+        if name in RECORD_UNSTORED_HEADERS:
+            continue
+        title = "-".join(part.capitalize() for part in name.decode("latin-1").split("-"))
+        headers[title] = value.decode("latin-1")
+    return headers
+
+
+async def RecordUrl(identifier, request, url_id=None):
+    """Proxies a request of a recording identifier and records the response.
+
+    A request that matched no url is queued for the record writer, it is
+    stored as a url of the identifier with a histogram of the latencies
+    observed upstream. In proxy mode a matched url is proxied too and only
+    its latency histogram learns the timing.
+
+    Arguments:
+        identifier {str} -- The identifier, may be None.
+        request {Request} -- The complete curl request
+
+    Keyword Arguments:
+        url_id {int} -- Id of the matched url, None if no url matched.
+
+    Raises:
+        HTTPException: 404 if the identifier is not recording, 504 or 502
+        if the upstream timed out or failed.
+
+    Returns:
+        Response[PrebuiltResponse] -- The upstream response.
+    """
+    mode = record_modes.get(identifier)
+    if mode is None:
+        raise HTTPException(status_code=404, detail="Url Not Found")
+    path = request.url.path
+    query = request.url.query
+    target = mode.target_url + path + ("?" + query if query else "")
+    headers = {
+        name.decode("latin-1"): value.decode("latin-1")
+        for name, value in forward_headers(request.headers.raw)
+        if name not in RECORD_DROPPED_HEADERS
+    }
+    headers["accept-encoding"] = "identity"
+    body = await request.body()
+    start = time.perf_counter()
+    response = await SendUpstream(request.method, target, headers, body or None)
+    async with response:
+        try:
+            content = await response.read()
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Upstream Timed Out")
+        except aiohttp.ClientError as e:
+            raise HTTPException(status_code=502, detail="Upstream Failed: {0}".format(e))
+        raw_headers = forward_headers(response.raw_headers)
+        charset = response.charset or "utf-8"
+    latency_ms = (time.perf_counter() - start) * 1000
+    compiled = compile_upstream(response.status, raw_headers, content)
+    if url_id is not None:
+        record_writer.observe(url_id, latency_ms)
+        return PrebuiltResponse(compiled)
+    try:
+        decoder = content_decoder(response.headers.get("content-encoding"))
+        text = decoder.decompress(content) if decoder else content
+        text = text.decode(charset, errors="replace")
+    except (ProjectionError, zlib.error, LookupError):
+        logger.warning("Not recording %s %s, cannot decode its body", request.method, path)
+    else:
+        record_writer.add(
+            (identifier, request.method, path, query),
+            {
+                "identifier": identifier,
+                "request_type": request.method,
+                "url": path,
+                "response": text,
+                "payload": query,
+                "headers": RecordedHeaders(raw_headers),
+                "status_code": response.status,
+                "is_active": True,
+                "inactive_status_code": None,
+                "inactive_response": None,
+                "created_on": datetime.now().replace(microsecond=0),
+                "created_by": mode.created_by,
+                "is_deleted": False,
+            },
+            latency_ms,
+        )
+    return PrebuiltResponse(compiled)
@@ -0,0 +1,175 @@
+"""Compact latency histograms learned from upstream timings.
+
+Latencies are counted in log-linear buckets: below 1 ms everything falls in
+bucket 0, above it every power of two is split into ``SUB_BUCKETS`` buckets,
+so a bucket is about 4.4% wide whatever the magnitude. Up to ``MAX_MS``
+that is at most ``MAX_BUCKETS`` counters per mock, only the non empty ones
+are stored. Histograms are merged by adding counts, so each worker records
+its own and the database holds their sum.
+
+As a latency_spec a histogram is stored as
+
+    {"type": "histogram", "buckets": [[index, count], ...]}
+"""
+import bisect
+import math
+import random
+
+SUB_BUCKETS = 16
+
+# Same bound as latency.MAX_DELAY_MS.
+MAX_MS = 300000
+
+MAX_BUCKETS = 2 + int(math.log2(MAX_MS) * SUB_BUCKETS)
+
+
+def bucket_index(ms):
+    """Gets the bucket of a latency.
+
+    Arguments:
+        ms {float} -- Latency in milliseconds.
+
+    Returns:
+        index[int] -- The bucket, 0 below 1 ms.
+    """
+    if ms < 1.0:
+        return 0
+    return 1 + int(math.log2(min(ms, MAX_MS)) * SUB_BUCKETS)
+
+
+def bucket_bounds(index):
+    """Gets the latencies covered by a bucket.
+
+    Arguments:
+        index {int} -- The bucket.
+
+    Returns:
+        bounds[tuple] -- Lowest and highest latency in milliseconds.
+    """
+    if index == 0:
+        return 0.0, 1.0
+    return 2.0 ** ((index - 1) / SUB_BUCKETS), 2.0 ** (index / SUB_BUCKETS)
+
+
+class LatencyHistogram(object):
+    """Sparse log-linear histogram of latencies in milliseconds."""
+
+    __slots__ = ("counts", "total", "indexes", "cumulative")
+
+    def __init__(self, counts=None):
+        """Creates a histogram.
+
+        Keyword Arguments:
+            counts {dict} -- Counts keyed by bucket index.
+        """
+        self.counts = dict(counts or {})
+        self.total = sum(self.counts.values())
+        self.indexes = None
+        self.cumulative = None
+
+    def record(self, ms, count=1):
+        """Counts a latency.
+
+        Keyword Arguments:
+            ms {float} -- Latency in milliseconds.
+            count {int} -- Times it was observed.
+        """
+        index = bucket_index(ms)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total += count
+        self.indexes = None
+
+    def merge(self, other):
+        """Adds the counts of another histogram to this one.
+
+        Keyword Arguments:
+            other {LatencyHistogram} -- The histogram to add.
+        """
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.indexes = None
+
+    def _prepare(self):
+        self.indexes = sorted(self.counts)
+        self.cumulative = []
+        running = 0
+        for index in self.indexes:
+            running += self.counts[index]
+            self.cumulative.append(running)
+
+    def quantile(self, q):
+        """Gets the upper bound of the bucket holding a quantile.
+
+        Arguments:
+            q {float} -- The quantile, 0 to 1.
+
+        Returns:
+            ms[float] -- Latency in milliseconds, 0 for an empty histogram.
+        """
+        if not self.total:
+            return 0.0
+        if self.indexes is None:
+            self._prepare()
+        position = bisect.bisect_left(self.cumulative, max(q * self.total, 1))
+        return bucket_bounds(self.indexes[min(position, len(self.indexes) - 1)])[1]
+
+    def sample(self):
+        """Draws a latency with the recorded distribution.
+
+        Returns:
+            ms[float] -- Latency in milliseconds, 0 for an empty histogram.
+        """
+        if not self.total:
+            return 0.0
+        if self.indexes is None:
+            self._prepare()
+        position = bisect.bisect_right(self.cumulative, random.random() * self.total)
+        low, high = bucket_bounds(self.indexes[min(position, len(self.indexes) - 1)])
+        if not low:
+            return random.uniform(low, high)
+        # Log-uniform inside the bucket, like the bucket widths.
+        return low * (high / low) ** random.random()
+
+    def to_spec(self):
+        """Gets the histogram as a latency_spec.
+
+        Returns:
+            spec[dict] -- The spec, buckets sorted by index.
+        """
+        return {
+            "type": "histogram",
+            "buckets": [[index, self.counts[index]] for index in sorted(self.counts)],
+        }
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Loads a histogram from a latency_spec.
+
+        Arguments:
+            spec {dict} -- A spec of type histogram.
+
+        Raises:
+            ValueError: if the buckets are malformed or empty.
+
+        Returns:
+            histogram[LatencyHistogram] -- The histogram.
+        """
+        buckets = spec.get("buckets")
+        if not isinstance(buckets, list) or not buckets:
+            raise ValueError("latency_spec.buckets must be a non empty list")
+        counts = {}
+        for bucket in buckets:
+            if (
+                not isinstance(bucket, (list, tuple))
+                or len(bucket) != 2
+                or not all(isinstance(v, int) and not isinstance(v, bool) for v in bucket)
+                or not 0 <= bucket[0] < MAX_BUCKETS
+                or bucket[1] < 0
+            ):
+                raise ValueError("latency_spec.buckets must be [index, count] pairs")
+            counts[bucket[0]] = counts.get(bucket[0], 0) + bucket[1]
+        histogram = cls(counts)
+        if not histogram.total:
+            raise ValueError("latency_spec.buckets must not be empty")
+        return histogram
@@ -0,0 +1,262 @@
+"""Simulated latency of mocked responses.
+
+A mock's ``latency_spec`` describes its delay in milliseconds:
+
+    {"type": "fixed", "ms": 120}
+    {"type": "uniform", "min_ms": 50, "max_ms": 150}
+    {"type": "normal", "mean_ms": 100, "stddev_ms": 20}
+    {"type": "lognormal", "median_ms": 80, "sigma": 0.5}
+    {"type": "percentiles", "p50": 80, "p90": 200, "p99": 900}
+    {"type": "histogram", "buckets": [[index, count], ...]}
+
+Histograms are learned from upstream timings in record mode, see
+``mock_server.histogram``.
+
+Mocks without a spec keep the legacy integer ``latency`` in seconds.
+Delayed responses are parked on one hashed timer wheel per worker, which
+releases every response due in a tick as a batch, instead of one heap
+timer per response.
+"""
+import asyncio
+import math
+import random
+
+from mock_server.histogram import LatencyHistogram
+
+MAX_DELAY_MS = 300000
+
+
+class LatencySpec(object):
+    """Compiled latency distribution of a mock."""
+
+    __slots__ = ("kind", "params", "sample")
+
+    def __init__(self, kind, params, sample):
+        """Creates a spec, see ``parse_spec``.
+
+        Keyword Arguments:
+            kind {str} -- The distribution type.
+            params {dict} -- The spec as stored.
+            sample {callable} -- Returns a delay in milliseconds.
+        """
+        self.kind = kind
+        self.params = params
+        self.sample = sample
+
+    def delay_ms(self):
+        """Samples one delay in milliseconds, clamped to [0, MAX_DELAY_MS]."""
+        return min(max(self.sample(), 0.0), MAX_DELAY_MS)
+
+
+def _number(params, name, default=None):
+    value = params.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("latency_spec.{0} must be a number".format(name))
+    if value < 0:
+        raise ValueError("latency_spec.{0} must not be negative".format(name))
+    return float(value)
+
+
+def _percentiles(params):
+    p50 = _number(params, "p50")
+    p90 = _number(params, "p90", p50)
+    p99 = _number(params, "p99", p90)
+    low = _number(params, "min", p50 / 2.0)
+    high = _number(params, "max", p99 + (p99 - p90))
+    points = [(0.0, low), (0.5, p50), (0.9, p90), (0.99, p99), (1.0, high)]
+    if any(points[i][1] > points[i + 1][1] for i in range(len(points) - 1)):
+        raise ValueError("latency_spec percentiles must not decrease")
+
+    def sample():
+        quantile = random.random()
+        for (q0, v0), (q1, v1) in zip(points, points[1:]):
+            if quantile <= q1:
+                return v0 + (v1 - v0) * (quantile - q0) / (q1 - q0)
+        return high
+
+    return sample
+
+
+def parse_spec(spec, legacy_seconds=0):
+    """Compiles a latency spec.
+
+    Arguments:
+        spec {dict} -- The latency_spec of the mock, may be None.
+
+    Keyword Arguments:
+        legacy_seconds {int} -- The latency column, used without a spec.
+
+    Raises:
+        ValueError: if the spec is malformed.
+
+    Returns:
+        spec[LatencySpec] -- The compiled spec, None for no delay.
+    """
+    if not spec:
+        if not legacy_seconds:
+            return None
+        delay = float(legacy_seconds) * 1000.0
+        return LatencySpec("fixed", {"ms": delay}, lambda: delay)
+    if not isinstance(spec, dict):
+        raise ValueError("latency_spec must be an object")
+    kind = spec.get("type", "fixed")
+    if kind == "fixed":
+        delay = _number(spec, "ms")
+        sample = lambda: delay  # noqa
+    elif kind == "uniform":
+        low, high = _number(spec, "min_ms"), _number(spec, "max_ms")
+        if high < low:
+            raise ValueError("latency_spec.max_ms must not be below min_ms")
+        sample = lambda: random.uniform(low, high)  # noqa
+    elif kind == "normal":
+        mean, stddev = _number(spec, "mean_ms"), _number(spec, "stddev_ms")
+        sample = lambda: random.gauss(mean, stddev)  # noqa
+    elif kind == "lognormal":
+        median, sigma = _number(spec, "median_ms"), _number(spec, "sigma")
+        if not median:
+            raise ValueError("latency_spec.median_ms must be positive")
+        mu = math.log(median)
+        sample = lambda: random.lognormvariate(mu, sigma)  # noqa
+    elif kind == "percentiles":
+        sample = _percentiles(spec)
+    elif kind == "histogram":
+        sample = LatencyHistogram.from_spec(spec).sample
+    else:
+        raise ValueError("Unknown latency_spec type {0}".format(kind))
+    return LatencySpec(kind, spec, sample)
+
+
+class TimerWheel(object):
+    """Hashed timer wheel releasing due waiters in batches per tick."""
+
+    def __init__(self, tick_ms=5, slots=512):
+        """Creates an idle wheel, it runs only while timers are pending.
+
+        Keyword Arguments:
+            tick_ms {int} -- Resolution of the wheel in milliseconds.
+            slots {int} -- Number of slots, one turn is tick_ms * slots.
+        """
+        self.tick = tick_ms / 1000.0
+        self.slots = [dict() for _ in range(slots)]
+        self.cursor = 0
+        self.pending = 0
+        self.loop = None
+        self.task = None
+        self.started = None
+
+    def schedule(self, delay_ms):
+        """Parks a waiter on the wheel.
+
+        Arguments:
+            delay_ms {float} -- Delay in milliseconds.
+
+        Returns:
+            future[Future] -- Resolved once the delay is over.
+        """
+        loop = asyncio.get_event_loop()
+        if loop is not self.loop:
+            self.reset(loop)
+        future = loop.create_future()
+        ticks = max(1, int(math.ceil(delay_ms / 1000.0 / self.tick)))
+        if self.task is None:
+            self.started = loop.time()
+            self.cursor = 0
+        else:
+            # Ticks already elapsed since the last processed slot.
+            ticks += int((loop.time() - self.started) / self.tick) - self.cursor
+        slot = (self.cursor + ticks) % len(self.slots)
+        rounds = (ticks - 1) // len(self.slots)
+        self.slots[slot][future] = rounds
+        self.pending += 1
+        future.add_done_callback(self._discard(slot))
+        if self.task is None:
+            self.task = loop.create_task(self.run())
+        return future
+
+    def _discard(self, slot):
+        def discard(future):
+            if self.slots[slot].pop(future, None) is not None:
+                self.pending -= 1
+                if self.pending == 0 and self.task is not None:
+                    self.task.cancel()
+                    self.task = None
+
+        return discard
+
+    def reset(self, loop):
+        """Drops all timers, used when the event loop changes."""
+        self.loop = loop
+        self.task = None
+        self.pending = 0
+        self.slots = [dict() for _ in self.slots]
+
+    async def run(self):
+        """Advances the wheel every tick until no timers are pending."""
+        loop = self.loop
+        try:
+            while self.pending > 0:
+                due = self.started + (self.cursor + 1) * self.tick
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.cursor += 1
+                slot = self.slots[self.cursor % len(self.slots)]
+                released = []
+                for future, rounds in list(slot.items()):
+                    if rounds:
+                        slot[future] = rounds - 1
+                    else:
+                        del slot[future]
+                        released.append(future)
+                self.pending -= len(released)
+                for future in released:
+                    if not future.done():
+                        future.set_result(None)
+        finally:
+            if self.task is asyncio.current_task():
+                self.task = None
+
+
+timer_wheel = TimerWheel()
+
+
+async def wait_disconnect(receive):
+    """Returns once the client has disconnected.
+
+    Keyword Arguments:
+        receive {callable} -- The ASGI receive of the request, the request
+        body must already have been read or be unused.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def simulate(delay_ms, receive=None):
+    """Waits for a simulated delay, giving up if the client disconnects.
+
+    Arguments:
+        delay_ms {float} -- Delay in milliseconds.
+
+    Keyword Arguments:
+        receive {callable} -- ASGI receive used to watch for a disconnect.
+
+    Returns:
+        connected[bool] -- False if the client went away while waiting.
+    """
+    if delay_ms <= 0:
+        return True
+    future = timer_wheel.schedule(delay_ms)
+    if receive is None:
+        await future
+        return True
+    watcher = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        await asyncio.wait({future, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if future.done():
+        return True
+    future.cancel()
+    return False
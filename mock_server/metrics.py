@@ -0,0 +1,624 @@
+"""Prometheus metrics of the mock server, in the text exposition format.
+
+Every worker counts in plain dicts, updated from its event loop without
+locks, so counting a request costs a few dict operations. Values that
+other objects already keep, like cache hits or pool usage, are read by
+collectors when the metrics are dumped instead of being counted twice.
+
+With ``uvicorn --workers N`` a scrape reaches one worker only. Each
+worker therefore dumps its values to a file of its own in ``METRICS_DIR``
+every interval, and ``/metrics`` merges the files of every worker:
+counters and histograms are summed, gauges are reported per pid. The
+files are keyed by pid and start time, so a worker reusing the pid of an
+exited one never overwrites its file. At startup the counters of workers
+that exited are folded into an aggregate file and their files deleted,
+so totals never go backwards and the directory does not grow.
+"""
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+import fcntl
+import glob
+import json
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# Upper bounds in seconds, from a cached mock to a slow upstream.
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+FILE_PATTERN = "metrics-*.json"
+
+AGGREGATE_FILE = "metrics-aggregate.json"
+
+LOCK_FILE = ".metrics.lock"
+
+
+class Counter(object):
+    """Monotonic counter per label values."""
+
+    kind = COUNTER
+
+    def __init__(self, name, documentation, labels=()):
+        """Creates a counter without values.
+
+        Keyword Arguments:
+            name {str} -- The metric name.
+            documentation {str} -- The HELP text.
+            labels {tuple} -- The label names.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        """Adds to the counter of the label values.
+
+        Keyword Arguments:
+            labels {tuple} -- The label values, in the order of the names.
+            amount {float} -- Added to the counter.
+        """
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dump(self):
+        """Gets the values, JSON serializable."""
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+
+class Histogram(object):
+    """Bucketed observations per label values."""
+
+    kind = HISTOGRAM
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """Creates a histogram without observations.
+
+        Keyword Arguments:
+            name {str} -- The metric name.
+            documentation {str} -- The HELP text.
+            labels {tuple} -- The label names.
+            buckets {tuple} -- Sorted upper bounds, +Inf is added.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, labels, value):
+        """Counts one observation.
+
+        Keyword Arguments:
+            labels {tuple} -- The label values, in the order of the names.
+            value {float} -- The observed value, seconds for timings.
+        """
+        counts = self.values.get(labels)
+        if counts is None:
+            # One count per bucket, the +Inf bucket, then the sum.
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def dump(self):
+        """Gets the values, JSON serializable."""
+        return [[list(labels), list(counts)] for labels, counts in self.values.items()]
+
+
+class MetricsRegistry(object):
+    """The metrics of one worker."""
+
+    def __init__(self):
+        """Creates an empty registry."""
+        self.metrics = {}
+        self.collectors = []
+
+    def counter(self, name, documentation, labels=()):
+        """Registers a counter, see ``Counter``."""
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """Registers a histogram, see ``Histogram``."""
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def register(self, metric):
+        """Adds a metric, or gets the one registered under its name.
+
+        Arguments:
+            metric {Counter} -- A counter or histogram.
+
+        Returns:
+            metric[Counter] -- The registered metric.
+        """
+        return self.metrics.setdefault(metric.name, metric)
+
+    def collect(self, name, kind, documentation, labels, function):
+        """Registers values read from elsewhere when the metrics are dumped.
+
+        Keyword Arguments:
+            name {str} -- The metric name.
+            kind {str} -- "counter" or "gauge".
+            documentation {str} -- The HELP text.
+            labels {tuple} -- The label names.
+            function {callable} -- Returns the values keyed by label values.
+        """
+        self.collectors.append((name, kind, documentation, tuple(labels), function))
+
+    def dump(self):
+        """Gets every metric of the worker.
+
+        Returns:
+            dump[dict] -- The pid and the metrics, JSON serializable.
+        """
+        metrics = {}
+        for metric in list(self.metrics.values()):
+            metrics[metric.name] = {
+                "type": metric.kind,
+                "help": metric.documentation,
+                "labels": list(metric.labels),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "values": metric.dump(),
+            }
+        for name, kind, documentation, labels, function in self.collectors:
+            try:
+                values = function()
+            except Exception:
+                logger.exception("Collecting metric %s failed", name)
+                continue
+            metrics[name] = {
+                "type": kind,
+                "help": documentation,
+                "labels": list(labels),
+                "buckets": [],
+                "values": [[list(key), value] for key, value in values.items()],
+            }
+        return {"pid": os.getpid(), "time": time.time(), "metrics": metrics}
+
+
+def pid_alive(pid):
+    """Checks if a process still runs.
+
+    Arguments:
+        pid {int} -- The process id.
+
+    Returns:
+        alive[bool] -- False once the process exited.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge_dumps(dumps):
+    """Merges the dumps of several workers.
+
+    Counters and histograms are summed. Gauges get a pid label, and only
+    workers that still run report them.
+
+    Arguments:
+        dumps {list} -- Dumps from ``MetricsRegistry.dump``.
+
+    Returns:
+        metrics[dict] -- Metrics keyed by name, values keyed by label values.
+    """
+    merged = {}
+    for dump in dumps:
+        alive = dump["pid"] == os.getpid() or pid_alive(dump["pid"])
+        for name, metric in dump["metrics"].items():
+            kind = metric["type"]
+            labels = metric["labels"] + (["pid"] if kind == GAUGE else [])
+            target = merged.setdefault(
+                name,
+                {
+                    "type": kind,
+                    "help": metric["help"],
+                    "labels": labels,
+                    "buckets": metric["buckets"],
+                    "values": {},
+                },
+            )
+            if kind == GAUGE and not alive:
+                continue
+            for label_values, value in metric["values"]:
+                if kind == GAUGE:
+                    label_values = label_values + [str(dump["pid"])]
+                key = tuple(label_values)
+                if kind == HISTOGRAM:
+                    current = target["values"].get(key)
+                    if current is None:
+                        target["values"][key] = list(value)
+                    else:
+                        target["values"][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target["values"][key] = target["values"].get(key, 0) + value
+    return merged
+
+
+def fold_dumps(dumps):
+    """Folds the counters and histograms of several dumps into one.
+
+    Gauges are dropped, only running workers report them.
+
+    Arguments:
+        dumps {list} -- Dumps of workers that exited, and the aggregate.
+
+    Returns:
+        dump[dict] -- A dump of pid 0 with the summed values.
+    """
+    metrics = {}
+    for name, metric in merge_dumps(dumps).items():
+        if metric["type"] == GAUGE:
+            continue
+        values = [[list(key), value] for key, value in metric["values"].items()]
+        metrics[name] = dict(metric, values=values)
+    return {"pid": 0, "started": 0, "time": time.time(), "metrics": metrics}
+
+
+def read_dump(path):
+    """Reads a dump file, None if it is gone or unreadable.
+
+    Arguments:
+        path {str} -- The dump file.
+
+    Returns:
+        dump[dict] -- The dump, None if it could not be read.
+    """
+    try:
+        with open(path) as dump_file:
+            return json.load(dump_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.warning("Skipping unreadable metrics file %s", path)
+        return None
+
+
+def write_dump(path, dump):
+    """Atomically replaces a dump file, blocks until done.
+
+    Keyword Arguments:
+        path {str} -- The dump file.
+        dump {dict} -- The dump to write.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(prefix=".metrics-", dir=directory)
+    try:
+        with os.fdopen(descriptor, "w") as dump_file:
+            json.dump(dump, dump_file, separators=(",", ":"))
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def escape(value):
+    """Escapes a label value of the exposition format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    """Formats label pairs, {} included, empty for no labels."""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    formatted = ('{0}="{1}"'.format(name, escape(value)) for name, value in pairs)
+    return "{" + ",".join(formatted) + "}"
+
+
+def format_bound(bound):
+    """Formats a bucket bound like Prometheus clients do."""
+    return repr(float(bound))
+
+
+def render(metrics):
+    """Renders merged metrics in the text exposition format.
+
+    Arguments:
+        metrics {dict} -- From ``merge_dumps``.
+
+    Returns:
+        text[str] -- The exposition, version 0.0.4.
+    """
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        names = metric["labels"]
+        lines.append("# HELP {0} {1}".format(name, metric["help"]))
+        lines.append("# TYPE {0} {1}".format(name, metric["type"]))
+        for key in sorted(metric["values"]):
+            value = metric["values"][key]
+            if metric["type"] != HISTOGRAM:
+                lines.append("{0}{1} {2}".format(name, format_labels(names, key), value))
+                continue
+            cumulative = 0
+            bounds = [format_bound(bound) for bound in metric["buckets"]] + ["+Inf"]
+            for bound, count in zip(bounds, value[:-1]):
+                cumulative += count
+                lines.append(
+                    "{0}_bucket{1} {2}".format(
+                        name, format_labels(names, key, [("le", bound)]), cumulative
+                    )
+                )
+            labels = format_labels(names, key)
+            lines.append("{0}_sum{1} {2}".format(name, labels, value[-1]))
+            lines.append("{0}_count{1} {2}".format(name, labels, cumulative))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter(object):
+    """Shares the metrics of a worker with the other workers of the host."""
+
+    def __init__(self, registry, directory=None, interval=5.0):
+        """Creates the exporter, call ``start`` to dump in the background.
+
+        Keyword Arguments:
+            registry {MetricsRegistry} -- The metrics of this worker.
+            directory {str} -- Shared by the workers, None to only ever
+            expose this worker.
+            interval {float} -- Seconds between two dumps.
+        """
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.started = int(time.time() * 1000)
+        self.task = None
+
+    def path(self):
+        """Gets the dump file of this worker, keyed by pid and start time."""
+        return os.path.join(
+            self.directory, "metrics-{0}-{1}.json".format(os.getpid(), self.started)
+        )
+
+    @contextmanager
+    def locked(self, operation):
+        """Holds the lock of the directory, shared or exclusive.
+
+        Keyword Arguments:
+            operation {int} -- ``fcntl.LOCK_SH`` or ``fcntl.LOCK_EX``.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def write(self):
+        """Atomically replaces the dump file of this worker, blocks until done."""
+        dump = self.registry.dump()
+        dump["started"] = self.started
+        write_dump(self.path(), dump)
+        return dump
+
+    def compact(self):
+        """Folds the files of workers that exited into the aggregate file.
+
+        Runs under the exclusive lock, so workers starting together never
+        fold a file twice and a scrape never sees it both folded and not.
+        The file of an older worker with a reused pid is folded too.
+
+        Returns:
+            count[int] -- Number of worker files folded.
+        """
+        with self.locked(fcntl.LOCK_EX):
+            dumps = {}
+            for path in glob.glob(os.path.join(self.directory, FILE_PATTERN)):
+                if os.path.basename(path) != AGGREGATE_FILE and path != self.path():
+                    dump = read_dump(path)
+                    if dump is not None:
+                        dumps[path] = dump
+            latest = {os.getpid(): self.started}
+            for dump in dumps.values():
+                pid = dump["pid"]
+                latest[pid] = max(latest.get(pid, 0), dump.get("started", 0))
+            dead = [
+                path
+                for path, dump in dumps.items()
+                if dump.get("started", 0) < latest[dump["pid"]] or not pid_alive(dump["pid"])
+            ]
+            if not dead:
+                return 0
+            aggregate_path = os.path.join(self.directory, AGGREGATE_FILE)
+            folded = [dumps[path] for path in dead]
+            aggregate = read_dump(aggregate_path)
+            if aggregate is not None:
+                folded.append(aggregate)
+            write_dump(aggregate_path, fold_dumps(folded))
+            for path in dead:
+                os.unlink(path)
+        return len(dead)
+
+    def exposition(self):
+        """Renders the metrics of every worker, blocks until done.
+
+        Returns:
+            text[str] -- The merged metrics in the exposition format.
+        """
+        if not self.directory:
+            return render(merge_dumps([self.registry.dump()]))
+        dumps = [self.write()]
+        with self.locked(fcntl.LOCK_SH):
+            for path in glob.glob(os.path.join(self.directory, FILE_PATTERN)):
+                if path == self.path():
+                    continue
+                dump = read_dump(path)
+                if dump is not None:
+                    dumps.append(dump)
+        return render(merge_dumps(dumps))
+
+    async def run(self):
+        """Folds the files of exited workers, then dumps every interval."""
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self.compact)
+        except Exception:
+            logger.exception("Folding the metrics of exited workers failed")
+        while True:
+            try:
+                await loop.run_in_executor(None, self.write)
+            except Exception:
+                logger.exception("Writing the metrics of this worker failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Runs the dumps as a background task, if there is a directory."""
+        if self.task is None and self.directory:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        """Cancels the background task and writes the final values."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+            self.write()
+
+
+class LoopLagMonitor(object):
+    """Measures how late the event loop wakes up a sleeping task."""
+
+    def __init__(self, histogram, interval=0.1):
+        """Creates the monitor, call ``start`` to run it in the background.
+
+        Keyword Arguments:
+            histogram {Histogram} -- Gets every lag, in seconds.
+            interval {float} -- Seconds slept between two measures.
+        """
+        self.histogram = histogram
+        self.interval = interval
+        self.last_lag = 0.0
+        self.task = None
+
+    async def run(self):
+        """Sleeps and measures until cancelled."""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(time.perf_counter() - start - self.interval, 0.0)
+            self.histogram.observe((), self.last_lag)
+
+    def start(self):
+        """Runs the monitor as a background task on the current loop."""
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        """Cancels the background task."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+# The metrics of this worker.
+metrics = MetricsRegistry()
+
+requests_total = metrics.counter(
+    "masquerader_requests_total",
+    "Requests served, by identifier, method, matched mock and status.",
+    ("identifier", "method", "mock", "status"),
+)
+
+request_seconds = metrics.histogram(
+    "masquerader_request_seconds",
+    "Time to serve a request, by identifier, method and matched mock.",
+    ("identifier", "method", "mock"),
+)
+
+stage_seconds = metrics.histogram(
+    "masquerader_stage_seconds",
+    "Time spent in a stage of serving a mock: lookup or modify.",
+    ("stage",),
+)
+
+upstream_seconds = metrics.histogram(
+    "masquerader_upstream_seconds",
+    "Time until an upstream answered with its headers, by host and outcome.",
+    ("host", "outcome"),
+)
+
+loop_lag_seconds = metrics.histogram(
+    "masquerader_event_loop_lag_seconds",
+    "How late the event loop woke up a sleeping task.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+loop_stalls_total = metrics.counter(
+    "masquerader_event_loop_stalls_total",
+    "Event loop blocks longer than LOOP_STALL_THRESHOLD, logged with their stack.",
+)
+
+
+class RequestMetrics(object):
+    """ASGI middleware counting and timing every http request.
+
+    The endpoints and the fast path put the matched mock in the scope as
+    ``scope["mock"] = (identifier, url template)``. Requests that matched
+    no mock are counted with empty identifier and mock labels, so the
+    number of series is bounded by the mocks, not by the callers.
+    """
+
+    def __init__(self, app):
+        """Wraps the app.
+
+        Keyword Arguments:
+            app {ASGI app} -- The rest of the stack.
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        """Serves the request and records its status and duration."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            identifier, mock = scope.get("mock") or ("", "")
+            labels = (identifier or "", scope["method"], mock)
+            request_seconds.observe(labels, time.perf_counter() - start)
+            requests_total.inc(labels + (str(status[0]),))
@@ -37,6 +37,7 @@ class Urls(Base):
     headers = Column(JSON)
     status_code = Column(Integer)
     latency = Column(Integer)
+    latency_spec = Column(JSON)
     is_active = Column(Boolean, default=True)
     inactive_status_code = Column(Integer)
     inactive_response = Column(String)
@@ -95,6 +96,9 @@ class UrlCollection(Base):
     request_headers = Column(JSON)
     response_key = Column(String)
     latency = Column(Integer)
+    latency_spec = Column(JSON)
+    cache_ttl = Column(Integer)
+    upstreams = Column(JSON)
     is_active = Column(Boolean, default=True)
     created_on = Column(DateTime, default=datetime.datetime.utcnow)
     created_by = Column(Integer, ForeignKey("users.id"))
@@ -111,3 +115,41 @@ Index(
     UrlCollection.request_type.desc(),
     UrlCollection.is_deleted.desc(),
 )
+
+
+class MockChange(Base):
+    """This is the mock_changes table.
+
+    Every crud mutation of urls or url_collection writes a row here in the
+    same transaction, workers replay the rows after their last seen id to
+    keep their in-memory mocks up to date.
+    """
+
+    __tablename__ = "mock_changes"
+
+    id = Column(Integer, primary_key=True, index=True)  # noqa
+    tag = Column(String)
+    row_id = Column(Integer)
+    identifier = Column(String)
+    created_on = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class RecordMode(Base):
+    """This is the record_modes table.
+
+    While an identifier has an active row here, its requests that match no
+    mock are proxied to target_url and the responses are stored as mocks
+    of the identifier. With proxy set, matched requests are proxied too
+    and only teach their mock its latency histogram.
+    """
+
+    __tablename__ = "record_modes"
+
+    id = Column(Integer, primary_key=True, index=True)  # noqa
+    identifier = Column(String, index=True)
+    target_url = Column(String)
+    proxy = Column(Boolean, default=False)
+    is_active = Column(Boolean, default=True)
+    created_on = Column(DateTime, default=datetime.datetime.utcnow)
+    created_by = Column(Integer, ForeignKey("users.id"))
+    stopped_on = Column(DateTime)
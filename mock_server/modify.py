@@ -0,0 +1,213 @@
+"""Safe, compiled handling of the x-modify-response/x-modify-body headers.
+
+The header is parsed as a JSON object (or a Python literal dict, which the
+old ``eval`` accepted), never evaluated. Its dotted keys are compiled into
+a plan of path setters applied copy-on-write to the pre-parsed mock body:
+only the containers on a modified path are copied. Results are kept in an
+LRU keyed by (mock id, mock version, header hash), since clients tend to
+send the same few overrides over and over.
+"""
+import ast
+from collections import OrderedDict
+import hashlib
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+SEPARATOR = "."
+
+MISSING = object()
+
+
+class ModifyError(ValueError):
+    """Raised for a malformed modification header."""
+
+
+def dumps(document):
+    """Encodes a document to JSON bytes, with orjson when installed.
+
+    Arguments:
+        document {Any} -- The JSON document.
+
+    Returns:
+        body[bytes] -- The encoded document.
+    """
+    if orjson is not None:
+        return orjson.dumps(document)
+    return json.dumps(document).encode("utf-8")
+
+
+def loads(body):
+    """Decodes a JSON document, with orjson when installed.
+
+    Arguments:
+        body {str} -- The JSON text, str, bytes or a memoryview.
+
+    Returns:
+        document[Any] -- The decoded document.
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    if isinstance(body, memoryview):
+        body = bytes(body)
+    return json.loads(body)
+
+
+def parse_header(header):
+    """Parses a modification header into a dict of dotted paths.
+
+    Arguments:
+        header {str} -- ``{"a.b": 1, "c": "x"}``
+
+    Raises:
+        ModifyError: if the header is not a dict literal with str keys.
+
+    Returns:
+        modifications[dict] -- Dotted path to new value.
+    """
+    try:
+        modifications = json.loads(header)
+    except ValueError:
+        try:
+            modifications = ast.literal_eval(header)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            raise ModifyError("Modification header is not a JSON object")
+    if not isinstance(modifications, dict):
+        raise ModifyError("Modification header is not a JSON object")
+    for key in modifications:
+        if not isinstance(key, str) or not key:
+            raise ModifyError("Modification keys must be dotted paths")
+    return modifications
+
+
+def compile_plan(header):
+    """Compiles a modification header into path setters.
+
+    Arguments:
+        header {str} -- The modification header.
+
+    Returns:
+        plan[tuple] -- (path segments, value) pairs.
+    """
+    return tuple(
+        (tuple(key.split(SEPARATOR)), value)
+        for key, value in parse_header(header).items()
+    )
+
+
+def _child(node, segment):
+    if isinstance(node, dict):
+        return node.get(segment, MISSING)
+    if isinstance(node, list) and segment.isdigit() and int(segment) < len(node):
+        return node[int(segment)]
+    return MISSING
+
+
+def _set(node, segment, value):
+    if isinstance(node, dict):
+        node[segment] = value
+    elif isinstance(node, list) and segment.isdigit():
+        # An existing item or the next one, never padding: a client could
+        # ask for a list of a billion items.
+        index = int(segment)
+        if index < len(node):
+            node[index] = value
+        elif index == len(node):
+            node.append(value)
+        else:
+            raise ModifyError("Index {0} is past the end of a list of {1}".format(
+                segment, len(node)
+            ))
+    else:
+        raise ModifyError("Cannot set {0} on a {1}".format(segment, type(node).__name__))
+
+
+def apply_plan(document, plan):
+    """Applies a plan copy-on-write, the document itself is never changed.
+
+    Arguments:
+        document {dict} -- The parsed mock body.
+        plan {tuple} -- Compiled by ``compile_plan``.
+
+    Raises:
+        ModifyError: if a path runs into a non container value.
+
+    Returns:
+        document[dict] -- The modified copy.
+    """
+    if not isinstance(document, (dict, list)):
+        raise ModifyError("Only JSON objects and arrays can be modified")
+    copied = set()
+
+    def own(container):
+        if id(container) in copied:
+            return container
+        container = dict(container) if isinstance(container, dict) else list(container)
+        copied.add(id(container))
+        return container
+
+    root = own(document)
+    for path, value in plan:
+        node = root
+        for segment in path[:-1]:
+            child = _child(node, segment)
+            if isinstance(child, (dict, list)):
+                child = own(child)
+            elif child is MISSING or child is None:
+                child = {}
+                copied.add(id(child))
+            else:
+                raise ModifyError("Cannot set {0} on a {1}".format(
+                    SEPARATOR.join(path), type(child).__name__
+                ))
+            _set(node, segment, child)
+            node = child
+        _set(node, path[-1], value)
+    return root
+
+
+class ModifiedCache(object):
+    """LRU of modified outputs keyed by mock id, version and header hash."""
+
+    def __init__(self, size=1024):
+        """Creates an empty cache.
+
+        Keyword Arguments:
+            size {int} -- Maximum number of outputs to keep, 0 disables it.
+        """
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, definition, header, build):
+        """Gets the modified output of a mock, building it on a miss.
+
+        Arguments:
+            definition {MockUrl} -- The mock, must have id and version.
+            header {str} -- The modification header.
+            build {callable} -- Called with the compiled plan on a miss.
+
+        Returns:
+            output[Any] -- What build returned.
+        """
+        key = (
+            definition.id,
+            definition.version,
+            hashlib.blake2b(header.encode("utf-8"), digest_size=16).digest(),
+        )
+        output = self.entries.get(key)
+        if output is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return output
+        self.misses += 1
+        output = build(compile_plan(header))
+        if self.size:
+            self.entries[key] = output
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return output
@@ -0,0 +1,251 @@
+"""Sampling profiler and event loop stall watchdog.
+
+The handlers are async but the mocks still meet blocking code now and
+then, a sync ``crud`` call or ``json.loads`` of a huge body, and every
+request of the worker waits while the loop is blocked. Both tools look at
+the loop from another thread, through ``sys._current_frames``, so they
+see the code that blocks it and add nothing to the requests served.
+
+``SamplingProfiler`` samples the stack of the loop thread, or of every
+thread, for a few seconds and counts the stacks in the collapsed format
+of flamegraph.pl, speedscope and the like: one line per stack, frames
+from the root separated by ``;``, then the number of samples.
+
+``LoopWatchdog`` gets a heartbeat from a task on the loop. When the loop
+misses it for more than the threshold, the stack of the loop thread is
+logged, at the moment it is blocked, so the offending code is on top.
+"""
+import asyncio
+from collections import Counter, deque
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# Longest profile, the sampling thread is busy for that long.
+MAX_PROFILE_SECONDS = 60.0
+
+
+def frame_name(frame):
+    """Names a frame for a collapsed stack.
+
+    Arguments:
+        frame {frame} -- A Python frame.
+
+    Returns:
+        name[str] -- The function, its file and line.
+    """
+    code = frame.f_code
+    path = code.co_filename.rsplit(os.sep, 2)
+    return "{0} ({1}:{2})".format(
+        code.co_name, "/".join(path[-2:]), frame.f_lineno
+    ).replace(";", ":")
+
+
+def collapse(frame):
+    """Formats the stack of a frame, from the root, for a flamegraph.
+
+    Arguments:
+        frame {frame} -- The innermost frame of the stack.
+
+    Returns:
+        stack[str] -- The frame names separated by ``;``.
+    """
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler(object):
+    """Counts the stacks of running threads at a fixed interval."""
+
+    def __init__(self, interval=0.005):
+        """Creates the profiler.
+
+        Keyword Arguments:
+            interval {float} -- Seconds between two samples. (default: {0.005})
+        """
+        self.interval = interval
+        self.running = False
+        self.profiles = 0
+
+    def sample(self, seconds, thread_id=None):
+        """Samples the stacks for a while, blocking the calling thread.
+
+        Arguments:
+            seconds {float} -- How long to sample.
+
+        Keyword Arguments:
+            thread_id {int} -- The thread sampled, every other thread but
+            the calling one if None, with the thread name as root.
+
+        Returns:
+            counts[Counter] -- Number of samples per collapsed stack.
+        """
+        counts = Counter()
+        names = {}
+        own = threading.get_ident()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (thread_id is not None and ident != thread_id):
+                    continue
+                stack = collapse(frame)
+                if thread_id is None:
+                    if ident not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack = "{0};{1}".format(names.get(ident, ident), stack)
+                counts[stack] += 1
+            time.sleep(self.interval)
+        return counts
+
+    async def profile(self, seconds, all_threads=False):
+        """Samples the loop thread, or every thread, from a worker thread.
+
+        Arguments:
+            seconds {float} -- How long to sample.
+
+        Keyword Arguments:
+            all_threads {bool} -- Samples the db and executor threads too.
+
+        Raises:
+            ValueError: if seconds is out of range.
+            RuntimeError: if a profile is running already.
+
+        Returns:
+            profile[str] -- The collapsed stacks, most sampled first.
+        """
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise ValueError(
+                "Profile seconds must be between 0 and {0}".format(MAX_PROFILE_SECONDS)
+            )
+        if self.running:
+            raise RuntimeError("A profile is running already")
+        self.running = True
+        try:
+            thread_id = None if all_threads else threading.get_ident()
+            loop = asyncio.get_event_loop()
+            counts = await loop.run_in_executor(None, self.sample, seconds, thread_id)
+        finally:
+            self.running = False
+        self.profiles += 1
+        return "".join(
+            "{0} {1}\n".format(stack, count) for stack, count in counts.most_common()
+        )
+
+
+class LoopWatchdog(object):
+    """Logs the stack of the code blocking the event loop too long."""
+
+    def __init__(self, threshold=0.25, counter=None, keep=20):
+        """Creates the watchdog, call ``start`` on the loop to run it.
+
+        Keyword Arguments:
+            threshold {float} -- Seconds the loop can be blocked before it
+            is reported, never reported if 0. (default: {0.25})
+            counter {Counter} -- Counts the stalls. (default: {None})
+            keep {int} -- Number of recent stalls kept. (default: {20})
+        """
+        self.threshold = threshold
+        self.interval = threshold / 5
+        self.counter = counter
+        self.stalls = deque(maxlen=keep)
+        self.stalled = 0
+        self.beat = time.perf_counter()
+        self.reported = None
+        self.loop = None
+        self.loop_thread = None
+        self.task = None
+        self.thread = None
+        self.stopped = threading.Event()
+        if counter is not None:
+            counter.inc((), 0)
+
+    async def heartbeat(self):
+        """Beats on the loop until cancelled, completes the stall reported."""
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            stall = self.reported
+            if stall is not None:
+                stall["seconds"] = round(now - self.beat - self.interval, 3)
+                self.reported = None
+            self.beat = now
+
+    def watch(self):
+        """Checks the heartbeat from its own thread until stopped."""
+        while not self.stopped.wait(self.interval):
+            if not self.loop.is_running():
+                self.beat = time.perf_counter()
+                continue
+            blocked = time.perf_counter() - self.beat
+            if blocked > self.threshold and self.reported is None:
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is not None:
+                    self.report(blocked, frame)
+
+    def report(self, blocked, frame):
+        """Logs and keeps a stall, with the stack of the loop thread.
+
+        Keyword Arguments:
+            blocked {float} -- Seconds the loop was blocked so far.
+            frame {frame} -- The frame running on the loop thread.
+        """
+        stack = traceback.format_stack(frame)
+        logger.warning(
+            "Event loop blocked for more than %.3fs, in:\n%s", blocked, "".join(stack)
+        )
+        self.stalled += 1
+        if self.counter is not None:
+            self.counter.inc()
+        self.reported = {
+            "at": time.time(),
+            "seconds": round(blocked, 3),
+            "stack": "".join(stack).splitlines(),
+        }
+        self.stalls.append(self.reported)
+
+    def start(self):
+        """Runs the heartbeat on the current loop and the watchdog thread."""
+        if self.threshold <= 0 or self.task is not None:
+            return
+        self.loop = asyncio.get_event_loop()
+        self.loop_thread = threading.get_ident()
+        self.beat = time.perf_counter()
+        self.stopped.clear()
+        self.task = asyncio.ensure_future(self.heartbeat())
+        self.thread = threading.Thread(target=self.watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    async def stop(self):
+        """Cancels the heartbeat and stops the watchdog thread."""
+        if self.task is None:
+            return
+        self.stopped.set()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        self.thread.join()
+        self.thread = None
+
+    def stats(self):
+        """Stalls reported by the watchdog.
+
+        Returns:
+            stats[dict] -- Threshold, number of stalls and the recent ones
+            with the stack of the loop thread, latest first.
+        """
+        return {
+            "threshold": self.threshold,
+            "stalled": self.stalled,
+            "recent": list(reversed(self.stalls)),
+        }
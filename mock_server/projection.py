@@ -0,0 +1,239 @@
+"""Streaming projection of upstream JSON on a collection's response_key.
+
+``response_key`` is a dotted path (``data.items.0.name``, digits index
+arrays). The projector is fed the upstream body chunk by chunk and only
+tokenizes the containers on the path; every other subtree is skipped by a
+single regex that jumps over everything but brackets, strings included.
+The projected value is cut out of the body as raw JSON bytes, so neither
+the document nor the value is ever parsed into Python objects, and the
+projector holds at most the projected value plus one chunk.
+"""
+import json
+import re
+import zlib
+
+SEPARATOR = "."
+
+# Runs of anything but brackets, complete strings included. Unrolled so a
+# string cut by a chunk boundary backtracks linearly.
+SKIP = re.compile(rb'[^"{}\[\]\\]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]\\]*)*', re.S)
+
+# One token of a container on the path.
+TOKEN = re.compile(
+    rb'\s*(?:([{}\[\],:])|"((?:[^"\\]|\\.)*)"|([^\s"{}\[\],:]+))', re.S
+)
+
+# The rest of a string cut by a chunk boundary, up to its closing quote.
+STRING_TAIL = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+
+OPENING = frozenset(b"{[")
+
+CLOSING = frozenset(b"}]")
+
+
+class ProjectionError(ValueError):
+    """Raised when the upstream body is not JSON or lacks the path."""
+
+
+def content_decoder(encoding):
+    """Gets an incremental decoder of a Content-Encoding.
+
+    Arguments:
+        encoding {str} -- The Content-Encoding header, may be None.
+
+    Raises:
+        ProjectionError: if the encoding is not gzip or deflate.
+
+    Returns:
+        decoder[zlib.Decompress] -- None for identity bodies.
+    """
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    raise ProjectionError("Cannot project a {0} encoded response".format(encoding))
+
+
+def parse_path(response_key):
+    """Splits a response_key into path segments.
+
+    Arguments:
+        response_key {str} -- The dotted path, may be empty.
+
+    Returns:
+        path[tuple] -- The segments, empty for the whole document.
+    """
+    if not response_key:
+        return ()
+    return tuple(response_key.split(SEPARATOR))
+
+
+class Frame(object):
+    """A container on the path being tokenized."""
+
+    __slots__ = ("is_object", "key", "expect_value")
+
+    def __init__(self, is_object):
+        """Creates the frame of a container that just opened."""
+        self.is_object = is_object
+        self.key = None if is_object else 0
+        self.expect_value = not is_object
+
+
+class JsonProjector(object):
+    """Incremental extractor of the value at a path of a JSON document."""
+
+    def __init__(self, path):
+        """Creates a projector.
+
+        Keyword Arguments:
+            path {tuple} -- Segments from ``parse_path``, empty for the
+            whole document.
+        """
+        self.path = path
+        self.buffer = bytearray()
+        self.pos = 0
+        self.stack = []
+        self.skip_depth = 0
+        self.in_string = False
+        self.capture_start = None
+        self.done = False
+        self.result = None
+
+    def feed(self, chunk):
+        """Scans the next chunk of the body.
+
+        Arguments:
+            chunk {bytes} -- The next bytes of the document.
+
+        Raises:
+            ProjectionError: if the path is not in the document.
+
+        Returns:
+            done[bool] -- True once the value is complete, the rest of the
+            body is not needed.
+        """
+        if self.done:
+            return True
+        self.buffer += chunk
+        self._scan()
+        keep = self.pos if self.capture_start is None else self.capture_start
+        if keep:
+            del self.buffer[:keep]
+            self.pos -= keep
+            if self.capture_start is not None:
+                self.capture_start = 0
+        return self.done
+
+    def close(self):
+        """Ends the document.
+
+        Raises:
+            ProjectionError: if the path is not in the document.
+
+        Returns:
+            value[bytes] -- The projected value as JSON text.
+        """
+        if not self.done:
+            self._scan(final=True)
+        if not self.done:
+            self._missing()
+        return self.result
+
+    def _missing(self):
+        if not self.path:
+            raise ProjectionError("Upstream response is not JSON")
+        raise ProjectionError(
+            "response_key {0} not found".format(SEPARATOR.join(self.path))
+        )
+
+    def _finish(self, end):
+        self.result = bytes(self.buffer[self.capture_start:end])
+        self.pos = end
+        self.done = True
+
+    def _scan(self, final=False):
+        buffer = self.buffer
+        while not self.done:
+            if self.skip_depth:
+                if not self._skip(buffer):
+                    return
+                continue
+            match = TOKEN.match(buffer, self.pos)
+            if match is None or (
+                match.group(3) and match.end() == len(buffer) and not final
+            ):
+                # Incomplete string or scalar, wait for the next chunk.
+                return
+            self._token(match)
+
+    def _skip(self, buffer):
+        if self.in_string:
+            end = STRING_TAIL.match(buffer, self.pos).end()
+            self.pos = end
+            if end == len(buffer) or end + 1 == len(buffer) and buffer[end] == ord("\\"):
+                return False
+            self.pos += 1
+            self.in_string = False
+        end = SKIP.match(buffer, self.pos).end()
+        self.pos = end
+        if end == len(buffer):
+            return False
+        self.pos = end + 1
+        if buffer[end] == ord('"'):
+            self.in_string = True
+            return True
+        if buffer[end] in OPENING:
+            self.skip_depth += 1
+            return True
+        if buffer[end] not in CLOSING:
+            raise ProjectionError("Upstream response is not JSON")
+        self.skip_depth -= 1
+        if not self.skip_depth and self.capture_start is not None:
+            self._finish(self.pos)
+        return True
+
+    def _token(self, match):
+        start = match.end() - len(match.group().lstrip())
+        self.pos = match.end()
+        punctuation, string, scalar = match.groups()
+        frame = self.stack[-1] if self.stack else None
+        if frame is not None and punctuation in (b"}", b"]"):
+            # The container on the path closed without the value.
+            self._missing()
+        if frame is not None and punctuation == b",":
+            if not frame.is_object:
+                frame.key += 1
+            return
+        if frame is not None and punctuation == b":":
+            frame.expect_value = True
+            return
+        if frame is not None and not frame.expect_value:
+            if string is None:
+                raise ProjectionError("Upstream response is not JSON")
+            frame.key = json.loads(b'"' + string + b'"')
+            return
+        depth = len(self.stack)
+        on_path = depth == 0 or str(frame.key) == self.path[depth - 1]
+        if frame is not None and frame.is_object:
+            frame.expect_value = False
+        if punctuation in (b"{", b"["):
+            if on_path and depth == len(self.path):
+                self.capture_start = start
+                self.skip_depth = 1
+            elif on_path:
+                self.stack.append(Frame(punctuation == b"{"))
+            else:
+                self.skip_depth = 1
+            return
+        if punctuation is not None:
+            raise ProjectionError("Upstream response is not JSON")
+        if on_path and depth == len(self.path):
+            self.capture_start = start
+            self._finish(self.pos)
+        elif on_path:
+            # A scalar where the path needs a container.
+            self._missing()
@@ -0,0 +1,279 @@
+"""Record mode: responses of unmatched requests become mocks.
+
+Recorded urls are queued in memory and written by one background task
+per worker, a batch at a time, with a single multi-row insert and one
+change log row per identifier. Recording a session of thousands of
+requests therefore costs a few statements instead of a commit and a
+refresh per url, and the proxied traffic never waits on the database.
+
+The upstream timings are kept as latency histograms, so a recorded url
+replays the latency distribution it was recorded with. In proxy mode the
+urls that already exist are proxied too, only to learn their histogram.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+
+from mock_server import crud
+from mock_server.database import run_in_db_thread
+from mock_server.histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class RecordWriter(object):
+    """Batches recorded urls into multi-row inserts.
+
+    Every upstream timing is kept in a latency histogram: the one of a
+    queued url, stored as its latency_spec, or the one of an existing url
+    in proxy mode, merged into the stored histogram on the next write.
+    """
+
+    def __init__(self, session_factory, batch_size=500, interval=0.5, max_pending=10000):
+        """Creates the writer, call ``start`` to run it in the background.
+
+        Keyword Arguments:
+            session_factory {callable} -- Returns a new db Session.
+            batch_size {int} -- Urls written by one insert at most.
+            interval {float} -- Seconds a url waits for its batch at most.
+            max_pending {int} -- Queued urls and histograms kept at most,
+            newer ones are dropped until the queue drains.
+        """
+        self.session_factory = session_factory
+        self.batch_size = max(batch_size, 1)
+        self.interval = interval
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.writing = set()
+        self.timings = {}
+        self.written = 0
+        self.merged = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+        self.wakeup = None
+        self.task = None
+
+    def add(self, key, row, latency_ms):
+        """Queues a recorded url.
+
+        Arguments:
+            key {tuple} -- Identifier, method, path and query of the url.
+            row {dict} -- Column values of the urls table.
+            latency_ms {float} -- Time the upstream took.
+
+        Returns:
+            queued[bool] -- False if the url was already queued, its
+            histogram counts the latency then, or if the queue is full.
+        """
+        with self.lock:
+            if key in self.pending:
+                self.pending[key][1].record(latency_ms)
+                return False
+            if key in self.writing:
+                return False
+            if len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            histogram = LatencyHistogram()
+            histogram.record(latency_ms)
+            self.pending[key] = (row, histogram)
+            full = len(self.pending) >= self.batch_size
+        if full and self.wakeup is not None:
+            self.wakeup.set()
+        return True
+
+    def observe(self, url_id, latency_ms):
+        """Counts an upstream timing of an existing url.
+
+        Keyword Arguments:
+            url_id {int} -- Id of the url.
+            latency_ms {float} -- Time the upstream took.
+        """
+        with self.lock:
+            histogram = self.timings.get(url_id)
+            if histogram is None:
+                if len(self.timings) >= self.max_pending:
+                    self.dropped += 1
+                    return
+                histogram = self.timings[url_id] = LatencyHistogram()
+            histogram.record(latency_ms)
+
+    def take(self):
+        """Removes the next batch from the queue.
+
+        Returns:
+            batch[tuple] -- Keys, rows with their latency_spec and the
+            histograms of existing urls keyed by id.
+        """
+        with self.lock:
+            keys = list(itertools.islice(self.pending, self.batch_size))
+            rows = []
+            for key in keys:
+                row, histogram = self.pending.pop(key)
+                rows.append(dict(row, latency=0, latency_spec=histogram.to_spec()))
+            self.writing.update(keys)
+            timings, self.timings = self.timings, {}
+        return keys, rows, timings
+
+    def write(self, batch):
+        """Inserts a batch, blocks until committed.
+
+        Keyword Arguments:
+            batch {tuple} -- A batch from ``take``.
+        """
+        keys, rows, timings = batch
+        db = self.session_factory()
+        try:
+            crud.CreateRecordedUrls(db, rows)
+            crud.MergeLatencyHistograms(db, timings)
+        except Exception:
+            db.rollback()
+            with self.lock:
+                self.failed += len(rows) + len(timings)
+            raise
+        finally:
+            db.close()
+            with self.lock:
+                self.writing.difference_update(keys)
+        with self.lock:
+            self.written += len(rows)
+            self.merged += len(timings)
+            self.batches += 1
+
+    async def flush(self):
+        """Writes every queued url and histogram."""
+        batch = self.take()
+        while batch[1] or batch[2]:
+            try:
+                await run_in_db_thread(self.write, batch)
+            except Exception:
+                logger.exception("Writing %d recorded urls failed", len(batch[1]))
+            batch = self.take()
+
+    async def run(self):
+        """Writes batches as they fill up or every interval until cancelled."""
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Runs the writer as a background task on the current loop."""
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        """Cancels the background task and writes what is still queued."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    def stats(self):
+        """Gets the queue length and the write counters.
+
+        Returns:
+            stats[dict] -- Queued, written, dropped and failed urls, and
+            the histograms merged into existing urls.
+        """
+        with self.lock:
+            return {
+                "pending": len(self.pending),
+                "pending_histograms": len(self.timings),
+                "written": self.written,
+                "merged": self.merged,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
+
+
+class RecordModes(object):
+    """The active record modes, reloaded in the background.
+
+    Served requests only read the in-memory copy, so checking for record
+    or proxy mode never touches the database. A mode started or stopped
+    on another worker is seen here after at most one interval.
+    """
+
+    def __init__(self, session_factory, interval=1.0):
+        """Creates an empty set, call ``start`` to load it in the background.
+
+        Keyword Arguments:
+            session_factory {callable} -- Returns a new db Session.
+            interval {float} -- Seconds between reloads.
+        """
+        self.session_factory = session_factory
+        self.interval = interval
+        self.modes = {}
+        self.task = None
+
+    def get(self, identifier):
+        """Gets the record mode of an identifier.
+
+        Arguments:
+            identifier {str} -- The identifier, may be None.
+
+        Returns:
+            mode[models.RecordMode] -- The active mode, None when not recording.
+        """
+        return self.modes.get(identifier)
+
+    def put(self, identifier, mode):
+        """Applies a mode started or stopped by this worker.
+
+        Keyword Arguments:
+            identifier {str} -- The identifier.
+            mode {models.RecordMode} -- The active mode, None when stopped.
+        """
+        modes = dict(self.modes)
+        if mode is None:
+            modes.pop(identifier, None)
+        else:
+            modes[identifier] = mode
+        self.modes = modes
+
+    def load(self):
+        """Reloads the active modes, blocks until done."""
+        db = self.session_factory()
+        try:
+            self.modes = {mode.identifier: mode for mode in crud.GetRecordings(db)}
+        finally:
+            db.close()
+
+    async def run(self):
+        """Reloads the modes every interval until cancelled."""
+        while True:
+            try:
+                await run_in_db_thread(self.load)
+            except Exception:
+                logger.exception("Loading record modes failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Runs the reloads as a background task on the current loop."""
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        """Cancels the background task."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,140 @@
+"""Pre-serialized responses of mocked urls.
+
+Every mock is compiled once, when it is written or loaded, into the exact
+bytes Starlette sends: the encoded body and the raw header list with
+Content-Length and a strong ETag. Serving a mock only copies references.
+A body may be a read-only memoryview, a slice of a mapped snapshot file.
+"""
+import hashlib
+
+from starlette.responses import Response
+
+CHARSET = "utf-8"
+
+SKIPPED_HEADERS = (b"content-length",)
+
+
+class CompiledResponse(object):
+    """Status, body bytes and raw headers ready to be sent."""
+
+    __slots__ = ("status_code", "body", "raw_headers", "etag", "not_modified")
+
+    def __init__(self, status_code, body, raw_headers, etag=None):
+        """Creates a compiled response, see ``compile_response``.
+
+        Keyword Arguments:
+            status_code {int} -- The status code.
+            body {bytes} -- The encoded body, bytes or a memoryview.
+            raw_headers {list} -- (name, value) byte pairs, names lower case.
+            etag {bytes} -- The ETag header value of the body.
+        """
+        self.status_code = status_code
+        self.body = body
+        self.raw_headers = raw_headers
+        self.etag = etag
+        self.not_modified = None
+        if etag is not None:
+            self.not_modified = CompiledResponse(304, b"", [(b"etag", etag)])
+
+
+def make_etag(body):
+    """Creates a strong ETag for a body.
+
+    Arguments:
+        body {bytes} -- The encoded body.
+
+    Returns:
+        etag[bytes] -- Quoted hash of the body.
+    """
+    return b'"' + hashlib.blake2b(body, digest_size=16).hexdigest().encode() + b'"'
+
+
+def encode_body(content):
+    """Encodes the stored body of a mock.
+
+    Arguments:
+        content {str} -- The body, str, bytes or a memoryview.
+
+    Returns:
+        body[bytes] -- The encoded body, a memoryview is kept as is.
+    """
+    if content is None:
+        return b""
+    if isinstance(content, (bytes, memoryview)):
+        return content
+    return str(content).encode(CHARSET)
+
+
+def compile_response(status_code, content, headers=None, etag=True):
+    """Compiles a mock into a ``CompiledResponse``.
+
+    Arguments:
+        status_code {int} -- The status code.
+        content {str} -- The body, str, bytes or a memoryview.
+
+    Keyword Arguments:
+        headers {dict} -- Headers of the mock.
+        etag {bool} -- Add an ETag so If-None-Match can be answered, the
+        ETag itself as bytes when it is already known.
+
+    Returns:
+        compiled[CompiledResponse] -- The response bytes.
+    """
+    body = encode_body(content)
+    raw_headers = []
+    etag_value = None
+    for name, value in (headers or {}).items():
+        raw_name = str(name).lower().encode("latin-1")
+        if raw_name in SKIPPED_HEADERS:
+            continue
+        raw_value = str(value).encode("latin-1")
+        if raw_name == b"etag":
+            etag_value = raw_value
+        raw_headers.append((raw_name, raw_value))
+    raw_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    if etag and etag_value is None:
+        etag_value = make_etag(body) if etag is True else etag
+        raw_headers.append((b"etag", etag_value))
+    return CompiledResponse(status_code, body, raw_headers, etag_value if etag else None)
+
+
+def etag_matches(if_none_match, etag):
+    """Checks an If-None-Match request header against an ETag.
+
+    Arguments:
+        if_none_match {str} -- The request header, may list several tags.
+        etag {bytes} -- The ETag of the response.
+
+    Returns:
+        matches[bool] -- True when a 304 can be sent.
+    """
+    if not if_none_match or etag is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.decode("latin-1")
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+class PrebuiltResponse(Response):
+    """Starlette response that sends a ``CompiledResponse`` as is."""
+
+    def __init__(self, compiled, extra_headers=None):
+        """Wraps the compiled response without re-encoding anything.
+
+        Keyword Arguments:
+            compiled {CompiledResponse} -- The response to send.
+            extra_headers {list} -- Raw header pairs added for this request.
+        """
+        self.status_code = compiled.status_code
+        self.body = compiled.body
+        self.background = None
+        self.raw_headers = list(compiled.raw_headers)
+        if extra_headers:
+            self.raw_headers.extend(extra_headers)
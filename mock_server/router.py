@@ -0,0 +1,147 @@
+"""Compiled route table used for matching mocked urls.
+
+Mocked urls are stored as path templates (``/user/{user_id}/orders``).
+Instead of registering every template on the FastAPI app, the templates of
+an identifier are compiled once into a segment trie and looked up in
+O(path length).
+
+A ``{param}`` node is shared by every template with a param at that
+position, whatever its name: ``/a/{id}`` and ``/a/{slug}/b`` go through
+the same node. The names are kept on the template they belong to and
+given to the values captured along the path once it matched.
+"""
+
+PARAM_PATH = "path"
+
+
+class RouteNode(object):
+    """A single path segment of the route trie."""
+
+    __slots__ = ("static", "param", "tail", "methods")
+
+    def __init__(self):
+        """Creates an empty node."""
+        self.static = {}
+        self.param = None
+        self.tail = None
+        # Method to (template, param names in path order).
+        self.methods = {}
+
+
+def split_path(path):
+    """Splits a url path into its segments.
+
+    Arguments:
+        path {str} -- The url path, with or without leading slash.
+
+    Returns:
+        segments[list] -- Path segments, trailing slash kept as "".
+    """
+    if path.startswith("/"):
+        path = path[1:]
+    return path.split("/")
+
+
+def parse_param(segment):
+    """Parses a template segment like ``{name}`` or ``{name:path}``.
+
+    Arguments:
+        segment {str} -- A single template segment.
+
+    Returns:
+        param[tuple] -- (name, convertor) or None for static segments.
+    """
+    if len(segment) < 3 or segment[0] != "{" or segment[-1] != "}":
+        return None
+    name, _, convertor = segment[1:-1].partition(":")
+    return name, convertor
+
+
+class RouteTable(object):
+    """Segment trie of mocked url templates keyed by method and path."""
+
+    def __init__(self, routes=()):
+        """Builds the trie.
+
+        Keyword Arguments:
+            routes {iterable} -- (template, method) pairs to compile.
+        """
+        self.root = RouteNode()
+        self.size = 0
+        for template, method in routes:
+            self.add(template, method)
+
+    def add(self, template, method):
+        """Adds a url template for a method to the trie.
+
+        Keyword Arguments:
+            template {str} -- The mocked url, may contain ``{param}`` parts.
+            method {str} -- GET, POST, PUT
+        """
+        node = self.root
+        names = []
+        for segment in split_path(template):
+            param = parse_param(segment)
+            if param is None:
+                node = node.static.setdefault(segment, RouteNode())
+            elif param[1] == PARAM_PATH:
+                if node.tail is None:
+                    node.tail = RouteNode()
+                names.append(param[0])
+                node = node.tail
+                break
+            else:
+                if node.param is None:
+                    node.param = RouteNode()
+                names.append(param[0])
+                node = node.param
+        if method.upper() not in node.methods:
+            self.size += 1
+        node.methods[method.upper()] = (template, tuple(names))
+
+    def match(self, path, method):
+        """Finds the template that serves a path.
+
+        Static segments win over ``{param}`` segments which win over
+        ``{param:path}`` segments.
+
+        Arguments:
+            path {str} -- The requested url path.
+            method {str} -- The request method.
+
+        Returns:
+            match[tuple] -- (template, path_params) or None if not mocked.
+        """
+        segments = split_path(path)
+        found = self._match(self.root, segments, 0, method.upper(), [])
+        if found is None:
+            return None
+        (template, names), values = found
+        return template, dict(zip(names, values))
+
+    def _match(self, node, segments, index, method, values):
+        if index == len(segments):
+            leaf = node.methods.get(method)
+            return (leaf, values) if leaf is not None else None
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            found = self._match(child, segments, index + 1, method, values)
+            if found is not None:
+                return found
+        if node.param is not None and segment:
+            values.append(segment)
+            found = self._match(node.param, segments, index + 1, method, values)
+            if found is not None:
+                return found
+            values.pop()
+        if node.tail is not None:
+            leaf = node.tail.methods.get(method)
+            if leaf is not None:
+                values.append("/".join(segments[index:]))
+                return leaf, values
+        return None
+
+    def __len__(self):
+        """Number of (template, method) pairs in the table."""
+        return self.size
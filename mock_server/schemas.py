@@ -35,7 +35,7 @@ class UrlCreate(UrlBase):
     It implements UrlBase so will have those properties too.
     """
 
-    pass
+    latency_spec: Dict = None
 
 
 class UrlUpdate(BaseModel):
@@ -51,6 +51,7 @@ class UrlUpdate(BaseModel):
     headers: Any
     status_code: Any
     latency: Any
+    latency_spec: Any
     is_active: Any
     inactive_response: Any
 
@@ -80,6 +81,9 @@ class UrlCollection(BaseModel):
     request_headers: Dict
     response_key: str
     latency: int
+    latency_spec: Dict = None
+    cache_ttl: int = None
+    upstreams: List[Dict] = None
     is_active: bool
 
 
@@ -112,6 +116,20 @@ class UrlToggle(BaseModel):
         orm_mode = True
 
 
+class RecordStart(BaseModel):
+    """Basic Validation while starting record mode of an identifier."""
+
+    identifier: str
+    target_url: str
+    proxy: bool = False
+
+
+class RecordStop(BaseModel):
+    """Basic Validation while stopping record mode of an identifier."""
+
+    identifier: str
+
+
 class UserBase(BaseModel):
     """Basic Input Validation while displaying user details."""
 
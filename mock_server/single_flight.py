@@ -0,0 +1,85 @@
+"""Coalescing of concurrent identical upstream calls.
+
+The first request of a key becomes the leader and calls the upstream; the
+identical requests arriving while it is in flight wait for the leader's
+response instead of sending their own. Followers wait through a shield, so
+a follower going away never cancels the shared call. A leader that fails,
+is cancelled or gets a body too large to share releases its followers
+with None, and they fall back to their own upstream call.
+"""
+import asyncio
+
+
+class SingleFlight(object):
+    """In-flight upstream calls keyed like the upstream cache."""
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        """Creates an empty flight table.
+
+        Keyword Arguments:
+            max_bytes {int} -- Largest body shared with followers.
+        """
+        self.max_bytes = max_bytes
+        self.flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+
+    def join(self, key):
+        """Joins the flight of a key, starting it if none is in flight.
+
+        Arguments:
+            key {tuple} -- Built by ``cache_key``.
+
+        Returns:
+            flight[tuple] -- (future, leader), the leader must call ``finish``.
+        """
+        future = self.flights.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future, False
+        future = asyncio.get_event_loop().create_future()
+        self.flights[key] = future
+        self.leaders += 1
+        return future, True
+
+    async def wait(self, future):
+        """Waits for the leader of a flight.
+
+        Arguments:
+            future {Future} -- Returned by ``join``.
+
+        Returns:
+            compiled[CompiledResponse] -- The shared response, None if the
+            follower has to call the upstream itself.
+        """
+        compiled = await asyncio.shield(future)
+        if compiled is None:
+            self.fallbacks += 1
+        return compiled
+
+    def finish(self, key, future, compiled):
+        """Ends a flight and hands its response to the followers.
+
+        Keyword Arguments:
+            key {tuple} -- The key passed to ``join``.
+            future {Future} -- The future returned to the leader.
+            compiled {CompiledResponse} -- The response, None on failure.
+        """
+        if self.flights.get(key) is future:
+            del self.flights[key]
+        if not future.done():
+            future.set_result(compiled)
+
+    def stats(self):
+        """Gets the flight counters.
+
+        Returns:
+            stats[dict] -- Upstream calls made, saved and fallen back.
+        """
+        return {
+            "in_flight": len(self.flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,498 @@
+"""Mock snapshots pushed from the control plane to the data plane.
+
+``MODE`` picks what a process does:
+
+    server   admin API and mocked traffic on one db, the default
+    control  server, and also publishes a snapshot of every mock
+    data     mocked traffic only, from the snapshots, never opens a db
+             connection, admin endpoints answer 503
+
+The control process writes the snapshot to ``SNAPSHOT_PATH`` whenever the
+change log moves. It writes a temporary file next to it and renames it
+over the old one, so readers see either the old or the new snapshot,
+never a partial one. Each data plane worker polls the file and swaps all
+its mocks to the new version at once.
+
+The snapshot is a binary file every worker maps read-only, so the page
+cache holds one copy of the response bodies however many workers run:
+
+    header   magic, format, index slots, version, creation time, offset
+             of the index and size of the file
+    blobs    encoded response bodies, each distinct body stored once
+    records  one JSON record per tag and identifier with its rows, the
+             response columns of urls hold the offset and length of
+             their body blob and the ETag of the response is stored
+    index    open addressing hash table of (tag, identifier) to the
+             offset and length of the record
+
+A worker only maps the file and reads the header when a snapshot
+arrives, which takes milliseconds whatever its size, so a restarted
+worker serves right away. The record of an identifier is parsed on the
+first request for it, its response bodies stay memoryview slices of the
+mapping and are sent from there without a copy.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from types import SimpleNamespace
+
+from mock_server import crud
+from mock_server.cache import COLLECTION_TAG, URL_TAG
+from mock_server.database import run_in_db_thread
+from mock_server.responses import encode_body, make_etag
+
+logger = logging.getLogger(__name__)
+
+SERVER_MODE = "server"
+CONTROL_MODE = "control"
+DATA_MODE = "data"
+
+SNAPSHOT_MAGIC = b"MQSNAP\x00\x00"
+SNAPSHOT_FORMAT = 2
+
+# Magic, format, index slots, version, created, index offset, file size.
+HEADER = struct.Struct("<8sIIqdQQ")
+
+# Key hash, record offset, record length. A zero length marks an empty slot.
+SLOT = struct.Struct("<QQQ")
+
+# Columns the mock cache serves from, per tag.
+SNAPSHOT_COLUMNS = {
+    URL_TAG: (
+        "id",
+        "identifier",
+        "request_type",
+        "url",
+        "response",
+        "payload",
+        "headers",
+        "status_code",
+        "latency",
+        "latency_spec",
+        "is_active",
+        "inactive_status_code",
+        "inactive_response",
+        "etag",
+    ),
+    COLLECTION_TAG: (
+        "id",
+        "identifier",
+        "request_type",
+        "url",
+        "request_url",
+        "request_body",
+        "request_headers",
+        "response_key",
+        "latency",
+        "latency_spec",
+        "cache_ttl",
+        "upstreams",
+        "is_active",
+    ),
+}
+
+# Columns of urls stored as body blobs, the record holds [offset, length].
+BLOB_COLUMNS = ("response", "inactive_response")
+
+
+def key_hash(tag, identifier):
+    """Hashes a (tag, identifier) key of the index.
+
+    Arguments:
+        tag {str} -- "url" or "collection"
+        identifier {str} -- The identifier, None for every identifier.
+
+    Returns:
+        hash[int] -- 64 bit hash, the same in every process.
+    """
+    key = tag.encode() + (b"\x01" if identifier is None else b"\x00" + identifier.encode())
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def pack_snapshot(version, rows):
+    """Encodes mock rows into a snapshot file.
+
+    Arguments:
+        version {int} -- The change log id the snapshot is at least at.
+        rows {dict} -- The live rows, keyed by tag.
+
+    Returns:
+        snapshot[bytearray] -- The content of the snapshot file.
+    """
+    data = bytearray(HEADER.size)
+    blobs = {}
+
+    def put_blob(body):
+        offset = blobs.get(body)
+        if offset is None:
+            offset = blobs[body] = len(data)
+            data.extend(body)
+        return [offset, len(body)]
+
+    records = []
+    for tag, columns in SNAPSHOT_COLUMNS.items():
+        identifiers = {}
+        for row in rows.get(tag, ()):
+            values = {column: getattr(row, column, None) for column in columns}
+            if tag == URL_TAG:
+                body = encode_body(row.response)
+                values["etag"] = make_etag(body).decode("latin-1")
+                for column in BLOB_COLUMNS:
+                    if values[column] is not None:
+                        values[column] = put_blob(encode_body(values[column]))
+            identifiers.setdefault(row.identifier, []).append(list(values.values()))
+        # The record of None lists the other identifiers, and holds the
+        # rows stored without an identifier.
+        unnamed = identifiers.pop(None, [])
+        for identifier, identifier_rows in identifiers.items():
+            records.append((tag, identifier, {"rows": identifier_rows}))
+        records.append((tag, None, {"rows": unnamed, "identifiers": list(identifiers)}))
+
+    slots = 1
+    while slots < 2 * len(records):
+        slots *= 2
+    index = [(0, 0, 0)] * slots
+    for tag, identifier, record in records:
+        record = json.dumps(
+            dict(record, tag=tag, identifier=identifier), separators=(",", ":")
+        ).encode()
+        hashed = key_hash(tag, identifier)
+        slot = hashed & (slots - 1)
+        while index[slot][2]:
+            slot = (slot + 1) & (slots - 1)
+        index[slot] = (hashed, len(data), len(record))
+        data.extend(record)
+    index_offset = len(data)
+    for slot in index:
+        data.extend(SLOT.pack(*slot))
+    HEADER.pack_into(
+        data,
+        0,
+        SNAPSHOT_MAGIC,
+        SNAPSHOT_FORMAT,
+        slots,
+        version or 0,
+        time.time(),
+        index_offset,
+        len(data),
+    )
+    return data
+
+
+def build_snapshot(db, version):
+    """Reads every live mock into a snapshot.
+
+    Arguments:
+        db {Session} -- Current db Session
+        version {int} -- The change log id the snapshot is at least at.
+
+    Returns:
+        snapshot[bytearray] -- The content of the snapshot file.
+    """
+    return pack_snapshot(
+        version, {tag: crud.GetAllUrls(db, None, tag) for tag in SNAPSHOT_COLUMNS}
+    )
+
+
+def write_snapshot(path, snapshot):
+    """Atomically replaces the snapshot file.
+
+    Keyword Arguments:
+        path {str} -- The snapshot file.
+        snapshot {bytes} -- From ``build_snapshot``.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(descriptor, "wb") as snapshot_file:
+            snapshot_file.write(snapshot)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class MappedSnapshot(object):
+    """A snapshot file mapped read-only.
+
+    The mapping stays valid after the file is replaced, and is released
+    once no served definition references one of its bodies any more.
+    """
+
+    def __init__(self, path):
+        """Maps the file and checks its header.
+
+        Arguments:
+            path {str} -- The snapshot file.
+
+        Raises:
+            ValueError: if the file is not a snapshot of a known format.
+        """
+        with open(path, "rb") as snapshot_file:
+            try:
+                self.map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError("Empty snapshot file {0}".format(path))
+        if len(self.map) < HEADER.size:
+            raise ValueError("Truncated snapshot file {0}".format(path))
+        (
+            magic,
+            snapshot_format,
+            self.slots,
+            self.version,
+            self.created,
+            self.index_offset,
+            size,
+        ) = HEADER.unpack_from(self.map, 0)
+        if magic != SNAPSHOT_MAGIC or snapshot_format != SNAPSHOT_FORMAT:
+            raise ValueError("Unknown snapshot format in {0}".format(path))
+        if size != len(self.map) or self.index_offset + self.slots * SLOT.size != size:
+            raise ValueError("Truncated snapshot file {0}".format(path))
+        self.view = memoryview(self.map)
+
+    def record(self, tag, identifier):
+        """Finds the record of a key in the index.
+
+        Arguments:
+            tag {str} -- "url" or "collection"
+            identifier {str} -- The identifier, None for every identifier.
+
+        Returns:
+            record[dict] -- The decoded record, None if the key has none.
+        """
+        hashed = key_hash(tag, identifier)
+        slot = hashed & (self.slots - 1)
+        while True:
+            slot_hash, offset, length = SLOT.unpack_from(
+                self.map, self.index_offset + slot * SLOT.size
+            )
+            if not length:
+                return None
+            if slot_hash == hashed:
+                record = json.loads(self.map[offset:offset + length])
+                if record["tag"] == tag and record["identifier"] == identifier:
+                    return record
+            slot = (slot + 1) & (self.slots - 1)
+
+    def rows(self, tag, identifier):
+        """Gets the rows of an identifier, the source of ``MockCache``.
+
+        Arguments:
+            tag {str} -- "url" or "collection"
+            identifier {str} -- The identifier, None for every identifier.
+
+        Returns:
+            rows[list] -- Rows with the served columns, bodies as memoryviews.
+        """
+        record = self.record(tag, identifier)
+        if record is None:
+            return []
+        columns = SNAPSHOT_COLUMNS[tag]
+        rows = []
+        for values in record["rows"]:
+            row = SimpleNamespace(**dict(zip(columns, values)))
+            if tag == URL_TAG:
+                for column in BLOB_COLUMNS:
+                    blob = getattr(row, column)
+                    if blob is not None:
+                        setattr(row, column, self.view[blob[0]:blob[0] + blob[1]])
+                row.etag = row.etag.encode("latin-1")
+            rows.append(row)
+        for each in record.get("identifiers", ()):
+            rows.extend(self.rows(tag, each))
+        return rows
+
+
+def read_snapshot(path):
+    """Maps a snapshot file.
+
+    Arguments:
+        path {str} -- The snapshot file.
+
+    Raises:
+        ValueError: if the file is not a snapshot of a known format.
+
+    Returns:
+        snapshot[MappedSnapshot] -- The mapped snapshot.
+    """
+    return MappedSnapshot(path)
+
+
+class SnapshotPublisher(object):
+    """Publishes a snapshot of the mocks whenever the change log moves."""
+
+    def __init__(self, session_factory, path, interval=1.0, max_age=30.0):
+        """Creates the publisher, call ``start`` to run it in the background.
+
+        Keyword Arguments:
+            session_factory {callable} -- Returns a new db Session.
+            path {str} -- The snapshot file.
+            interval {float} -- Seconds between checks of the change log.
+            max_age {float} -- Seconds after which a snapshot is rebuilt
+            even if the change log did not move, to pick up changes that
+            committed with an older id.
+        """
+        self.session_factory = session_factory
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.version = None
+        self.published_at = None
+        self.published = 0
+        self.task = None
+
+    def publish(self):
+        """Writes a new snapshot if the mocks changed, blocks until done.
+
+        Returns:
+            published[bool] -- False if the current snapshot is up to date.
+        """
+        db = self.session_factory()
+        try:
+            version = crud.GetLastChangeId(db)
+            if (
+                version == self.version
+                and time.monotonic() - self.published_at < self.max_age
+                and os.path.exists(self.path)
+            ):
+                return False
+            snapshot = build_snapshot(db, version)
+        finally:
+            db.close()
+        write_snapshot(self.path, snapshot)
+        self.version = version
+        self.published_at = time.monotonic()
+        self.published += 1
+        return True
+
+    async def run(self):
+        """Publishes every interval until cancelled."""
+        while True:
+            try:
+                await run_in_db_thread(self.publish)
+            except Exception:
+                logger.exception("Publishing the mock snapshot failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Runs the publisher as a background task on the current loop."""
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        """Cancels the background task."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self):
+        """Gets the last published version.
+
+        Returns:
+            stats[dict] -- Version and number of snapshots written.
+        """
+        return {"path": self.path, "version": self.version, "published": self.published}
+
+
+class SnapshotLoader(object):
+    """Swaps the mocks of a data plane worker to each new snapshot."""
+
+    def __init__(self, path, cache, interval=1.0):
+        """Creates the loader, call ``start`` to run it in the background.
+
+        Keyword Arguments:
+            path {str} -- The snapshot file.
+            cache {MockCache} -- The cache to load.
+            interval {float} -- Seconds between checks of the file.
+        """
+        self.path = path
+        self.cache = cache
+        self.interval = interval
+        self.signature = None
+        self.version = None
+        self.loaded_at = None
+        self.loads = 0
+        self.task = None
+
+    def poll(self):
+        """Loads the snapshot file if it was replaced, blocks until done.
+
+        Returns:
+            loaded[bool] -- False if the file did not change or is missing.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self.signature:
+            return False
+        snapshot = read_snapshot(self.path)
+        self.cache.attach_snapshot(tuple(SNAPSHOT_COLUMNS), snapshot.rows)
+        self.signature = signature
+        self.version = snapshot.version
+        self.loaded_at = time.time()
+        self.loads += 1
+        return True
+
+    async def run(self):
+        """Checks the file every interval until cancelled."""
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.poll)
+            except Exception:
+                logger.exception("Loading the mock snapshot failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Maps the current snapshot, then runs the loader in the background.
+
+        Mapping the file only reads its header, so a restarted worker serves
+        from its first request on, without waiting for the first interval.
+        """
+        if self.task is None:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Loading the mock snapshot failed")
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        """Cancels the background task."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self):
+        """Gets the loaded version.
+
+        Returns:
+            stats[dict] -- Version, load time and number of loads.
+        """
+        return {
+            "path": self.path,
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "loads": self.loads,
+        }
@@ -0,0 +1,180 @@
+"""Keeps the in-memory mocks of a worker in sync with the change log.
+
+Every crud mutation writes ``mock_changes`` rows in its own transaction.
+Each worker polls the rows after the last id it has applied and patches
+only the changed mocks into its cache, so a write that lands on another
+worker or pod is served here after at most one sync interval.
+"""
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+import logging
+import time
+
+from mock_server import crud
+from mock_server.database import run_in_db_thread
+
+logger = logging.getLogger(__name__)
+
+PRUNE_EVERY = 3600
+
+
+class ChangeLogSync(object):
+    """Pulls change log deltas into a mock cache."""
+
+    def __init__(
+        self,
+        session_factory,
+        cache,
+        interval=1.0,
+        gap_timeout=30.0,
+        retention=None,
+        max_missing=1000,
+    ):
+        """Creates the sync, call ``start`` to run it in the background.
+
+        Keyword Arguments:
+            session_factory {callable} -- Returns a new db Session.
+            cache {MockCache} -- The cache to patch.
+            interval {float} -- Seconds between polls, the staleness bound.
+            gap_timeout {float} -- Seconds to wait for ids committed out of order.
+            retention {int} -- Seconds of change log to keep, None to never prune.
+            max_missing {int} -- Skipped ids re-checked at most. A larger gap,
+            e.g. after a setval or many rolled back inserts, is not tracked
+            id by id, the whole cache is dropped once it timed out instead.
+            As many timed out ids are still re-checked, the oldest ones are
+            forgotten first.
+        """
+        self.session_factory = session_factory
+        self.cache = cache
+        self.interval = interval
+        self.gap_timeout = gap_timeout
+        self.retention = retention
+        self.max_missing = max_missing
+        self.last_seen = None
+        self.missing = {}
+        self.expired = {}
+        self.overflows = deque()
+        self.applied = 0
+        self.last_sync = None
+        self.last_prune = time.monotonic()
+        self.task = None
+
+    def bootstrap(self):
+        """Starts following the change log from its current end.
+
+        Whatever the cache loaded before this point may be stale, so it is
+        dropped and reloaded lazily.
+        """
+        db = self.session_factory()
+        try:
+            self.last_seen = crud.GetLastChangeId(db)
+        finally:
+            db.close()
+        self.missing = {}
+        self.expired = {}
+        self.overflows.clear()
+        self.cache.invalidate()
+
+    def poll(self):
+        """Applies the changes committed since the last poll.
+
+        Ids are handed out before commit, so a lower id can become visible
+        after a higher one. Skipped ids are re-checked until gap_timeout.
+        Past max_missing of them, a gap is only timed: a change committed
+        in it is picked up by dropping the whole cache at its timeout.
+
+        A skipped id that timed out is most likely a rolled back insert,
+        but its transaction may still commit. The last max_missing timed
+        out ids keep being re-checked, a change committed that late is
+        applied and logged. An id forgotten since is never applied.
+
+        Returns:
+            count[int] -- Number of change rows applied.
+        """
+        if self.last_seen is None:
+            self.bootstrap()
+        now = time.monotonic()
+        timed_out = False
+        while self.overflows and now - self.overflows[0] >= self.gap_timeout:
+            self.overflows.popleft()
+            timed_out = True
+        if timed_out:
+            self.cache.invalidate()
+        expired = dict(self.expired)
+        for change_id, seen in self.missing.items():
+            if now - seen >= self.gap_timeout:
+                expired[change_id] = now
+        while len(expired) > self.max_missing:
+            del expired[next(iter(expired))]
+        self.missing = {
+            change_id: seen
+            for change_id, seen in self.missing.items()
+            if now - seen < self.gap_timeout
+        }
+        self.expired = expired
+        last_seen = self.last_seen
+        missing = dict(self.missing)
+        db = self.session_factory()
+        try:
+            changes = crud.GetChangesSince(db, last_seen, list(missing) + list(expired))
+            row_ids = {}
+            reloads = set()
+            for change in changes:
+                if change.row_id is None:
+                    # A batch of rows, e.g. recorded urls, reload the identifier.
+                    reloads.add((change.tag, change.identifier))
+                else:
+                    row_ids.setdefault(change.tag, set()).add(change.row_id)
+                missing.pop(change.id, None)
+                if expired.pop(change.id, None) is not None:
+                    logger.warning(
+                        "Change %s committed after the gap timeout", change.id
+                    )
+                if change.id > last_seen:
+                    if len(missing) + change.id - last_seen - 1 > self.max_missing:
+                        self.overflows.append(now)
+                    else:
+                        for change_id in range(last_seen + 1, change.id):
+                            missing[change_id] = now
+                    last_seen = change.id
+            for tag, ids in row_ids.items():
+                self.cache.apply(tag, crud.GetRowsById(db, tag, list(ids)))
+            for tag, identifier in reloads:
+                self.cache.invalidate(tag, identifier)
+            self.last_seen = last_seen
+            self.missing = missing
+            self.expired = expired
+            if self.retention and now - self.last_prune > PRUNE_EVERY:
+                self.last_prune = now
+                crud.PruneChanges(db, datetime.utcnow() - timedelta(seconds=self.retention))
+        finally:
+            db.close()
+        self.applied += len(changes)
+        self.last_sync = time.time()
+        return len(changes)
+
+    async def run(self):
+        """Polls the change log every interval until cancelled."""
+        while True:
+            try:
+                await run_in_db_thread(self.poll)
+            except Exception:
+                logger.exception("Mock change log sync failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Runs the sync as a background task on the current loop."""
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        """Cancels the background task."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
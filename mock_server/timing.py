@@ -0,0 +1,198 @@
+"""Opt-in stage timing of mocked requests.
+
+With ``STAGE_TIMING`` on, ``StageTiming`` puts a ``StageTimer`` in the
+scope of each http request. The fast path, ``Url`` and ``UrlCollection``
+mark the end of their stages on it with ``mark``:
+
+    app       FastAPI routing and header dependencies, up to the endpoint
+    load      GetIdentifierMocks, the mocks of the identifier
+    route     the route table match of the path
+    lookup    load, route and find on the fast path
+    find      the mock of the method, query and status code
+    modify    x-modify-response and x-modify-body
+    latency   the simulated latency
+    upstream  the collection request, up to the upstream headers
+    send      the rest, up to the last byte of the response
+
+Each stage lasts from the previous mark, or from the start of the
+request. The stages are sent in a ``Server-Timing`` header, in ms, with a
+``total`` up to the response headers, so without ``send``. The slowest
+requests are kept with their stages in ``SlowestRequests``.
+
+When it is off the middleware is not installed, the scope has no timer
+and ``mark`` is a dict lookup.
+"""
+import heapq
+from itertools import count
+import time
+
+SERVER_TIMING_HEADER = b"server-timing"
+
+
+class StageTimer(object):
+    """Durations of the stages of one request."""
+
+    __slots__ = ("start", "last", "stages")
+
+    def __init__(self):
+        """Starts the timer."""
+        self.start = self.last = time.perf_counter()
+        self.stages = []
+
+    def mark(self, stage):
+        """Ends a stage, started at the previous mark.
+
+        Keyword Arguments:
+            stage {str} -- Name of the stage.
+        """
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def header(self, total):
+        """Formats the stages as the value of a ``Server-Timing`` header.
+
+        Arguments:
+            total {float} -- Seconds up to the response headers.
+
+        Returns:
+            value[bytes] -- Stages and total with their duration in ms.
+        """
+        metrics = ["{0};dur={1:.3f}".format(s, d * 1000) for s, d in self.stages]
+        metrics.append("total;dur={0:.3f}".format(total * 1000))
+        return ", ".join(metrics).encode("latin-1")
+
+
+def mark(scope, stage):
+    """Ends a stage of the request if its stages are timed.
+
+    Keyword Arguments:
+        scope {dict} -- The ASGI scope of the request.
+        stage {str} -- Name of the stage.
+    """
+    timer = scope.get("timer")
+    if timer is not None:
+        timer.mark(stage)
+
+
+class SlowestRequests(object):
+    """Bounded buffer of the slowest requests of the worker."""
+
+    def __init__(self, size=50):
+        """Creates an empty buffer.
+
+        Keyword Arguments:
+            size {int} -- Number of requests kept. (default: {50})
+        """
+        self.size = size
+        self.heap = []
+        self.sequence = count()
+        self.recorded = 0
+
+    def admits(self, total):
+        """Checks if a request that took total seconds would be kept.
+
+        Arguments:
+            total {float} -- Duration of the request in seconds.
+
+        Returns:
+            admitted[bool] -- True if it is among the slowest.
+        """
+        return self.size > 0 and (len(self.heap) < self.size or total > self.heap[0][0])
+
+    def add(self, total, request):
+        """Keeps a request, dropping the fastest one when full.
+
+        Keyword Arguments:
+            total {float} -- Duration of the request in seconds.
+            request {dict} -- Details and stages of the request.
+        """
+        self.recorded += 1
+        if not self.admits(total):
+            return
+        item = (total, next(self.sequence), request)
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, item)
+        else:
+            heapq.heapreplace(self.heap, item)
+
+    def requests(self):
+        """Lists the requests kept, slowest first.
+
+        Returns:
+            requests[list] -- Details and stages of every request kept.
+        """
+        return [request for _, _, request in sorted(self.heap, reverse=True)]
+
+    def clear(self):
+        """Drops every request kept."""
+        self.heap = []
+
+
+class StageTiming(object):
+    """ASGI middleware timing the stages of every http request."""
+
+    def __init__(self, app, slowest=None):
+        """Wraps the app.
+
+        Keyword Arguments:
+            app {ASGI app} -- The rest of the stack.
+            slowest {SlowestRequests} -- Keeps the slowest requests, none
+            are kept if None.
+        """
+        self.app = app
+        self.slowest = slowest
+
+    async def __call__(self, scope, receive, send):
+        """Serves the request, sends its stages and keeps it if slow."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timer = StageTimer()
+        scope["timer"] = timer
+        status = [500]
+        sent_at = [None]
+
+        async def send_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                sent_at[0] = time.perf_counter() - timer.start
+                message = dict(message)
+                message["headers"] = list(message.get("headers", ())) + [
+                    (SERVER_TIMING_HEADER, timer.header(sent_at[0]))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timing)
+        finally:
+            timer.mark("send")
+            if self.slowest is not None:
+                self.keep(scope, timer, status[0], sent_at[0])
+
+    def keep(self, scope, timer, status, sent_at):
+        """Adds the request to the slowest ones if it is among them.
+
+        Keyword Arguments:
+            scope {dict} -- The ASGI scope of the request.
+            timer {StageTimer} -- The stages of the request.
+            status {int} -- The status sent, 500 if none was.
+            sent_at {float} -- Seconds up to the response headers, None
+            if they were not sent.
+        """
+        total = timer.last - timer.start
+        request = None
+        if self.slowest.admits(total):
+            identifier, mock = scope.get("mock") or (None, None)
+            request = {
+                "at": time.time(),
+                "method": scope["method"],
+                "path": scope["path"],
+                "identifier": identifier,
+                "mock": mock,
+                "status": status,
+                "total_ms": round(total * 1000, 3),
+                "headers_ms": None if sent_at is None else round(sent_at * 1000, 3),
+                "stages": [[s, round(d * 1000, 3)] for s, d in timer.stages],
+            }
+        self.slowest.add(total, request)
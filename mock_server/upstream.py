@@ -0,0 +1,310 @@
+"""Pooled HTTP client for the upstreams behind url collections.
+
+One ``aiohttp.ClientSession`` per worker, opened with the app and closed on
+shutdown, with bounded connections per host, keep-alive, a DNS cache and
+connect/read timeouts from config. Every upstream call is timed per host.
+
+Upstream bodies are never decoded: they are streamed to the client chunk by
+chunk as they arrive, still compressed if the upstream compressed them, so
+a proxied request holds at most one chunk in memory.
+"""
+import asyncio
+import threading
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+from starlette.responses import Response
+
+from mock_server.metrics import upstream_seconds
+
+# Headers of a single connection, never forwarded (RFC 7230 section 6.1).
+HOP_BY_HOP_HEADERS = frozenset((
+    b"connection",
+    b"keep-alive",
+    b"proxy-authenticate",
+    b"proxy-authorization",
+    b"proxy-connection",
+    b"te",
+    b"trailer",
+    b"transfer-encoding",
+    b"upgrade",
+))
+
+
+class HostStats(object):
+    """Call counters of one upstream host."""
+
+    __slots__ = ("requests", "errors", "timeouts", "seconds", "max_seconds", "statuses")
+
+    def __init__(self):
+        """Creates empty counters."""
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.statuses = {}
+
+    def as_dict(self):
+        """Returns the counters as a dict."""
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_seconds": self.seconds / self.requests if self.requests else 0.0,
+            "max_seconds": self.max_seconds,
+            "statuses": dict(self.statuses),
+        }
+
+
+class UpstreamClient(object):
+    """Keep-alive client shared by every collection request of a worker."""
+
+    def __init__(
+        self,
+        limit=100,
+        limit_per_host=20,
+        connect_timeout=5.0,
+        read_timeout=30.0,
+        dns_ttl=300,
+        keepalive_timeout=30.0,
+    ):
+        """Creates the client, the session is opened on first use or start.
+
+        Keyword Arguments:
+            limit {int} -- Maximum open connections, 0 for no limit.
+            limit_per_host {int} -- Maximum open connections per host.
+            connect_timeout {float} -- Seconds to get a connection.
+            read_timeout {float} -- Seconds between two reads of a response.
+            dns_ttl {int} -- Seconds DNS answers are cached.
+            keepalive_timeout {float} -- Seconds idle connections are kept.
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def get_session(self):
+        """Gets the session of the running loop, opening it if needed.
+
+        Returns:
+            session[ClientSession] -- The shared session.
+        """
+        loop = asyncio.get_event_loop()
+        session = self.session
+        if session is None or session.closed or session._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                auto_decompress=False,
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    connect=self.connect_timeout,
+                    sock_read=self.read_timeout,
+                ),
+            )
+            self.session = session
+        return session
+
+    async def start(self):
+        """Opens the session, called on app startup."""
+        self.get_session()
+
+    async def close(self):
+        """Closes the session and its connections, called on shutdown."""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def preconnect(self, urls):
+        """Opens a keep-alive connection to every origin of the urls.
+
+        Sends a HEAD request, a safe method, to the root of each origin
+        and releases the response, which leaves a pooled connection and a
+        cached DNS answer behind. Origins that do not answer are skipped.
+
+        Arguments:
+            urls {list} -- Upstream urls.
+
+        Returns:
+            opened[int] -- Number of origins connected.
+        """
+        origins = set()
+        for url in urls:
+            parsed = urlparse(url or "")
+            if parsed.scheme in ("http", "https") and parsed.netloc:
+                origins.add("{0}://{1}/".format(parsed.scheme, parsed.netloc))
+        session = self.get_session()
+        timeout = aiohttp.ClientTimeout(total=self.connect_timeout)
+
+        async def connect(origin):
+            try:
+                async with session.head(origin, allow_redirects=False, timeout=timeout):
+                    return True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False
+
+        return sum(await asyncio.gather(*(connect(origin) for origin in origins)))
+
+    def record(self, url, seconds, status=None, error=None):
+        """Records one upstream call.
+
+        Keyword Arguments:
+            url {str} -- The upstream url.
+            seconds {float} -- Time until the response headers arrived.
+            status {int} -- The upstream status code.
+            error {Exception} -- The failure, if the call failed.
+        """
+        host = urlparse(url).netloc
+        if isinstance(error, asyncio.TimeoutError):
+            outcome = "timeout"
+        elif error is not None:
+            outcome = "error"
+        else:
+            outcome = "{0}xx".format(status // 100) if status else "unknown"
+        upstream_seconds.observe((host, outcome), seconds)
+        with self.lock:
+            stats = self.hosts.get(host)
+            if stats is None:
+                stats = self.hosts[host] = HostStats()
+            stats.requests += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            if isinstance(error, asyncio.TimeoutError):
+                stats.timeouts += 1
+            elif error is not None:
+                stats.errors += 1
+            if status is not None:
+                stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    async def request(self, method, url, headers=None, data=None):
+        """Sends a request upstream.
+
+        The caller owns the response and must read or release it.
+
+        Arguments:
+            method {str} -- GET, POST, PUT
+            url {str} -- The upstream url.
+
+        Keyword Arguments:
+            headers {dict} -- Request headers.
+            data {bytes} -- Request body.
+
+        Raises:
+            asyncio.TimeoutError: if the upstream did not answer in time.
+            aiohttp.ClientError: if the upstream could not be reached.
+
+        Returns:
+            response[ClientResponse] -- The upstream response.
+        """
+        start = time.perf_counter()
+        try:
+            response = await self.get_session().request(
+                method, url, headers=headers, data=data
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.record(url, time.perf_counter() - start, error=e)
+            raise
+        self.record(url, time.perf_counter() - start, status=response.status)
+        return response
+
+    def stats(self):
+        """Gets the per host counters and the connection pool usage.
+
+        Returns:
+            stats[dict] -- Counters keyed by upstream host.
+        """
+        with self.lock:
+            hosts = {host: stats.as_dict() for host, stats in self.hosts.items()}
+        connector = self.session.connector if self.session is not None else None
+        return {
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "open_connections": (
+                sum(len(c) for c in connector._conns.values()) if connector else 0
+            ),
+            "hosts": hosts,
+        }
+
+
+def forward_headers(raw_headers):
+    """Drops the hop-by-hop headers of an upstream response.
+
+    Arguments:
+        raw_headers {tuple} -- (name, value) byte pairs as received.
+
+    Returns:
+        raw_headers[list] -- The end-to-end headers, names lower case.
+    """
+    dropped = set(HOP_BY_HOP_HEADERS)
+    for name, value in raw_headers:
+        if name.lower() == b"connection":
+            dropped.update(
+                token.strip().lower() for token in value.split(b",") if token.strip()
+            )
+    return [
+        (name.lower(), value)
+        for name, value in raw_headers
+        if name.lower() not in dropped
+    ]
+
+
+class StreamedResponse(Response):
+    """Starlette response relaying an upstream body as it arrives."""
+
+    def __init__(self, upstream, status_code=200, on_complete=None, tee_limit=0):
+        """Wraps an upstream response whose body is not read yet.
+
+        Keyword Arguments:
+            upstream {ClientResponse} -- Released once the body is sent.
+            status_code {int} -- The status code sent to the client.
+            on_complete {callable} -- Called with the forwarded headers and
+            the whole body once it was sent, or with None for the body if it
+            did not fit in tee_limit bytes or could not be sent.
+            tee_limit {int} -- Bytes kept for on_complete.
+        """
+        self.upstream = upstream
+        self.status_code = status_code
+        self.background = None
+        self.raw_headers = forward_headers(upstream.raw_headers)
+        self.on_complete = on_complete
+        self.tee_limit = tee_limit
+
+    async def __call__(self, scope, receive, send):
+        """Sends the upstream headers, then every chunk as it is read."""
+        chunks = []
+        size = 0
+        body = None
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            })
+            async for chunk in self.upstream.content.iter_any():
+                if chunks is not None:
+                    size += len(chunk)
+                    if size <= self.tee_limit:
+                        chunks.append(chunk)
+                    else:
+                        chunks = None
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            if chunks is not None:
+                body = b"".join(chunks)
+        finally:
+            # An unread body closes the connection instead of pooling it.
+            self.upstream.release()
+            if self.on_complete is not None:
+                self.on_complete(self.raw_headers, body)
@@ -0,0 +1,191 @@
+"""Cache of upstream responses of url collections.
+
+A collection with a ``cache_ttl`` keeps its upstream responses for that many
+seconds, keyed by collection id and version, method, a hash of the final
+request body and the headers sent upstream. Past the TTL an entry is still
+served for ``stale`` seconds while one refresh runs in the background. The
+cache is an LRU bounded by the bytes it holds.
+"""
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+from .responses import CompiledResponse
+
+
+class CachedUpstream(object):
+    """One cached upstream response."""
+
+    __slots__ = ("compiled", "size", "fresh_until", "stale_until")
+
+    def __init__(self, compiled, size, fresh_until, stale_until):
+        """Creates an entry, see ``UpstreamCache.store``.
+
+        Keyword Arguments:
+            compiled {CompiledResponse} -- The response as sent to clients.
+            size {int} -- Bytes accounted to the entry.
+            fresh_until {float} -- Monotonic time the entry expires.
+            stale_until {float} -- Monotonic time it can no longer be served.
+        """
+        self.compiled = compiled
+        self.size = size
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+def cache_key(definition, method, body, headers):
+    """Builds the cache key of an upstream request.
+
+    Arguments:
+        definition {MockCollection} -- The collection, must have id and version.
+        method {str} -- GET, POST, PUT
+        body {bytes} -- The final request body, may be None.
+        headers {dict} -- The headers sent upstream.
+
+    Returns:
+        key[tuple] -- Hashable key of the request.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if body:
+        digest.update(body if isinstance(body, bytes) else str(body).encode("utf-8"))
+    selected = tuple(sorted((str(k).lower(), str(v)) for k, v in headers.items()))
+    return definition.id, definition.version, method, digest.digest(), selected
+
+
+def compile_upstream(status_code, raw_headers, body):
+    """Compiles an upstream response with its own Content-Length.
+
+    Arguments:
+        status_code {int} -- The status code sent to clients.
+        raw_headers {list} -- Forwarded (name, value) byte pairs.
+        body {bytes} -- The body as received, still encoded.
+
+    Returns:
+        compiled[CompiledResponse] -- The response bytes.
+    """
+    raw_headers = [(k, v) for k, v in raw_headers if k != b"content-length"]
+    raw_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    return CompiledResponse(status_code, body, raw_headers)
+
+
+class UpstreamCache(object):
+    """Byte bounded LRU of upstream responses with TTL and stale serving."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, stale=0, max_entry_bytes=None):
+        """Creates an empty cache.
+
+        Keyword Arguments:
+            max_bytes {int} -- Bytes kept at most, 0 disables the cache.
+            stale {float} -- Seconds an expired entry is served while refreshed.
+            max_entry_bytes {int} -- Larger responses are not cached,
+            defaults to an eighth of max_bytes.
+        """
+        self.max_bytes = max_bytes
+        self.stale = stale
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 8
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.refreshing = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+
+    def lookup(self, key):
+        """Gets the entry of a key.
+
+        Arguments:
+            key {tuple} -- Built by ``cache_key``.
+
+        Returns:
+            result[tuple] -- (compiled response, fresh) or None on a miss.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.stale_until <= now:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            if entry.fresh_until > now:
+                self.hits += 1
+                return entry.compiled, True
+            self.stale_hits += 1
+            return entry.compiled, False
+
+    def admits(self, size):
+        """Checks if a response of size bytes can be cached."""
+        return 0 < self.max_bytes and size <= self.max_entry_bytes
+
+    def store(self, key, compiled, ttl):
+        """Caches a response, evicting the least recently used ones.
+
+        Keyword Arguments:
+            key {tuple} -- Built by ``cache_key``.
+            compiled {CompiledResponse} -- The response to cache.
+            ttl {float} -- Seconds the response is fresh.
+        """
+        size = len(compiled.body) + sum(len(k) + len(v) for k, v in compiled.raw_headers)
+        if not ttl or not self.admits(size):
+            return
+        now = time.monotonic()
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = CachedUpstream(
+                compiled, size, now + ttl, now + ttl + self.stale
+            )
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key).size
+
+    def begin_refresh(self, key):
+        """Claims the background refresh of a stale key.
+
+        Returns:
+            claimed[bool] -- False if a refresh of the key already runs.
+        """
+        with self.lock:
+            if key in self.refreshing:
+                return False
+            self.refreshing.add(key)
+            self.refreshes += 1
+            return True
+
+    def end_refresh(self, key):
+        """Releases a refresh claimed by ``begin_refresh``."""
+        with self.lock:
+            self.refreshing.discard(key)
+
+    def clear(self):
+        """Drops every entry."""
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Gets the cache counters.
+
+        Returns:
+            stats[dict] -- Entries, bytes, hits, misses and evictions.
+        """
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "refreshes": self.refreshes,
+            }
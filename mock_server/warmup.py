@@ -0,0 +1,92 @@
+"""Startup warm-up of a worker, reported by ``/_readyz``.
+
+A worker listens as soon as it starts, but its first requests would pay
+every cold cost at once: reading and compiling the mocks, opening db
+connections, resolving and connecting to the upstreams of collections.
+The warm-up pays them in the background right after startup, one step
+after the other, and the worker reports ready once every step is done.
+A failing step, e.g. while the db is still coming up, is retried.
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WarmUp(object):
+    """Runs the warm-up steps of a worker once, in order."""
+
+    def __init__(self, steps, retry_interval=1.0):
+        """Creates the warm-up, call ``start`` to run it in the background.
+
+        Keyword Arguments:
+            steps {list} -- (name, coroutine function) pairs, each function
+            returns the number of things it warmed.
+            retry_interval {float} -- Seconds before a failed step is retried.
+        """
+        self.steps = steps
+        self.retry_interval = retry_interval
+        self.ready = not steps
+        self.seconds = None
+        self.results = {}
+        self.task = None
+
+    async def run(self):
+        """Runs every step until it succeeds, then reports ready."""
+        start = time.perf_counter()
+        for name, step in self.steps:
+            attempts = 0
+            while True:
+                attempts += 1
+                step_start = time.perf_counter()
+                try:
+                    count = await step()
+                except Exception as e:
+                    logger.exception("Warm-up step %s failed", name)
+                    self.results[name] = {
+                        "count": None,
+                        "seconds": time.perf_counter() - step_start,
+                        "attempts": attempts,
+                        "error": str(e),
+                    }
+                    await asyncio.sleep(self.retry_interval)
+                    continue
+                self.results[name] = {
+                    "count": count,
+                    "seconds": time.perf_counter() - step_start,
+                    "attempts": attempts,
+                }
+                break
+        self.seconds = time.perf_counter() - start
+        self.ready = True
+        logger.info("Warm-up done in %.3fs: %s", self.seconds, self.results)
+
+    def start(self):
+        """Runs the warm-up as a background task on the current loop."""
+        if self.task is None and not self.ready:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        """Cancels the warm-up if it is still running."""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self):
+        """Gets the readiness and what each step warmed.
+
+        Returns:
+            stats[dict] -- Ready flag, total seconds and per step counts,
+            seconds and attempts.
+        """
+        return {
+            "ready": self.ready,
+            "seconds": self.seconds,
+            "steps": {name: dict(result) for name, result in self.results.items()},
+        }
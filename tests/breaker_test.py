@@ -0,0 +1,81 @@
+"""Test cases for the circuit breakers of collection upstreams."""
+from mock_server import breaker as breaker_module
+from mock_server.breaker import CircuitBreaker, LastGoodStore
+from mock_server.responses import CompiledResponse
+
+
+def test_breaker_opens_and_probes(monkeypatch):
+    """Errors open the breaker, a probe closes or reopens it."""
+    now = [0.0]
+    monkeypatch.setattr(breaker_module.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker("host", window=4, min_calls=4, open_seconds=10)
+    for success in (True, False, True):
+        token = breaker.allow()
+        assert token
+        breaker.record(success, 0.01, token)
+    assert breaker.state == "closed"
+    breaker.record(False, 0.01, breaker.allow())
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    now[0] = 11.0
+    probe = breaker.allow()
+    assert probe and breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record(False, 0.01, probe)
+    assert breaker.state == "open"
+    now[0] = 22.0
+    probe = breaker.allow()
+    assert probe
+    breaker.record(True, 0.01, probe)
+    assert breaker.state == "closed"
+    assert [t["to"] for t in breaker.stats()["transitions"]] == [
+        "open", "half_open", "open", "half_open", "closed",
+    ]
+    assert breaker.rejected == 2
+
+
+def test_breaker_opens_on_slow_calls():
+    """Slow successful calls open the breaker too."""
+    breaker = CircuitBreaker("host", window=4, min_calls=4, slow_ms=100, slow_rate=0.75)
+    for seconds in (0.2, 0.01, 0.2, 0.2):
+        breaker.record(True, seconds)
+    assert breaker.state == "open"
+    assert breaker.stats()["transitions"][0]["reason"] == "slow call rate 75%"
+
+
+def test_abandoned_probe_allows_another():
+    """A cancelled probe does not leave the breaker half open forever."""
+    breaker = CircuitBreaker("host", open_seconds=0)
+    breaker._open("test")
+    probe = breaker.allow()
+    assert probe
+    breaker.abandon(probe)
+    assert breaker.allow()
+
+
+def test_late_call_is_not_the_probe():
+    """Calls allowed before the breaker opened do not end the probe."""
+    breaker = CircuitBreaker("host", window=2, min_calls=2, open_seconds=0)
+    late, failing = breaker.allow(), breaker.allow()
+    breaker.record(False, 0.01, failing)
+    breaker.record(False, 0.01, breaker.allow())
+    assert breaker.state == "open"
+    probe = breaker.allow()
+    assert probe and breaker.state == "half_open"
+    breaker.record(True, 0.01, late)
+    breaker.abandon(late)
+    assert breaker.state == "half_open" and not breaker.allow()
+    breaker.record(True, 0.01, probe)
+    assert breaker.state == "closed"
+
+
+def test_last_good_store():
+    """The store keeps the newest responses up to its bounds."""
+    store = LastGoodStore(max_entries=2, max_entry_bytes=4)
+    responses = [CompiledResponse(200, b"ok", []) for _ in range(3)]
+    for key, compiled in enumerate(responses):
+        store.put(key, compiled)
+    store.put("big", CompiledResponse(200, b"too big", []))
+    assert store.get(0) is None and store.get("big") is None
+    assert store.get(2) is responses[2]
+    assert store.served == 1
@@ -0,0 +1,104 @@
+"""Test cases for the in-memory mock definition cache."""
+from types import SimpleNamespace
+
+from mock_server.cache import MockCache, URL_TAG
+
+
+def make_row(row_id, identifier="test", url="/test/test1", **kwargs):
+    """Creates a fake urls row."""
+    row = {
+        "id": row_id,
+        "identifier": identifier,
+        "request_type": "GET",
+        "url": url,
+        "response": '{"hi": "test"}',
+        "payload": "",
+        "headers": {},
+        "status_code": 200,
+        "latency": 0,
+        "is_active": True,
+        "inactive_status_code": None,
+        "inactive_response": None,
+        "is_deleted": False,
+    }
+    row.update(kwargs)
+    return SimpleNamespace(**row)
+
+
+def test_get_loads_once():
+    """An identifier is only loaded from the db on the first request."""
+    cache = MockCache()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [make_row(1)]
+
+    first = cache.get(URL_TAG, "test", loader)
+    second = cache.get(URL_TAG, "test", loader)
+    assert first is second
+    assert len(calls) == 1
+    assert first.route_table.match("/test/test1", "GET")[0] == "/test/test1"
+    assert first.find("/test/test1", "GET", "").headers == {
+        "Content-Type": "application/json"
+    }
+
+
+def test_apply_patches_loaded_identifiers():
+    """Created, updated and deleted rows are patched into the cache."""
+    cache = MockCache()
+    loaded = cache.get(URL_TAG, "test", lambda: [make_row(1)])
+    cache.apply(URL_TAG, [make_row(2, url="/test/test2")])
+    patched = cache.get(URL_TAG, "test", lambda: [])
+    assert patched.version > loaded.version
+    assert patched.route_table.match("/test/test2", "GET")
+    cache.apply(URL_TAG, [make_row(1, is_deleted=True)])
+    patched = cache.get(URL_TAG, "test", lambda: [])
+    assert not patched.route_table.match("/test/test1", "GET")
+    cache.apply(URL_TAG, [make_row(2, identifier="other", url="/test/test2")])
+    assert len(cache.get(URL_TAG, "test", lambda: [])) == 0
+
+
+def test_stale_load_is_not_cached():
+    """A load that raced with a mutation is served once but not cached."""
+    cache = MockCache()
+
+    def loader():
+        cache.apply(URL_TAG, [make_row(1, status_code=500)])
+        return [make_row(1)]
+
+    cache.get(URL_TAG, "test", loader)
+    fresh = cache.get(URL_TAG, "test", lambda: [make_row(1, status_code=500)])
+    assert fresh.find("/test/test1", "GET", "").status_code == 500
+
+
+def test_preload_skips_changed_identifiers():
+    """A preload never overwrites what changed while its rows were read."""
+    cache = MockCache()
+    loaded = cache.get(URL_TAG, "loaded", lambda: [make_row(1, identifier="loaded")])
+
+    def loader():
+        cache.apply(URL_TAG, [make_row(4, identifier="changed")])
+        return [
+            make_row(1, identifier="loaded"),
+            make_row(2, identifier="a"),
+            make_row(3, identifier="b", url="/test/test3"),
+            make_row(4, identifier="changed"),
+        ]
+
+    assert cache.preload(URL_TAG, loader) == 4
+    assert cache.peek(URL_TAG, "loaded") is loaded
+    assert cache.peek(URL_TAG, "b").route_table.match("/test/test3", "GET")
+    assert cache.peek(URL_TAG, "changed") is None
+    assert cache.peek(URL_TAG, None) is None
+
+
+def test_size_bounds_identifiers():
+    """Past its size the cache drops the identifier loaded first."""
+    cache = MockCache(size=2)
+    for identifier in ("a", "b", "c"):
+        cache.get(URL_TAG, identifier, lambda: [])
+    assert cache.peek(URL_TAG, "a") is None
+    assert cache.peek(URL_TAG, "b") is not None
+    assert cache.peek(URL_TAG, "c") is not None
+    assert cache.misses == 3
@@ -0,0 +1,25 @@
+"""Fixtures shared by the test cases."""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from mock_server import models
+from mock_server.database import Base
+
+
+@pytest.fixture()
+def session_factory():
+    """Yields a session factory on an in-memory SQLite db."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(models.Users(name="test", password="", is_active=True, is_admin=True))
+    db.commit()
+    db.close()
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.drop_all(bind=engine)
@@ -0,0 +1,62 @@
+"""Test cases for the shared connection pool."""
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, exc
+from sqlalchemy.orm import Session
+
+from mock_server import models  # noqa: F401, registers the tables
+from mock_server.database import (
+    check_schema,
+    close_session,
+    db_executor,
+    get_pool_stats,
+    InstrumentedQueuePool,
+    pool_stats,
+)
+
+
+def test_pool_stats(tmp_path):
+    """Saturation and checkout timeouts are reported."""
+    engine = create_engine(
+        "sqlite:///{0}".format(tmp_path / "pool.db"),
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    timeouts = pool_stats.timeouts
+    connection = engine.connect()
+    stats = get_pool_stats(engine)
+    assert stats["checked_out"] == 1
+    assert stats["saturation"] == 1.0
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    assert get_pool_stats(engine)["timeouts"] == timeouts + 1
+    connection.close()
+    assert get_pool_stats(engine)["saturation"] == 0.0
+
+
+def test_check_schema():
+    """Missing tables fail the check unless they may be created."""
+    engine = create_engine("sqlite://")
+    with pytest.raises(RuntimeError, match="alembic upgrade head"):
+        check_schema(engine)
+    assert "urls" in check_schema(engine, create=True)
+    assert check_schema(engine) == []
+
+
+def test_close_session(monkeypatch):
+    """Only a Session that checked out a connection is closed on the db pool."""
+    submitted = []
+    submit = db_executor.submit
+    monkeypatch.setattr(
+        db_executor, "submit", lambda *a, **kw: submitted.append(a) or submit(*a, **kw)
+    )
+    engine = create_engine("sqlite://")
+    unused, used = Session(bind=engine), Session(bind=engine)
+    used.execute("select 1")
+    asyncio.run(close_session(unused))
+    assert submitted == []
+    asyncio.run(close_session(used))
+    assert len(submitted) == 1 and used.transaction._connections == {}
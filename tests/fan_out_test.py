@@ -0,0 +1,67 @@
+"""Test cases for fan-out collections."""
+import asyncio
+import json
+import time
+
+from aiohttp import web
+from fastapi import HTTPException
+import pytest
+
+from mock_server import helpers
+from tests.stand_in import run_on_new_loop, stand_in_upstream
+
+
+def test_fan_out_merges_upstreams():
+    """Upstreams run concurrently and failures are reported under _errors."""
+
+    async def user(request):
+        await asyncio.sleep(0.2)
+        return web.json_response({"data": {"user": {"id": 1}}})
+
+    async def orders(request):
+        await asyncio.sleep(0.2)
+        return web.json_response([{"id": 7}])
+
+    async def slow(request):
+        await asyncio.sleep(2)
+        return web.json_response({})
+
+    async def broken(request):
+        return web.Response(status=500)
+
+    async def run():
+        routes = [("/user", user), ("/orders", orders), ("/slow", slow), ("/broken", broken)]
+        async with stand_in_upstream(routes) as base:
+            try:
+                start = time.perf_counter()
+                content, successful = await helpers.FanOutUpstreams([
+                    {"key": "user", "url": base + "/user", "response_key": "data.user"},
+                    {"key": "orders", "url": base + "/orders"},
+                    {"key": "slow", "url": base + "/slow", "timeout": 0.3},
+                    {"key": "broken", "url": base + "/broken"},
+                ])
+                return content, successful, time.perf_counter() - start
+            finally:
+                await helpers.upstream_client.close()
+
+    content, successful, elapsed = run_on_new_loop(run())
+    merged = json.loads(content)
+    assert not successful
+    assert merged["user"] == {"id": 1}
+    assert merged["orders"] == [{"id": 7}]
+    assert merged["slow"] is None and merged["broken"] is None
+    assert set(merged["_errors"]) == {"slow", "broken"}
+    assert elapsed < 0.6
+
+
+@pytest.mark.parametrize("upstreams", [
+    [{"url": "http://a"}],
+    [{"key": "a", "url": "http://a"}, {"key": "a", "url": "http://b"}],
+    [{"key": "a"}],
+    [{"key": "a", "url": "http://a", "method": "DELETE"}],
+    [{"key": "a", "url": "http://a", "timeout": 0}],
+])
+def test_validate_upstreams(upstreams):
+    """Malformed upstreams are rejected."""
+    with pytest.raises(HTTPException):
+        helpers.ValidateUpstreams(upstreams)
@@ -0,0 +1,112 @@
+"""Test cases for the raw ASGI fast path of mocked urls."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from mock_server.cache import mock_cache, URL_TAG
+from mock_server.fast_path import FastPath
+
+IDENTIFIER = "fast-path-test"
+
+
+class Fallback(object):
+    """Stand-in for the FastAPI app, records the requests it gets."""
+
+    routes = [SimpleNamespace(path=p) for p in ("/url/create/", "/collection{path:path}")]
+
+    def __init__(self):
+        """Creates the app."""
+        self.paths = []
+
+    async def __call__(self, scope, receive, send):
+        """Answers 404 like an unmatched url."""
+        self.paths.append(scope["path"])
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def url_row(row_id, url, **columns):
+    """A row of the urls table."""
+    row = dict(
+        id=row_id,
+        identifier=IDENTIFIER,
+        request_type="GET",
+        url=url,
+        response='{"id": 1}',
+        payload="",
+        headers={},
+        status_code=200,
+        latency=0,
+        latency_spec=None,
+        is_active=True,
+        inactive_status_code=None,
+        inactive_response=None,
+        is_deleted=False,
+    )
+    row.update(columns)
+    return SimpleNamespace(**row)
+
+
+@pytest.fixture()
+def fast_path():
+    """Yields the fast path in front of a fallback, with mocks loaded."""
+    mock_cache.invalidate(URL_TAG, IDENTIFIER)
+    mock_cache.get(URL_TAG, IDENTIFIER, lambda: [
+        url_row(1, "/orders/{id}"),
+        url_row(2, "/url/create/"),
+        url_row(3, "/down", is_active=False, inactive_response="down"),
+        url_row(4, "/orders/{id}", status_code=201, response="created"),
+    ])
+    yield FastPath(Fallback())
+    mock_cache.invalidate(URL_TAG, IDENTIFIER)
+
+
+def call(app, path, headers=(), method="GET", query=b""):
+    """Sends one request, returns the status, headers and body sent."""
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(10)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "headers": [(b"x-identifier-id", IDENTIFIER.encode())] + list(headers),
+    }
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(app(scope, receive, send))
+    finally:
+        loop.close()
+    return sent[0]["status"], dict(sent[0]["headers"]), sent[1]["body"]
+
+
+def test_serves_mocks_from_memory(fast_path):
+    """Matched mocks are sent without reaching the app."""
+    status, headers, body = call(fast_path, "/orders/7")
+    assert (status, body) == (201, b"created")
+    assert call(fast_path, "/orders/7", [(b"if-none-match", headers[b"etag"])])[0] == 304
+    assert call(fast_path, "/orders/7", [(b"x-status-code", b"200")])[2] == b'{"id": 1}'
+    assert call(fast_path, "/down")[:3:2] == (400, b"down")
+    assert fast_path.served == 4 and fast_path.app.paths == []
+
+
+@pytest.mark.parametrize("path, headers, method, query", [
+    ("/missing", (), "GET", b""),
+    ("/url/create/", (), "GET", b""),
+    ("/collection/orders/7", (), "GET", b""),
+    ("/orders/7", (), "DELETE", b""),
+    ("/orders/7", (), "GET", b"a=1"),
+    ("/orders/7", [(b"x-status-code", b"abc")], "GET", b""),
+    ("/orders/7", [(b"x-modify-response", b"{}")], "GET", b""),
+])
+def test_falls_through_to_app(fast_path, path, headers, method, query):
+    """Admin routes, collections and anything not found go to the app."""
+    assert call(fast_path, path, headers, method, query)[0] == 404
+    assert fast_path.app.paths == [path] and fast_path.served == 0
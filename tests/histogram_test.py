@@ -0,0 +1,55 @@
+"""Test cases for learned latency histograms."""
+import pytest
+
+from mock_server.histogram import (
+    bucket_bounds,
+    bucket_index,
+    LatencyHistogram,
+    MAX_BUCKETS,
+    MAX_MS,
+)
+from mock_server.latency import parse_spec
+
+
+def test_buckets_are_relative():
+    """Buckets are a few percent wide at every magnitude."""
+    assert bucket_index(0.5) == 0
+    assert bucket_index(MAX_MS * 10) == bucket_index(MAX_MS) < MAX_BUCKETS
+    for ms in (1.0, 7.3, 120.0, 4500.0, 290000.0):
+        low, high = bucket_bounds(bucket_index(ms))
+        assert low <= ms < high and high / low < 1.05
+
+
+def test_histogram_quantiles_and_merge():
+    """Merged histograms keep the quantiles of all timings."""
+    fast, slow = LatencyHistogram(), LatencyHistogram()
+    for i in range(900):
+        fast.record(20 + i % 10)
+    for i in range(100):
+        slow.record(1000)
+    fast.merge(slow)
+    assert fast.total == 1000
+    assert 24 <= fast.quantile(0.5) <= 27
+    assert 950 <= fast.quantile(0.99) <= 1050
+    assert LatencyHistogram.from_spec(fast.to_spec()).counts == fast.counts
+
+
+def test_histogram_spec_replays_distribution():
+    """A histogram latency_spec samples the recorded tail."""
+    histogram = LatencyHistogram()
+    histogram.record(10, count=90)
+    histogram.record(800, count=10)
+    spec = parse_spec(histogram.to_spec())
+    samples = sorted(spec.delay_ms() for _ in range(5000))
+    assert 9.5 <= samples[2500] <= 10.5
+    assert 0.05 <= sum(1 for s in samples if s > 700) / 5000.0 <= 0.15
+    assert samples[-1] < 840
+
+
+@pytest.mark.parametrize(
+    "buckets", [None, [], [[1]], [[-1, 2]], [[MAX_BUCKETS, 1]], [[3, 0]]],
+)
+def test_malformed_histogram_spec(buckets):
+    """Malformed or empty buckets are rejected."""
+    with pytest.raises(ValueError):
+        parse_spec({"type": "histogram", "buckets": buckets})
@@ -0,0 +1,63 @@
+"""Test cases for latency specs and the timer wheel."""
+import asyncio
+
+import pytest
+
+from mock_server.latency import parse_spec, simulate, timer_wheel, TimerWheel
+
+
+def test_parse_spec():
+    """Specs are compiled to millisecond samplers."""
+    assert parse_spec(None) is None
+    assert parse_spec(None, legacy_seconds=2).delay_ms() == 2000
+    assert parse_spec({"type": "fixed", "ms": 15}).delay_ms() == 15
+    uniform = parse_spec({"type": "uniform", "min_ms": 5, "max_ms": 10})
+    assert all(5 <= uniform.delay_ms() <= 10 for _ in range(100))
+    table = parse_spec({"type": "percentiles", "p50": 10, "p90": 20, "p99": 50})
+    samples = sorted(table.delay_ms() for _ in range(2000))
+    assert 5 <= samples[0] and samples[-1] <= 80
+    assert 8 <= samples[1000] <= 12
+    for spec in ({"type": "poisson"}, {"ms": "1"}, {"type": "uniform", "min_ms": 2}):
+        with pytest.raises(ValueError):
+            parse_spec(spec)
+
+
+def test_timer_wheel_releases_in_order():
+    """Waiters are released after their delay, across wheel turns."""
+    wheel = TimerWheel(tick_ms=1, slots=8)
+    order = []
+
+    async def wait(delay):
+        await wheel.schedule(delay)
+        order.append(delay)
+
+    async def run():
+        await asyncio.gather(wait(20), wait(3), wait(11), wait(3))
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+    assert order == [3, 3, 11, 20]
+    assert wheel.pending == 0
+
+
+def test_disconnect_cancels_delay():
+    """A client disconnect drops the pending response from the wheel."""
+
+    async def receive():
+        await asyncio.sleep(0.01)
+        return {"type": "http.disconnect"}
+
+    async def run():
+        connected = await simulate(5000, receive)
+        await asyncio.sleep(0)
+        return connected
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(run()) is False
+    finally:
+        loop.close()
+    assert timer_wheel.pending == 0
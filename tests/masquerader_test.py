@@ -200,6 +200,19 @@ def test_get_url(cleanup_database, application):
     assert response.json() == expected_resp
 
 
+def test_get_url_not_modified(cleanup_database, application):
+    """Test if a matching If-None-Match gets a 304 without body."""
+    change_engine(cleanup_database)
+    response = application.get("/test/test1", headers={"x-identifier-id": "test"})
+    etag = response.headers["etag"]
+    assert response.headers["content-length"] == str(len(response.content))
+    response = application.get(
+        "/test/test1", headers={"x-identifier-id": "test", "If-None-Match": etag},
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+
+
 def test_toggle_url(cleanup_database, application):
     """Test if url gets toggled by user."""
     change_engine(cleanup_database)
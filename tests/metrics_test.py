@@ -0,0 +1,126 @@
+"""Test cases for the Prometheus metrics of the workers."""
+import asyncio
+import os
+
+from mock_server.metrics import (
+    AGGREGATE_FILE,
+    COUNTER,
+    GAUGE,
+    merge_dumps,
+    metrics,
+    MetricsExporter,
+    MetricsRegistry,
+    render,
+    RequestMetrics,
+    requests_total,
+    write_dump,
+)
+
+
+def test_render_histogram():
+    """Buckets are cumulative and end with +Inf, sum and count."""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("seconds", "Time.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(("lookup",), value)
+    text = render(merge_dumps([registry.dump()]))
+    assert "# TYPE seconds histogram" in text
+    assert 'seconds_bucket{stage="lookup",le="0.1"} 2' in text
+    assert 'seconds_bucket{stage="lookup",le="1.0"} 3' in text
+    assert 'seconds_bucket{stage="lookup",le="+Inf"} 4' in text
+    assert 'seconds_count{stage="lookup"} 4' in text
+    assert 'seconds_sum{stage="lookup"} 3.65' in text
+
+
+def test_merge_workers(tmp_path):
+    """Counters are summed over workers, gauges are kept per live pid."""
+    registry = MetricsRegistry()
+    registry.counter("hits_total", "Hits.", ("cache",)).inc(("mocks",), 2)
+    registry.collect("ready", GAUGE, "Ready.", (), lambda: {(): 1})
+    exporter = MetricsExporter(registry, str(tmp_path))
+    dead = {
+        "pid": 2 ** 22 + 1,
+        "time": 0,
+        "metrics": {
+            "hits_total": {
+                "type": COUNTER,
+                "help": "Hits.",
+                "labels": ["cache"],
+                "buckets": [],
+                "values": [[["mocks"], 3]],
+            },
+            "ready": {
+                "type": GAUGE,
+                "help": "Ready.",
+                "labels": [],
+                "buckets": [],
+                "values": [[[], 0]],
+            },
+        },
+    }
+    merged = merge_dumps([registry.dump(), dead])
+    assert merged["hits_total"]["values"] == {("mocks",): 5}
+    assert merged["ready"]["values"] == {(str(os.getpid()),): 1}
+    text = exporter.exposition()
+    assert 'hits_total{cache="mocks"} 2' in text
+    assert os.path.exists(exporter.path())
+
+
+def test_compact_folds_exited_workers(tmp_path):
+    """Files of exited workers and of reused pids are folded, once."""
+    registry = MetricsRegistry()
+    registry.counter("hits_total", "Hits.", ("cache",)).inc(("mocks",), 2)
+    exporter = MetricsExporter(registry, str(tmp_path))
+    exporter.write()
+
+    def dump(pid, started, hits):
+        return {
+            "pid": pid,
+            "started": started,
+            "time": 0,
+            "metrics": {
+                "hits_total": {
+                    "type": COUNTER,
+                    "help": "Hits.",
+                    "labels": ["cache"],
+                    "buckets": [],
+                    "values": [[["mocks"], hits]],
+                },
+                "ready": {
+                    "type": GAUGE,
+                    "help": "Ready.",
+                    "labels": [],
+                    "buckets": [],
+                    "values": [[[], 1]],
+                },
+            },
+        }
+
+    write_dump(str(tmp_path / "metrics-4194305-1.json"), dump(2 ** 22 + 1, 1, 3))
+    reused = tmp_path / "metrics-{0}-1.json".format(os.getpid())
+    write_dump(str(reused), dump(os.getpid(), 1, 5))
+    assert exporter.compact() == 2
+    assert exporter.compact() == 0
+    files = sorted(path.name for path in tmp_path.glob("metrics-*.json"))
+    assert files == sorted([AGGREGATE_FILE, os.path.basename(exporter.path())])
+    text = exporter.exposition()
+    assert 'hits_total{cache="mocks"} 10' in text
+    assert "ready" not in text
+
+
+def test_request_labels():
+    """Requests are labelled with the mock the app put in the scope."""
+
+    async def app(scope, receive, send):
+        scope["mock"] = ("metrics-test", '/orders/{id}"')
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": "/orders/1"}
+    asyncio.run(RequestMetrics(app)(scope, None, send))
+    labels = ("metrics-test", "GET", '/orders/{id}"', "201")
+    assert requests_total.values[labels] >= 1
+    text = render(merge_dumps([metrics.dump()]))
+    assert 'mock="/orders/{id}\\"",status="201"}' in text
@@ -0,0 +1,56 @@
+"""Test cases for the x-modify-response engine."""
+from types import SimpleNamespace
+
+import pytest
+
+from mock_server.modify import apply_plan, compile_plan, ModifiedCache, ModifyError
+
+
+def test_parse_header():
+    """JSON and literal dicts are accepted, anything else is rejected."""
+    assert compile_plan('{"a.b": 1}') == ((("a", "b"), 1),)
+    assert compile_plan("{'a': True}") == ((("a",), True),)
+    for header in ("__import__('os').getcwd()", "[1, 2]", "{1: 2}", "{"):
+        with pytest.raises(ModifyError):
+            compile_plan(header)
+
+
+def test_apply_copy_on_write():
+    """Only the containers on a modified path are copied."""
+    document = {"a": {"b": 1, "c": [1, 2]}, "d": {"e": 1}, "f": [{"g": 1}]}
+    modified = apply_plan(
+        document, compile_plan('{"a.b": 2, "f.0.g": 3, "f.1": 4, "h.i": 5}')
+    )
+    assert modified == {
+        "a": {"b": 2, "c": [1, 2]},
+        "d": {"e": 1},
+        "f": [{"g": 3}, 4],
+        "h": {"i": 5},
+    }
+    assert document == {"a": {"b": 1, "c": [1, 2]}, "d": {"e": 1}, "f": [{"g": 1}]}
+    assert modified["d"] is document["d"]
+    assert modified["a"]["c"] is document["a"]["c"]
+    with pytest.raises(ModifyError):
+        apply_plan(document, compile_plan('{"a.b.c": 1}'))
+    for header in ('{"f.2": 1}', '{"f.999999999": 1}', '{"a.c.999999999.x": 1}'):
+        with pytest.raises(ModifyError):
+            apply_plan(document, compile_plan(header))
+
+
+def test_modified_cache():
+    """Outputs are reused per mock version and header."""
+    cache = ModifiedCache(size=1)
+    definition = SimpleNamespace(id=1, version=1)
+    builds = []
+
+    def build(plan):
+        builds.append(plan)
+        return apply_plan({"a": 1}, plan)
+
+    assert cache.get(definition, '{"a": 2}', build) == {"a": 2}
+    assert cache.get(definition, '{"a": 2}', build) == {"a": 2}
+    assert len(builds) == 1
+    definition.version = 2
+    cache.get(definition, '{"a": 2}', build)
+    assert len(builds) == 2
+    assert len(cache.entries) == 1
@@ -0,0 +1,57 @@
+"""Test cases for the sampling profiler and the event loop watchdog."""
+import asyncio
+import time
+
+from mock_server.metrics import Counter
+from mock_server.profiler import LoopWatchdog, SamplingProfiler
+
+
+def blocking_call():
+    """Blocks the calling thread, like a sync crud call."""
+    time.sleep(0.2)
+
+
+def test_profile_samples_the_loop_thread():
+    """The collapsed stacks of the loop show the code blocking it."""
+    profiler = SamplingProfiler(interval=0.001)
+
+    async def run():
+        task = asyncio.ensure_future(profiler.profile(0.1))
+        await asyncio.sleep(0)
+        blocking_call()
+        return await task
+
+    lines = asyncio.run(run()).splitlines()
+    stack, count = lines[0].rsplit(" ", 1)
+    assert stack.split(";")[-1].startswith("blocking_call (tests/profiler_test.py:")
+    assert int(count) > 10 and profiler.profiles == 1 and not profiler.running
+
+
+def test_profile_rejects_bad_seconds():
+    """Profiles are bounded in time."""
+    profiler = SamplingProfiler()
+    for seconds in (0, 61):
+        try:
+            asyncio.run(profiler.profile(seconds))
+        except ValueError:
+            continue
+        raise AssertionError(seconds)
+
+
+def test_watchdog_reports_blocking_code():
+    """A block longer than the threshold is reported once, with its stack."""
+    counter = Counter("stalls", "Stalls.")
+    watchdog = LoopWatchdog(threshold=0.05, counter=counter)
+
+    async def run():
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        blocking_call()
+        await asyncio.sleep(0.05)
+        await watchdog.stop()
+
+    asyncio.run(run())
+    stall = watchdog.stats()["recent"][0]
+    assert watchdog.stalled == 1 and counter.values == {(): 1}
+    assert stall["seconds"] >= 0.15
+    assert "blocking_call" in stall["stack"][-2]
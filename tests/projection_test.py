@@ -0,0 +1,63 @@
+"""Test cases for the streaming projection of upstream JSON."""
+import gzip
+import json
+
+import pytest
+
+from mock_server.projection import (
+    content_decoder,
+    JsonProjector,
+    parse_path,
+    ProjectionError,
+)
+
+DOCUMENT = {
+    "meta": {"skipped": ["a", {"b": '}]\\"'}], "quote": '\\"{'},
+    "data": {"items": [{"name": "first"}, {"name": "seçond", "n": 2.5}]},
+    "tail": [1, 2, 3],
+}
+
+
+def project(response_key, body, chunk_size=3):
+    """Feeds body to a projector in chunks of chunk_size bytes."""
+    projector = JsonProjector(parse_path(response_key))
+    for start in range(0, len(body), chunk_size):
+        if projector.feed(body[start:start + chunk_size]):
+            break
+    return projector.close()
+
+
+@pytest.mark.parametrize(
+    "response_key", ["data", "data.items", "data.items.1", "data.items.1.n", "tail.2"],
+)
+def test_projection_matches_json(response_key):
+    """The projected bytes decode to the value at the path."""
+    body = json.dumps(DOCUMENT, indent=1).encode()
+    value = DOCUMENT
+    for segment in response_key.split("."):
+        value = value[int(segment)] if isinstance(value, list) else value[segment]
+    for chunk_size in (1, 3, 64, len(body)):
+        assert json.loads(project(response_key, body, chunk_size)) == value
+
+
+def test_projection_stops_early():
+    """The rest of the body is not needed once the value is complete."""
+    projector = JsonProjector(parse_path("a"))
+    assert projector.feed(b'{"a": {"b": 1}, "c": [')
+    assert projector.close() == b'{"b": 1}'
+
+
+@pytest.mark.parametrize("response_key", ["missing", "data.items.2", "tail.0.x"])
+def test_missing_path(response_key):
+    """A path that is not in the document raises."""
+    with pytest.raises(ProjectionError):
+        project(response_key, json.dumps(DOCUMENT).encode())
+
+
+def test_gzip_decoder():
+    """Gzipped bodies are decoded incrementally."""
+    decoder = content_decoder("gzip")
+    assert decoder.decompress(gzip.compress(b'{"a": 1}')) == b'{"a": 1}'
+    assert content_decoder(None) is None
+    with pytest.raises(ProjectionError):
+        content_decoder("br")
@@ -0,0 +1,169 @@
+"""Test cases for record mode."""
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from aiohttp import web
+from fastapi import HTTPException
+import pytest
+from starlette.requests import Request
+
+from mock_server import crud, helpers, models
+from mock_server.cache import MockCache, URL_TAG
+from mock_server.histogram import bucket_index, LatencyHistogram
+from mock_server.record import RecordWriter
+from mock_server.sync import ChangeLogSync
+from tests.stand_in import run_on_new_loop, stand_in_upstream
+
+
+def recorded_row(url):
+    """Column values of a recorded url."""
+    return {
+        "identifier": "test",
+        "request_type": "GET",
+        "url": url,
+        "response": '{"hi": "test"}',
+        "payload": "",
+        "headers": {"Content-Type": "application/json"},
+        "status_code": 200,
+        "is_active": True,
+        "inactive_status_code": None,
+        "inactive_response": None,
+        "created_on": datetime.now().replace(microsecond=0),
+        "created_by": 1,
+        "is_deleted": False,
+    }
+
+
+def test_writer_batches_and_syncs(session_factory):
+    """Recorded urls are inserted in batches and reach other workers."""
+    worker_cache = MockCache()
+    sync = ChangeLogSync(session_factory, worker_cache)
+    sync.poll()
+
+    def loader():
+        db = session_factory()
+        try:
+            return crud.GetAllUrls(db, "test", URL_TAG)
+        finally:
+            db.close()
+
+    assert len(worker_cache.get(URL_TAG, "test", loader)) == 0
+    writer = RecordWriter(session_factory, batch_size=2)
+    for i in range(5):
+        url = "/r/{0}".format(i)
+        assert writer.add(("test", "GET", url, ""), recorded_row(url), 12)
+    assert not writer.add(("test", "GET", "/r/0", ""), recorded_row("/r/0"), 40)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(writer.flush())
+    finally:
+        loop.close()
+    assert writer.stats()["written"] == 5 and writer.stats()["batches"] == 3
+    assert writer.add(("test", "GET", "/r/0", ""), recorded_row("/r/0"), 12)
+    sync.poll()
+    mocks = worker_cache.get(URL_TAG, "test", loader)
+    assert len(mocks) == 5
+    assert mocks.find("/r/0", "GET").latency_spec.params["buckets"] == [
+        [bucket_index(12), 1], [bucket_index(40), 1],
+    ]
+    assert mocks.find("/r/3", "GET").latency == 0
+
+
+def test_proxy_timings_merge_into_histograms(session_factory):
+    """Timings of existing urls from several workers add up."""
+    first = RecordWriter(session_factory)
+    first.add(("test", "GET", "/a", ""), recorded_row("/a"), 10)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(first.flush())
+        db = session_factory()
+        url_id = crud.GetAllUrls(db, "test", URL_TAG)[0].id
+        db.close()
+        second = RecordWriter(session_factory)
+        for writer, latency in ((first, 10), (second, 500), (second, 500)):
+            writer.observe(url_id, latency)
+        loop.run_until_complete(first.flush())
+        loop.run_until_complete(second.flush())
+    finally:
+        loop.close()
+    db = session_factory()
+    spec = db.query(models.Urls).get(url_id).latency_spec
+    db.close()
+    assert spec["buckets"] == [[bucket_index(10), 2], [bucket_index(500), 2]]
+    assert first.stats()["merged"] == 1
+
+
+def test_manual_latency_survives_timings(session_factory):
+    """Timings never replace a latency set by hand."""
+    db = session_factory()
+    crud.CreateRecordedUrls(db, [
+        dict(recorded_row(url), latency=latency, latency_spec=spec)
+        for url, latency, spec in (
+            ("/fixed", 0, {"type": "fixed", "ms": 120}),
+            ("/legacy", 2, None),
+            ("/learned", 0, None),
+        )
+    ])
+    urls = {url.url: url.id for url in crud.GetAllUrls(db, "test", URL_TAG)}
+    histograms = {}
+    for url_id in urls.values():
+        histograms[url_id] = LatencyHistogram()
+        histograms[url_id].record(10)
+    assert crud.MergeLatencyHistograms(db, histograms) == 1
+    rows = {row.url: row for row in db.query(models.Urls).all()}
+    assert rows["/fixed"].latency_spec == {"type": "fixed", "ms": 120}
+    assert rows["/legacy"].latency_spec is None and rows["/legacy"].latency == 2
+    assert rows["/learned"].latency_spec["type"] == "histogram"
+    db.close()
+
+
+def test_writer_drops_when_full(session_factory):
+    """A full queue drops new urls instead of growing."""
+    writer = RecordWriter(session_factory, max_pending=1)
+    assert writer.add(1, recorded_row("/a"), 1)
+    assert not writer.add(2, recorded_row("/b"), 1)
+    assert writer.stats()["dropped"] == 1
+
+
+def test_record_url_proxies_and_queues():
+    """An unmatched request is proxied and queued with its latency."""
+
+    async def upstream(request):
+        await asyncio.sleep(0.05)
+        assert "x-identifier-id" not in request.headers
+        return web.json_response({"path": request.path}, status=201)
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def run():
+        async with stand_in_upstream([("/orders/1", upstream)]) as target:
+            helpers.record_modes.put("rec", SimpleNamespace(
+                target_url=target, created_by=1, proxy=False,
+            ))
+            request = Request({
+                "type": "http",
+                "method": "GET",
+                "path": "/orders/1",
+                "query_string": b"a=1",
+                "headers": [(b"x-identifier-id", b"rec"), (b"host", b"mock")],
+            }, receive)
+            try:
+                with pytest.raises(HTTPException):
+                    await helpers.RecordUrl("other", request)
+                return await helpers.RecordUrl("rec", request)
+            finally:
+                await helpers.upstream_client.close()
+
+    response = run_on_new_loop(run())
+    assert response.status_code == 201
+    assert response.body == b'{"path": "/orders/1"}'
+    keys, rows, _ = helpers.record_writer.take()
+    assert keys[-1] == ("rec", "GET", "/orders/1", "a=1")
+    row = rows[-1]
+    assert row["response"] == '{"path": "/orders/1"}'
+    assert row["headers"]["Content-Type"].startswith("application/json")
+    assert row["status_code"] == 201 and row["latency"] == 0
+    histogram = LatencyHistogram.from_spec(row["latency_spec"])
+    assert histogram.total == 1 and histogram.quantile(0.5) >= 50
@@ -0,0 +1,55 @@
+"""Test cases for the compiled route table."""
+from mock_server.router import RouteTable
+
+
+def test_static_route():
+    """Static urls match only their own method."""
+    table = RouteTable([("/test/test1", "GET"), ("/test/test1", "POST")])
+    assert table.match("/test/test1", "GET") == ("/test/test1", {})
+    assert table.match("/test/test1", "post") == ("/test/test1", {})
+    assert table.match("/test/test1", "PUT") is None
+    assert table.match("/test/test2", "GET") is None
+    assert len(table) == 2
+
+
+def test_param_route():
+    """Templates capture their params and static segments take priority."""
+    table = RouteTable(
+        [("/user/{user_id}/orders", "GET"), ("/user/me/orders", "GET")]
+    )
+    assert table.match("/user/42/orders", "GET") == (
+        "/user/{user_id}/orders",
+        {"user_id": "42"},
+    )
+    assert table.match("/user/me/orders", "GET") == ("/user/me/orders", {})
+    assert table.match("/user//orders", "GET") is None
+
+
+def test_param_backtracking():
+    """A static prefix that dead-ends falls back to the param branch."""
+    table = RouteTable([("/a/b/c", "GET"), ("/a/{x}/d", "GET")])
+    assert table.match("/a/b/d", "GET") == ("/a/{x}/d", {"x": "b"})
+
+
+def test_path_route():
+    """``{name:path}`` templates match the rest of the url."""
+    table = RouteTable([("/files/{rest:path}", "GET")])
+    assert table.match("/files/a/b/c.txt", "GET") == (
+        "/files/{rest:path}",
+        {"rest": "a/b/c.txt"},
+    )
+
+
+def test_sibling_param_names():
+    """Templates sharing a param position keep their own param names."""
+    table = RouteTable([
+        ("/a/{id}", "GET"),
+        ("/a/{slug}/b", "GET"),
+        ("/a/{slug}/{rest:path}", "POST"),
+    ])
+    assert table.match("/a/7", "GET") == ("/a/{id}", {"id": "7"})
+    assert table.match("/a/x/b", "GET") == ("/a/{slug}/b", {"slug": "x"})
+    assert table.match("/a/x/c/d", "POST") == (
+        "/a/{slug}/{rest:path}",
+        {"slug": "x", "rest": "c/d"},
+    )
@@ -0,0 +1,53 @@
+"""Test cases for coalescing concurrent identical upstream calls."""
+import asyncio
+
+from mock_server.single_flight import SingleFlight
+
+
+def run(coroutine):
+    """Runs a coroutine on a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_followers_share_the_leader_response():
+    """Followers get what the leader finishes with."""
+    flights = SingleFlight()
+
+    async def test():
+        future, leader = flights.join("key")
+        assert leader
+        followers = [asyncio.ensure_future(flights.wait(flights.join("key")[0]))
+                     for _ in range(3)]
+        await asyncio.sleep(0)
+        flights.finish("key", future, "response")
+        assert await asyncio.gather(*followers) == ["response"] * 3
+        assert flights.join("key")[1]
+
+    run(test())
+    assert flights.stats() == {
+        "in_flight": 1, "leaders": 2, "coalesced": 3, "fallbacks": 0,
+    }
+
+
+def test_cancelled_follower_keeps_the_flight():
+    """A follower going away neither cancels nor ends the shared call."""
+    flights = SingleFlight()
+
+    async def test():
+        future, _ = flights.join("key")
+        gone = asyncio.ensure_future(flights.wait(flights.join("key")[0]))
+        staying = asyncio.ensure_future(flights.wait(flights.join("key")[0]))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.sleep(0)
+        assert not future.cancelled()
+        flights.finish("key", future, None)
+        assert await staying is None
+
+    run(test())
+    assert flights.fallbacks == 1
+    assert flights.flights == {}
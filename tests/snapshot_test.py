@@ -0,0 +1,131 @@
+"""Test cases for mock snapshots of the data plane."""
+import mmap
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from mock_server import crud, schemas
+from mock_server.cache import COLLECTION_TAG, MockCache, URL_TAG
+from mock_server.snapshot import (
+    MappedSnapshot,
+    pack_snapshot,
+    SnapshotLoader,
+    SnapshotPublisher,
+    write_snapshot,
+)
+
+
+def create_url(session_factory, identifier, url):
+    """Creates a mocked url through crud, like the admin API."""
+    db = session_factory()
+    try:
+        return crud.CreateUrl(
+            db,
+            schemas.UrlCreate(
+                identifier=identifier,
+                request_type="GET",
+                url=url,
+                response={"url": url},
+                headers={},
+                status_code=0,
+                latency=0,
+                latency_spec={"type": "fixed", "ms": 5},
+                is_active=True,
+            ),
+            1,
+        ).id
+    finally:
+        db.close()
+
+
+def test_snapshot_push(session_factory, tmp_path):
+    """The data plane serves what the control plane published, without a db."""
+    path = str(tmp_path / "snapshot.bin")
+    publisher = SnapshotPublisher(session_factory, path)
+    worker_cache = MockCache()
+    loader = SnapshotLoader(path, worker_cache)
+    assert not loader.poll()
+    create_url(session_factory, "a", "orders/{id}")
+    create_url(session_factory, "b", "users")
+    assert publisher.publish()
+    assert not publisher.publish()
+    assert loader.poll() and not loader.poll()
+
+    def no_db():
+        raise AssertionError("The data plane must not query the db")
+
+    mocks = worker_cache.get(URL_TAG, "a", no_db)
+    assert mocks.route_table.match("/orders/7", "GET")
+    assert mocks.find("/orders/{id}", "GET").latency_spec.delay_ms() == 5
+    assert len(worker_cache.get(URL_TAG, None, no_db)) == 2
+    assert len(worker_cache.get(URL_TAG, "unknown", no_db)) == 0
+    assert len(worker_cache.get(COLLECTION_TAG, "a", no_db)) == 0
+
+    old = worker_cache.get(URL_TAG, "a", no_db)
+    create_url(session_factory, "a", "orders")
+    assert publisher.publish() and loader.poll()
+    assert len(worker_cache.get(URL_TAG, "a", no_db)) == 2
+    assert len(old) == 1
+    assert loader.version == publisher.version
+    assert os.listdir(str(tmp_path)) == ["snapshot.bin"]
+
+
+def url_row(row_id, identifier, url, response):
+    """A row of the urls table."""
+    return SimpleNamespace(
+        id=row_id,
+        identifier=identifier,
+        request_type="GET",
+        url=url,
+        response=response,
+        payload="",
+        headers={},
+        status_code=200,
+        latency=0,
+        latency_spec=None,
+        is_active=row_id != 3,
+        inactive_status_code=None,
+        inactive_response="down" if row_id == 3 else None,
+    )
+
+
+def test_mapped_snapshot(tmp_path):
+    """Bodies are shared slices of the mapped file, stored once."""
+    body = '{"items": [%s]}' % ",".join(["1"] * 1000)
+    path = str(tmp_path / "snapshot.bin")
+    write_snapshot(path, pack_snapshot(7, {URL_TAG: [
+        url_row(1, "a", "/orders", body),
+        url_row(2, "b", "/orders", body),
+        url_row(3, None, "/down", "{}"),
+    ]}))
+    assert os.path.getsize(path) < 2 * len(body)
+
+    snapshot = MappedSnapshot(path)
+    assert snapshot.version == 7
+    assert snapshot.rows(URL_TAG, "unknown") == []
+    assert [row.id for row in snapshot.rows(URL_TAG, None)] == [3, 1, 2]
+
+    caches = [MockCache(), MockCache()]
+    for cache in caches:
+        cache.attach_snapshot((URL_TAG, COLLECTION_TAG), MappedSnapshot(path).rows)
+    compiled = [
+        cache.get(URL_TAG, "a", None).find("/orders", "GET").compiled for cache in caches
+    ]
+    assert all(isinstance(each.body.obj, mmap.mmap) for each in compiled)
+    assert bytes(compiled[0].body) == body.encode()
+    assert compiled[0].etag == compiled[1].etag
+    down = caches[0].get(URL_TAG, None, None).find("/down", "GET")
+    assert bytes(down.inactive.body) == b"down"
+    assert caches[0].get(URL_TAG, "a", None).find("/orders", "GET").get_document()["items"]
+
+
+def test_rejects_partial_snapshot(tmp_path):
+    """A truncated or foreign file is never mapped as a snapshot."""
+    path = str(tmp_path / "snapshot.bin")
+    data = pack_snapshot(1, {URL_TAG: [url_row(1, "a", "/orders", "{}")]})
+    for content in (b"", b"{}", bytes(data[:-1])):
+        with open(path, "wb") as snapshot_file:
+            snapshot_file.write(content)
+        with pytest.raises(ValueError):
+            MappedSnapshot(path)
@@ -0,0 +1,44 @@
+"""Local stand-in upstreams for the tests and benchmarks of upstream calls."""
+import asyncio
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+
+
+@asynccontextmanager
+async def stand_in_upstream(routes):
+    """Serves aiohttp handlers on a free local port.
+
+    Arguments:
+        routes {iterable} -- (path, handler) pairs answering GET requests.
+
+    Yields:
+        base[str] -- The url of the stand-in, without a trailing slash.
+    """
+    app = web.Application()
+    for path, handler in routes:
+        app.router.add_get(path, handler)
+    runner = web.AppRunner(app, handle_signals=False, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        yield "http://127.0.0.1:{0}".format(site._server.sockets[0].getsockname()[1])
+    finally:
+        await runner.cleanup()
+
+
+def run_on_new_loop(coroutine):
+    """Runs a coroutine on a fresh event loop, closed afterwards.
+
+    Arguments:
+        coroutine {coroutine} -- The test to run.
+
+    Returns:
+        result[Any] -- What the coroutine returned.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
@@ -0,0 +1,44 @@
+"""Test cases for the import of the server, which must be quick and inert."""
+import os
+import subprocess
+import sys
+
+from config.config_parser import parse_config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Microseconds importing main may take, with every dependency. About 0.35s
+# on a laptop, the rest is headroom for slow CI runners.
+IMPORT_BUDGET_US = 1500000
+
+IMPORT_MAIN = """
+import main
+from mock_server import database
+assert database.engine is None, "an engine was created at import"
+"""
+
+
+def test_import_main_within_budget():
+    """Importing main prints nothing, connects nowhere and is quick."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_MAIN],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert result.stdout == ""
+    cumulative = None
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == "main":
+            cumulative = int(fields[1])
+    assert cumulative is not None
+    assert cumulative < IMPORT_BUDGET_US, "import main took {0}us".format(cumulative)
+
+
+def test_config_ignores_command_line():
+    """Only explicit flags override the yaml and the environment."""
+    assert parse_config().SNAPSHOT_INTERVAL == 1.0
+    assert parse_config(["--SNAPSHOT_INTERVAL", "2.5"]).SNAPSHOT_INTERVAL == 2.5
@@ -0,0 +1,133 @@
+"""Test cases for the change log sync between workers."""
+from types import SimpleNamespace
+
+from mock_server import crud, models, schemas
+from mock_server.cache import MockCache, URL_TAG
+from mock_server.sync import ChangeLogSync
+
+
+def url_create(url):
+    """Creates the request body of a mocked url."""
+    return schemas.UrlCreate(
+        identifier="test",
+        request_type="GET",
+        url=url,
+        response={"hi": "test"},
+        headers={},
+        status_code=0,
+        latency=0,
+        is_active=True,
+    )
+
+
+def test_changes_are_written_with_mutations(session_factory):
+    """Every crud mutation writes its change log rows."""
+    db = session_factory()
+    db_url = crud.CreateUrl(db, url_create("test/test1"), 1)
+    crud.UrlToggle(
+        db,
+        SimpleNamespace(
+            url="/test/test1",
+            status_code=200,
+            request_type="GET",
+            inactive_response=None,
+            inactive_status_code=None,
+            is_active=False,
+        ),
+    )
+    changes = crud.GetChangesSince(db, 0)
+    assert [(c.tag, c.row_id) for c in changes] == [(URL_TAG, db_url.id)] * 2
+    db.close()
+
+
+def test_sync_applies_deltas(session_factory):
+    """A worker picks up writes made through another worker."""
+    worker_cache = MockCache()
+    sync = ChangeLogSync(session_factory, worker_cache)
+    assert sync.poll() == 0
+
+    def loader():
+        db = session_factory()
+        try:
+            return crud.GetAllUrls(db, "test", URL_TAG)
+        finally:
+            db.close()
+
+    assert len(worker_cache.get(URL_TAG, "test", loader)) == 0
+    db = session_factory()
+    crud.CreateUrl(db, url_create("test/test1"), 1)
+    crud.CreateUrl(db, url_create("test/test2"), 1)
+    db.close()
+    assert sync.poll() == 2
+    mocks = worker_cache.get(URL_TAG, "test", lambda: [])
+    assert mocks.route_table.match("/test/test2", "GET")
+    assert worker_cache.misses == 1
+    assert sync.poll() == 0
+
+
+def test_sync_waits_for_out_of_order_commits(session_factory):
+    """Ids that become visible after a higher id are still applied."""
+    sync = ChangeLogSync(session_factory, MockCache())
+    sync.poll()
+    db = session_factory()
+    db_url = crud.CreateUrl(db, url_create("test/test1"), 1)
+    db.query(models.MockChange).delete()
+    db.add(models.MockChange(id=2, tag=URL_TAG, row_id=db_url.id, identifier="test"))
+    db.commit()
+    assert sync.poll() == 1
+    assert list(sync.missing) == [1]
+    db.add(models.MockChange(id=1, tag=URL_TAG, row_id=db_url.id, identifier="test"))
+    db.commit()
+    db.close()
+    assert sync.poll() == 1
+    assert sync.missing == {}
+
+
+def test_sync_drops_the_cache_after_a_large_gap(session_factory, monkeypatch):
+    """A gap past max_missing is not tracked id by id."""
+    now = [0.0]
+    monkeypatch.setattr("mock_server.sync.time.monotonic", lambda: now[0])
+    cache = MockCache()
+    sync = ChangeLogSync(session_factory, cache, gap_timeout=10, max_missing=5)
+    sync.poll()
+    db = session_factory()
+    db_url = crud.CreateUrl(db, url_create("test/test1"), 1)
+    db.query(models.MockChange).delete()
+    db.add(models.MockChange(id=10 ** 9, tag=URL_TAG, row_id=db_url.id, identifier="test"))
+    db.commit()
+    db.close()
+    assert sync.poll() == 1
+    assert sync.missing == {} and sync.last_seen == 10 ** 9
+    cache.get(URL_TAG, "test", lambda: [])
+    now[0] = 5.0
+    sync.poll()
+    assert cache.peek(URL_TAG, "test") is not None
+    now[0] = 10.0
+    sync.poll()
+    assert cache.peek(URL_TAG, "test") is None and not sync.overflows
+
+
+def test_sync_applies_commits_after_the_gap_timeout(session_factory, monkeypatch):
+    """A skipped id committed after it timed out is still applied."""
+    now = [0.0]
+    monkeypatch.setattr("mock_server.sync.time.monotonic", lambda: now[0])
+    cache = MockCache()
+    sync = ChangeLogSync(session_factory, cache, gap_timeout=10, max_missing=2)
+    sync.poll()
+    db = session_factory()
+    db_url = crud.CreateUrl(db, url_create("test/test1"), 1)
+    db.query(models.MockChange).delete()
+    db.add(models.MockChange(id=3, tag=URL_TAG, row_id=db_url.id, identifier="test"))
+    db.commit()
+    assert sync.poll() == 1
+    assert list(sync.missing) == [1, 2]
+    cache.get(URL_TAG, "test", lambda: [])
+    now[0] = 10.0
+    assert sync.poll() == 0
+    assert sync.missing == {} and list(sync.expired) == [1, 2]
+    db.add(models.MockChange(id=2, tag=URL_TAG, row_id=db_url.id, identifier="test"))
+    db.commit()
+    db.close()
+    assert sync.poll() == 1
+    assert list(sync.expired) == [1]
+    assert cache.peek(URL_TAG, "test").route_table.match("/test/test1", "GET")
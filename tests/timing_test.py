@@ -0,0 +1,58 @@
+"""Test cases for the opt-in timing of request stages."""
+import asyncio
+
+from mock_server.timing import mark, SlowestRequests, StageTiming
+
+
+async def staged_app(scope, receive, send):
+    """Marks two stages, like the endpoints, then answers."""
+    mark(scope, "load")
+    await asyncio.sleep(float(scope["path"].strip("/")))
+    mark(scope, "latency")
+    scope["mock"] = ("timing-test", scope["path"])
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def call(app, path):
+    """Sends one GET request, returns the headers sent."""
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(10)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": []}
+    asyncio.run(app(scope, receive, send))
+    return dict(sent[0]["headers"])
+
+
+def test_server_timing_header():
+    """Every stage marked is sent in milliseconds with the total."""
+    header = call(StageTiming(staged_app), "/0.01")[b"server-timing"].decode()
+    stages = dict(metric.split(";dur=") for metric in header.split(", "))
+    assert list(stages) == ["load", "latency", "total"]
+    assert float(stages["latency"]) >= 10
+    assert float(stages["total"]) >= float(stages["latency"])
+
+
+def test_keeps_slowest_requests():
+    """Only the slowest requests are kept, slowest first."""
+    slowest = SlowestRequests(size=2)
+    app = StageTiming(staged_app, slowest=slowest)
+    for delay in ("0", "0.02", "0", "0.01", "0"):
+        call(app, "/" + delay)
+    requests = slowest.requests()
+    assert slowest.recorded == 5
+    assert [r["path"] for r in requests] == ["/0.02", "/0.01"]
+    assert [s for s, _ in requests[0]["stages"]] == ["load", "latency", "send"]
+    assert requests[0]["mock"] == "/0.02" and requests[0]["status"] == 200
+
+
+def test_mark_without_timer():
+    """Marking a stage of a request that is not timed does nothing."""
+    scope = {}
+    mark(scope, "load")
+    assert scope == {}
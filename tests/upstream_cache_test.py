@@ -0,0 +1,48 @@
+"""Test cases for the upstream response cache of url collections."""
+from types import SimpleNamespace
+
+from mock_server import upstream_cache
+from mock_server.upstream_cache import cache_key, compile_upstream, UpstreamCache
+
+COLLECTION = SimpleNamespace(id=1, version=3)
+
+
+def test_cache_key():
+    """Keys change with the body and headers but not their order or case."""
+    key = cache_key(COLLECTION, "POST", '{"a": 1}', {"A": "1", "b": "2"})
+    assert key == cache_key(COLLECTION, "POST", '{"a": 1}', {"b": "2", "a": "1"})
+    assert key != cache_key(COLLECTION, "POST", '{"a": 2}', {"A": "1", "b": "2"})
+    assert key != cache_key(COLLECTION, "POST", '{"a": 1}', {"A": "1"})
+    assert key != cache_key(SimpleNamespace(id=1, version=4), "POST", '{"a": 1}', {})
+
+
+def test_fresh_stale_and_expired(monkeypatch):
+    """Entries are fresh for the TTL, then stale, then gone."""
+    now = [100.0]
+    monkeypatch.setattr(upstream_cache.time, "monotonic", lambda: now[0])
+    cache = UpstreamCache(max_bytes=1024, stale=5)
+    compiled = compile_upstream(200, [(b"content-length", b"99")], b"body")
+    assert compiled.raw_headers == [(b"content-length", b"4")]
+    cache.store("key", compiled, 10)
+    assert cache.lookup("key") == (compiled, True)
+    now[0] = 112.0
+    assert cache.lookup("key") == (compiled, False)
+    assert cache.begin_refresh("key") and not cache.begin_refresh("key")
+    cache.end_refresh("key")
+    now[0] = 116.0
+    assert cache.lookup("key") is None
+    assert cache.stats()["bytes"] == 0
+    assert (cache.hits, cache.stale_hits, cache.misses) == (1, 1, 1)
+
+
+def test_byte_bounded_lru():
+    """The least recently used entries are evicted to stay under the bound."""
+    cache = UpstreamCache(max_bytes=100, max_entry_bytes=60)
+    for key in ("a", "b", "c"):
+        cache.store(key, compile_upstream(200, [], b"x" * 10), 60)
+    cache.lookup("a")
+    cache.store("d", compile_upstream(200, [], b"x" * 10), 60)
+    assert list(cache.entries) == ["c", "a", "d"]
+    assert cache.bytes <= 100 and cache.evictions == 1
+    cache.store("big", compile_upstream(200, [], b"x" * 70), 60)
+    assert "big" not in cache.entries
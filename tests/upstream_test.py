@@ -0,0 +1,136 @@
+"""Test cases for the pooled upstream client."""
+import asyncio
+import gzip
+from types import SimpleNamespace
+
+from aiohttp import web
+import pytest
+
+from mock_server import helpers
+from mock_server.upstream import forward_headers, StreamedResponse, UpstreamClient
+from tests.stand_in import run_on_new_loop, stand_in_upstream
+
+GZIPPED = gzip.compress(b"ok" * 1000)
+
+
+def run_with_upstream(test):
+    """Runs test(client, url) against a local stand-in upstream."""
+    peers = set()
+
+    async def handle(request):
+        peers.add(request.transport.get_extra_info("peername"))
+        if "slow" in request.query:
+            await asyncio.sleep(1)
+        if "gzip" in request.query:
+            return web.Response(
+                body=GZIPPED,
+                headers={"Content-Encoding": "gzip", "Connection": "keep-alive, X-Hop"},
+            )
+        if "missing" in request.query:
+            return web.Response(status=404, text="gone")
+        return web.Response(text="ok")
+
+    async def run():
+        async with stand_in_upstream([("/upstream", handle)]) as base:
+            client = UpstreamClient(limit_per_host=2, read_timeout=0.2)
+            try:
+                await test(client, base + "/upstream")
+            finally:
+                await client.close()
+
+    run_on_new_loop(run())
+    return peers
+
+
+def test_connections_are_reused():
+    """Sequential requests share one keep-alive connection."""
+
+    async def test(client, url):
+        for _ in range(5):
+            response = await client.request("GET", url)
+            async with response:
+                assert await response.text() == "ok"
+
+    peers = run_with_upstream(test)
+    assert len(peers) == 1
+
+
+def test_timeouts_are_counted():
+    """A slow upstream raises a timeout and shows up in the stats."""
+
+    async def test(client, url):
+        with pytest.raises(asyncio.TimeoutError):
+            response = await client.request("GET", url + "?slow=1")
+            async with response:
+                await response.read()
+        stats = client.stats()["hosts"]
+        assert len(stats) == 1
+        assert list(stats.values())[0]["timeouts"] == 1
+
+    run_with_upstream(test)
+
+
+def test_forward_headers():
+    """Hop-by-hop headers and the ones named in Connection are dropped."""
+    headers = forward_headers((
+        (b"Content-Type", b"text/plain"),
+        (b"Transfer-Encoding", b"chunked"),
+        (b"Connection", b"close, X-Hop"),
+        (b"X-Hop", b"1"),
+        (b"Set-Cookie", b"a=1"),
+        (b"Set-Cookie", b"b=2"),
+    ))
+    assert headers == [
+        (b"content-type", b"text/plain"),
+        (b"set-cookie", b"a=1"),
+        (b"set-cookie", b"b=2"),
+    ]
+
+
+def test_compressed_body_is_streamed_untouched():
+    """A gzipped upstream body reaches the client as is, with its length."""
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def test(client, url):
+        response = await client.request("GET", url + "?gzip=1")
+        await StreamedResponse(response)({}, None, send)
+        assert response.connection is None
+
+    run_with_upstream(test)
+    headers = dict(messages[0]["headers"])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"content-length"] == str(len(GZIPPED)).encode()
+    assert b"connection" not in headers and b"x-hop" not in headers
+    assert b"".join(m.get("body", b"") for m in messages[1:]) == GZIPPED
+    assert messages[-1]["more_body"] is False
+
+
+def test_collection_relays_upstream_status(monkeypatch):
+    """An upstream error status reaches the client, not a 200."""
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def test(client, url):
+        monkeypatch.setattr(helpers, "upstream_client", client)
+        collection = SimpleNamespace(
+            id=1, version=1, response_key=None, upstreams=None, cache_ttl=0
+        )
+        requests_new = {
+            "collection": collection,
+            "headers": {},
+            "body": None,
+            "url": url + "?missing=1",
+        }
+        response = await helpers.CollectionResponse(
+            requests_new, SimpleNamespace(method="GET", headers={})
+        )
+        await response({}, None, send)
+
+    run_with_upstream(test)
+    assert messages[0]["status"] == 404
+    assert b"".join(m.get("body", b"") for m in messages[1:]) == b"gone"
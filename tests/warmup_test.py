@@ -0,0 +1,32 @@
+"""Test cases for the startup warm-up of a worker."""
+import asyncio
+
+from mock_server.warmup import WarmUp
+
+
+def test_steps_retry_until_ready():
+    """Ready is only reported once every step succeeded."""
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("db is starting")
+        return 5
+
+    async def quick():
+        return 2
+
+    warm_up = WarmUp([("db_pool", flaky), ("mocks", quick)], retry_interval=0.01)
+    assert not warm_up.stats()["ready"]
+    asyncio.run(warm_up.run())
+    stats = warm_up.stats()
+    assert stats["ready"] and stats["seconds"] > 0
+    assert stats["steps"]["db_pool"]["attempts"] == 3
+    assert stats["steps"]["db_pool"]["count"] == 5
+    assert stats["steps"]["mocks"]["count"] == 2
+
+
+def test_no_steps_is_ready():
+    """A worker with the warm-up disabled is ready right away."""
+    assert WarmUp([]).stats()["ready"]